@@ -413,6 +413,22 @@ class CVSummaryProcessor:
 - File ZIP sudah berisi semua hasil termasuk presentasi
 
 """
+        
+        # Pemakaian AI (token & latency) dari process_all_documents_with_competency
+        ai_usage = df.attrs.get('ai_usage')
+        if ai_usage:
+            total = ai_usage['total']
+            report += f"""🤖 **Pemakaian AI:**
+- Request API: {total['api_calls']} (cache: {total['cache_hits']}, diminta ulang: {total['reasks']}, retry: {total['retries']})
+- Token: {total['input_tokens']:,} input / {total['output_tokens']:,} output
+- Latency: total {total['latency_total']:.1f} s, p50 {total['latency_p50']:.1f} s, p95 {total['latency_p95']:.1f} s
+"""
+            slowest = sorted(ai_usage['by_category'].items(), key=lambda item: -item[1]['latency_total'])[:3]
+            if slowest:
+                report += "- Kategori terberat: " + ", ".join(
+                    f"{name} ({stats['latency_total']:.1f} s, {stats['input_tokens']:,} token)" for name, stats in slowest
+                ) + "\n"
+        
         return report
     
     def get_zip_file(self):
@@ -1,18 +1,50 @@
 import os
 import glob
+import asyncio
 import re
+import math
+import unicodedata
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image, ImageEnhance, ImageFilter
 import time
+import random
+import shutil
+import tempfile
+import textwrap
+import subprocess
+import sqlite3
+import threading
+import contextvars
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Set
 import warnings
-from collections import defaultdict
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+from contextlib import closing
 from difflib import SequenceMatcher
 from dotenv import load_dotenv 
+from scipy.optimize import linear_sum_assignment
+
+# Optional: tesserocr memakai C API Tesseract langsung (engine tetap hangat, tanpa subprocess per halaman)
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Optional: rapidfuzz untuk kernel similarity nama (C++), fallback ke difflib
+try:
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+except ImportError:
+    rapidfuzz_fuzz = None
 
 warnings.filterwarnings('ignore')
 load_dotenv()
@@ -31,39 +63,293 @@ else:
     # Windows path for local development
     pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-# ========== TAMBAHKAN CACHING GLOBAL ==========
-# Dictionary untuk menyimpan hasil OCR agar tidak diproses ulang
-OCR_CACHE = {}
+# Backend OCR: "auto" (tesserocr jika terpasang), "tesserocr", atau "pytesseract"
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+USE_TESSEROCR = tesserocr is not None and OCR_ENGINE in ("auto", "tesserocr")
+if OCR_ENGINE == "tesserocr" and tesserocr is None:
+    print("⚠ OCR_ENGINE=tesserocr tetapi paket tesserocr tidak terpasang, memakai pytesseract")
+# Engine yang benar-benar dipakai (bagian dari key cache OCR: hasil teks kedua engine bisa berbeda)
+OCR_ENGINE_USED = "tesserocr" if USE_TESSEROCR else "pytesseract"
+
+# ========== CACHE OCR PERSISTEN ==========
+class PersistentCache:
+    """
+    Cache key-value di disk (value berupa JSON).
+    Penulisan atomic (tulis file sementara lalu rename), eviction LRU berdasarkan waktu akses
+    terakhir saat total ukuran melewati budget, serta counter hit/miss.
+    ttl_seconds (opsional): entry yang ditulis lebih lama dari ini dianggap kedaluwarsa.
+    Waktu akses (LRU) disimpan di atime, waktu tulis (TTL) di mtime file.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._bytes_since_prune = 0
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+    
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def get(self, key: str, track_stats: bool = True):
+        """
+        Ambil value dari cache, None jika tidak ada.
+        track_stats=False dipakai di worker process; hit/miss dicatat di parent via record_lookup.
+        """
+        path = self._path(key)
+        try:
+            written_at = os.path.getmtime(path)
+            if self._is_expired(written_at):
+                os.remove(path)
+                self._count('evictions')
+                raise FileNotFoundError(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # Tandai baru dipakai untuk LRU (mtime tetap = waktu tulis)
+            os.utime(path, (time.time(), written_at))
+        except (OSError, ValueError):
+            if track_stats:
+                self._count('misses')
+            return None
+        
+        if track_stats:
+            self._count('hits')
+        return value
+    
+    def _is_expired(self, written_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - written_at > self.ttl_seconds
+    
+    def record_lookup(self, hit: bool):
+        """Catat hasil lookup yang dilakukan di process lain"""
+        self._count('hits' if hit else 'misses')
+    
+    def set(self, key: str, value):
+        """Simpan value ke cache secara atomic"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_", suffix=".part")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"    ⚠ Gagal menulis cache ({e})")
+            return
+        
+        with self._lock:
+            self.writes += 1
+            self._bytes_since_prune += size
+            should_prune = self._bytes_since_prune > self.max_bytes // 10
+            if should_prune:
+                self._bytes_since_prune = 0
+        
+        if should_prune:
+            self.prune()
+    
+    def _entries(self) -> List[Tuple[float, int, str, float]]:
+        """List (waktu akses terakhir, ukuran, path, waktu tulis) semua entry cache"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path, stat.st_mtime))
+        return entries
+    
+    def prune(self):
+        """Hapus entry kedaluwarsa, lalu entry yang paling lama tidak dipakai sampai ukuran cache di bawah budget"""
+        entries = []
+        for entry in self._entries():
+            if self._is_expired(entry[3]):
+                try:
+                    os.remove(entry[2])
+                    self._count('evictions')
+                    continue
+                except OSError:
+                    pass
+            entries.append(entry)
+        
+        total = sum(size for _, size, _, _ in entries)
+        if total <= self.max_bytes:
+            return
+        
+        target = int(self.max_bytes * 0.9)
+        for _, size, path, _ in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count('evictions')
+    
+    def clear(self):
+        """Hapus seluruh isi cache"""
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.writes = self.evictions = 0
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+            }
+    
+    def __len__(self):
+        return len(self._entries())
+
+def _file_sha256(path: str) -> str:
+    """SHA-256 dari isi file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_cache_key(*parts) -> str:
+    """Key cache dari gabungan bagian-bagian (di-serialize sebagai JSON lalu di-hash)"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Cache hasil OCR di disk, key = SHA-256 isi PDF + parameter OCR
+# sehingga upload ulang file yang sama (walau path berbeda) tidak di-OCR lagi
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "512"))
+# Teks OCR berisi data pribadi (NIK, CV): kedaluwarsa sama dengan retensi roster (0 = tanpa kedaluwarsa)
+OCR_CACHE_TTL_DAYS = float(os.getenv("OCR_CACHE_TTL_DAYS", os.getenv("ROSTER_RETENTION_DAYS", "30")))
+OCR_CACHE_TTL_SECONDS = OCR_CACHE_TTL_DAYS * 86400 if OCR_CACHE_TTL_DAYS > 0 else None
+OCR_CACHE = PersistentCache(os.path.join(OCR_CACHE_DIR, "documents"), OCR_CACHE_MAX_MB * 1024 * 1024,
+                            ttl_seconds=OCR_CACHE_TTL_SECONDS)
+
+# Cache OCR per halaman, key = hash pixel halaman hasil render + parameter OCR.
+# Halaman boilerplate (cover, legend, rubrik) dan halaman CV yang tidak berubah cukup di-OCR sekali.
+OCR_PAGE_CACHE_MAX_MB = int(os.getenv("OCR_PAGE_CACHE_MAX_MB", "256"))
+OCR_PAGE_CACHE = PersistentCache(os.path.join(OCR_CACHE_DIR, "pages"), OCR_PAGE_CACHE_MAX_MB * 1024 * 1024,
+                                 ttl_seconds=OCR_CACHE_TTL_SECONDS)
+
+# Naikkan jika perubahan pipeline OCR membuat hasil lama tidak valid
+OCR_PIPELINE_VERSION = 1
+
+# Cache response Gemini di disk, key = hash model + generation config + versi prompt + prompt lengkap
+# (template + teks input), sehingga batch yang diulang dengan teks dan model sama tidak memanggil API lagi
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "128"))
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))  # 0 = tanpa kedaluwarsa
+LLM_CACHE = PersistentCache(
+    os.path.join(OCR_CACHE_DIR, "llm"),
+    LLM_CACHE_MAX_MB * 1024 * 1024,
+    ttl_seconds=LLM_CACHE_TTL_DAYS * 86400 if LLM_CACHE_TTL_DAYS > 0 else None
+)
+
+# Naikkan jika template prompt berubah secara makna agar response lama tidak dipakai lagi
+PROMPT_VERSION = 1
 
-def get_cached_ocr_text(pdf_path: str, use_cache: bool = True) -> Tuple[Optional[str], bool]:
+def _ocr_params(lang: str) -> Dict:
+    """Parameter OCR yang mempengaruhi hasil teks (bagian dari key cache)"""
+    return {
+        'version': OCR_PIPELINE_VERSION,
+        'engine': OCR_ENGINE_USED,
+        'lang': lang,
+        'dpi': 300,
+        'adaptive_dpi': OCR_ADAPTIVE_DPI,
+        'low_dpi': OCR_LOW_DPI,
+        'min_confidence': OCR_MIN_CONFIDENCE,
+        'psm': 6,
+        'max_pages': OCR_MAX_PAGES,
+        'text_layer': True,
+        'text_layer_min_chars': TEXT_LAYER_MIN_CHARS,
+        'text_layer_min_glyph_ratio': TEXT_LAYER_MIN_GLYPH_RATIO,
+        'blank_ink_ratio': OCR_BLANK_INK_RATIO,
+        'blank_confirm_ink_ratio': OCR_BLANK_CONFIRM_INK_RATIO,
+        'blank_confirm_dpi': OCR_BLANK_CONFIRM_DPI,
+        'ink_contrast': OCR_INK_CONTRAST,
+        'duplicate_max_distance': OCR_DUPLICATE_MAX_DISTANCE if OCR_NEAR_DUPLICATES else None,
+        'skip_blank_duplicates': OCR_SKIP_BLANK_DUPLICATES,
+        'near_duplicates': OCR_NEAR_DUPLICATES,
+        'preprocess': True,
+        'preprocess_mode': OCR_PREPROCESS_MODE,
+    }
+
+def _document_cache_key(pdf_path: str, lang: str) -> Optional[str]:
+    """Key cache OCR dokumen: SHA-256 isi PDF + parameter OCR (None jika file tidak terbaca)"""
+    try:
+        return make_cache_key('document', _file_sha256(pdf_path), _ocr_params(lang))
+    except OSError as e:
+        print(f"    ⚠ Tidak bisa membaca file untuk cache: {e}")
+        return None
+
+def get_cached_ocr_text(pdf_path: str, use_cache: bool = True, lang: str = 'ind') -> Tuple[Optional[str], bool]:
     """
     Mendapatkan teks dari cache atau melakukan OCR baru.
     Returns: (text, from_cache)
     """
-    if use_cache and pdf_path in OCR_CACHE:
-        return OCR_CACHE[pdf_path], True
+    cache_key = None
+    if use_cache:
+        cache_key = _document_cache_key(pdf_path, lang)
+        
+        if cache_key:
+            cached = OCR_CACHE.get(cache_key)
+            if cached is not None:
+                return cached['text'], True
     
     # Jika tidak ada di cache, lakukan OCR
-    text = pdf_to_text_ocr_advanced(pdf_path, lang='ind')
+    text = pdf_to_text_ocr_advanced(pdf_path, lang=lang)
     
     # Simpan ke cache
-    if use_cache and text:
-        OCR_CACHE[pdf_path] = text
+    if cache_key and text:
+        OCR_CACHE.set(cache_key, {'text': text, 'filename': os.path.basename(pdf_path)})
     
     return text, False
 
+def clear_llm_cache():
+    """Membersihkan cache response Gemini di disk"""
+    LLM_CACHE.clear()
+    LLM_CACHE.reset_stats()
+    print("✓ LLM cache cleared")
+
 def clear_ocr_cache():
-    """Membersihkan cache OCR"""
-    global OCR_CACHE
-    OCR_CACHE.clear()
+    """Membersihkan cache OCR (dokumen dan per halaman) di disk"""
+    for cache in (OCR_CACHE, OCR_PAGE_CACHE):
+        cache.clear()
+        cache.reset_stats()
     print("✓ OCR cache cleared")
 
+def format_cache_stats(cache: PersistentCache) -> str:
+    """Ringkasan counter cache untuk log"""
+    stats = cache.stats()
+    return f"{stats['hits']} hit, {stats['misses']} miss, {stats['evictions']} evicted"
+
 def verify_ocr_installation():
     """Verify that OCR engine is properly installed"""
     try:
         # Try to get tesseract version
         version = pytesseract.get_tesseract_version()
         print(f"✓ Tesseract OCR version: {version}")
+        print(f"✓ OCR engine: {'tesserocr (engine persisten)' if USE_TESSEROCR else 'pytesseract (subprocess)'}")
         return True
     except Exception as e:
         print(f"✗ Tesseract OCR not found or not accessible: {e}")
@@ -138,7 +424,7 @@ def read_excel_competency(excel_path: str, nik_column: str = 'nik', level_column
                 }
                 competencies_list.append(competency_dict)
             
-            competency_by_nik[str(nik)] = competencies_list
+            competency_by_nik[normalize_nik(nik) or str(nik)] = competencies_list
         
         print(f"Total NIK yang ditemukan dengan competency >= level {min_level}: {len(competency_by_nik)}")
         return competency_by_nik
@@ -147,7 +433,7 @@ def read_excel_competency(excel_path: str, nik_column: str = 'nik', level_column
         print(f"Error membaca Excel: {e}")
         return {}
 
-def format_competency_string(competencies_list: List[Dict]) -> str:
+def format_competency_string(competencies_list: List[Dict], bullet: str = "•\t") -> str:
     """
     Format list competency menjadi string dengan format yang diminta
     """
@@ -158,11 +444,74 @@ def format_competency_string(competencies_list: List[Dict]) -> str:
     for comp in competencies_list:
         comp_name = comp.get('competency', '')
         level = comp.get('level', 0)
-        formatted = f"•\t{comp_name} (Lvl. {level}/5)"
+        formatted = f"{bullet}{comp_name} (Lvl. {level}/5)"
         formatted_list.append(formatted)
     
     return "\n".join(formatted_list)
 
+def format_competency_local(competencies_list: List[Dict], max_items: int = 10, min_level: int = 2) -> str:
+    """
+    Formatter competency lokal (tanpa API) dengan aturan yang sama seperti prompt AI:
+    level >= min_level, urut level tertinggi (urutan Excel dipertahankan untuk level sama),
+    maksimal max_items, format "• [Nama Kompetensi] (Lvl. [X]/5)"
+    """
+    eligible = [comp for comp in competencies_list or [] if comp.get('level', 0) >= min_level]
+    eligible.sort(key=lambda comp: comp.get('level', 0), reverse=True)
+    return format_competency_string(eligible[:max_items], bullet="• ")
+
+# Pattern NIK berlabel; angka lepas tanpa label hanya dipakai jika cocok dengan NIK yang dikenal
+NIK_LABEL_PATTERNS = [
+    r'NIK\s*[:\.]?\s*(\d+)',
+    r'Nomor\s+Induk\s+Karyawan\s*[:\.]?\s*(\d+)',
+    r'Employee\s+ID\s*[:\.]?\s*(\d+)',
+    r'ID\s+Karyawan\s*[:\.]?\s*(\d+)',
+]
+NIK_CANDIDATE_PATTERN = r'(?<!\d)\d{5,20}(?!\d)'
+
+def normalize_nik(value) -> Optional[str]:
+    """NIK sebagai string digit (123456.0 dari Excel -> '123456'); None jika kosong atau bukan angka"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = re.sub(r'\.0+$', '', str(value).strip())
+    text = re.sub(r'[\s\.\-]', '', text)
+    return text if text.isdigit() else None
+
+def extract_nik_candidates(text: str) -> Tuple[List[str], List[str]]:
+    """
+    Kandidat NIK dari teks atau nama file.
+    Returns: (nik_berlabel, angka_lepas); angka lepas bisa saja nomor HP/ID lain
+    """
+    labeled, bare = [], []
+    for pattern in NIK_LABEL_PATTERNS:
+        for match in re.findall(pattern, text, re.IGNORECASE):
+            nik = normalize_nik(match)
+            if nik and nik not in labeled:
+                labeled.append(nik)
+    for match in re.findall(NIK_CANDIDATE_PATTERN, text):
+        if match not in labeled and match not in bare:
+            bare.append(match)
+    return labeled, bare
+
+def resolve_nik(labeled: List[str], bare: List[str], known_niks: Optional[Set[str]] = None,
+                require_known: bool = False) -> Optional[str]:
+    """
+    Pilih NIK: berlabel & dikenal > angka lepas & dikenal > berlabel pertama.
+    require_known=True: hanya NIK yang ada di known_niks (label "NIK:" di CV bisa saja NIK KTP 16 digit)
+    """
+    known_niks = known_niks or set()
+    for nik in labeled + bare:
+        if nik in known_niks:
+            return nik
+    if require_known:
+        return None
+    return labeled[0] if labeled else None
+
+def _nik_text_from_filename(filename: str) -> str:
+    """Nama file tanpa ekstensi, separator diganti spasi agar pattern NIK berlabel ikut cocok"""
+    return re.sub(r'[_\-]+', ' ', os.path.splitext(filename)[0])
+
 def extract_nik_and_name_from_text(text: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Mencoba ekstrak NIK dan Nama dari text assessment
@@ -172,13 +521,7 @@ def extract_nik_and_name_from_text(text: str) -> Tuple[Optional[str], Optional[s
     nama = None
     
     # Pattern untuk NIK
-    nik_patterns = [
-        r'NIK\s*[:\.]?\s*(\d+)',
-        r'Nomor\s+Induk\s+Karyawan\s*[:\.]?\s*(\d+)',
-        r'Employee\s+ID\s*[:\.]?\s*(\d+)',
-        r'ID\s+Karyawan\s*[:\.]?\s*(\d+)',
-        r'\b\d{8,15}\b'
-    ]
+    nik_patterns = NIK_LABEL_PATTERNS + [r'\b\d{8,15}\b']
     
     for pattern in nik_patterns:
         matches = re.findall(pattern, text, re.IGNORECASE)
@@ -215,13 +558,880 @@ def extract_nik_and_name_from_text(text: str) -> Tuple[Optional[str], Optional[s
     
     return nik, nama
 
-def generate_competency_with_ai(competencies_list: List[Dict]) -> str:
+# ========== GEMINI ASYNC ==========
+# Batas request Gemini yang berjalan bersamaan; semua kandidat berbagi batas ini.
+# Dengan GEMINI_ADAPTIVE_CONCURRENCY nilai ini hanya titik awal, batas aktual diatur AIMD
+# antara 1 dan GEMINI_MAX_CONCURRENCY_LIMIT.
+GEMINI_MAX_CONCURRENCY = max(1, int(os.getenv("GEMINI_MAX_CONCURRENCY", "6")))
+GEMINI_ADAPTIVE_CONCURRENCY = os.getenv("GEMINI_ADAPTIVE_CONCURRENCY", "1") == "1"
+GEMINI_MAX_CONCURRENCY_LIMIT = max(GEMINI_MAX_CONCURRENCY, int(os.getenv("GEMINI_MAX_CONCURRENCY_LIMIT", "32")))
+# Request dianggap sehat jika latency-nya <= faktor ini x median latency terakhir
+GEMINI_LATENCY_TOLERANCE = float(os.getenv("GEMINI_LATENCY_TOLERANCE", "2.0"))
+
+# Hedging: request yang melewati p95 latency dikirim ulang (opsional ke model cadangan),
+# response pertama yang berhasil dipakai. Budget = rasio maksimal request hedge per run.
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "1") == "1"
+GEMINI_HEDGE_BUDGET = float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL") or None
+
+# Budget quota per menit (0 = tanpa batas) dan kebijakan retry
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "0"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+
+# Error sementara yang layak dicoba ulang (429, 5xx, timeout)
+RETRYABLE_GEMINI_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    asyncio.TimeoutError,
+)
+
+# Satu event loop di background thread untuk semua request Gemini: client async Gemini (grpc.aio)
+# terikat ke loop tempat ia dibuat, jadi loop dipakai ulang alih-alih asyncio.run per kandidat
+_GEMINI_LOOP = None
+_GEMINI_LOOP_LOCK = threading.Lock()
+
+def _get_gemini_loop() -> asyncio.AbstractEventLoop:
+    global _GEMINI_LOOP
+    with _GEMINI_LOOP_LOCK:
+        if _GEMINI_LOOP is None or _GEMINI_LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-loop", daemon=True).start()
+            _GEMINI_LOOP = loop
+    return _GEMINI_LOOP
+
+def _run_coroutine_sync(coro):
+    """Jalankan coroutine di event loop Gemini bersama dan tunggu hasilnya (untuk kode sync)"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_gemini_loop()).result()
+
+class TokenBucket:
+    """Token bucket per menit: kapasitas = rate, terisi ulang kontinu. rate <= 0 berarti tanpa batas."""
+    
+    def __init__(self, per_minute: float):
+        self.rate = per_minute
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate / 60.0)
+        self._updated = now
+    
+    def wait_time(self, amount: float) -> float:
+        """Detik yang perlu ditunggu sampai amount token tersedia"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.rate)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) * 60.0 / self.rate
+    
+    def consume(self, amount: float):
+        """Ambil token; boleh negatif (hutang) jika pemakaian aktual melebihi perkiraan"""
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= amount
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    return isinstance(error, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted))
+
+class AdaptiveConcurrencyLimiter:
     """
-    Menggunakan AI untuk membuat Skills (Competency) dari data Excel
+    Batas konkurensi AIMD (additive increase, multiplicative decrease).
+    Naik ~1 slot per "putaran" request yang sehat (sukses dengan latency wajar) yang dimulai saat
+    semua slot terpakai (batas benar-benar menahan request), turun setengah saat kena rate limit. Penurunan hanya sekali per gelombang: 429 dari request yang dimulai
+    sebelum penurunan terakhir diabaikan. Dipakai dari satu event loop (tanpa lock thread).
     """
-    if not competencies_list:
-        return ""
     
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = GEMINI_MAX_CONCURRENCY_LIMIT,
+                 adaptive: bool = True, backoff_ratio: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._latencies = deque(maxlen=200)
+        self._last_decrease = 0.0
+        self._condition = None
+    
+    @property
+    def current_limit(self) -> int:
+        return max(self.minimum, int(self.limit))
+    
+    def _take_slot(self) -> SimpleNamespace:
+        self.in_flight += 1
+        return SimpleNamespace(started=time.monotonic(), saturated=self.in_flight >= self.current_limit)
+    
+    async def acquire(self) -> SimpleNamespace:
+        """Tunggu slot kosong. Returns: slot (waktu mulai + apakah batas penuh), diteruskan ke release"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            return self._take_slot()
+    
+    def try_acquire(self) -> Optional[SimpleNamespace]:
+        """Ambil slot tanpa menunggu (untuk request hedge). Returns: slot, None jika penuh"""
+        if self.in_flight >= self.current_limit:
+            return None
+        return self._take_slot()
+    
+    async def release(self, slot: SimpleNamespace, success: bool = True, rate_limited: bool = False):
+        """Lepas slot dan sesuaikan batas berdasarkan hasil request"""
+        started = slot.started
+        latency = time.monotonic() - started
+        if success:
+            healthy = not self._latencies or latency <= GEMINI_LATENCY_TOLERANCE * self.percentile(50)
+            self._latencies.append(latency)
+            # Batas yang tidak pernah terisi tidak terbukti aman untuk dinaikkan
+            if self.adaptive and healthy and slot.saturated:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        elif rate_limited and self.adaptive and started >= self._last_decrease:
+            self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+            self._last_decrease = time.monotonic()
+            print(f"    ⚠ Rate limit Gemini, konkurensi diturunkan ke {self.current_limit}")
+        
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+    
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+    
+    def percentile(self, q: float) -> float:
+        """Persentil latency (detik) dari request sukses terakhir, 0 jika belum ada"""
+        if not self._latencies:
+            return 0.0
+        return float(np.percentile(list(self._latencies), q))
+    
+    def stats(self) -> Dict:
+        return {
+            'limit': self.current_limit,
+            'in_flight': self.in_flight,
+            'latency_p50': self.percentile(50),
+            'latency_p90': self.percentile(90),
+            'latency_p95': self.percentile(95),
+            'latency_p99': self.percentile(99),
+        }
+
+# ========== BACKEND GEMINI (LIVE / RECORD / REPLAY) ==========
+# "live": API Gemini, "record": API Gemini + simpan pasangan request/response ke cassette,
+# "replay": jawab dari cassette secara lokal (tanpa jaringan) dengan latency/error sintetis
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "live").lower()
+GEMINI_CASSETTE = os.getenv("GEMINI_CASSETTE", "gemini_cassette.jsonl")
+# Latency replay dalam detik; "recorded" memakai latency saat direkam
+GEMINI_REPLAY_LATENCY = os.getenv("GEMINI_REPLAY_LATENCY", "recorded")
+GEMINI_REPLAY_JITTER = float(os.getenv("GEMINI_REPLAY_JITTER", "0.2"))
+GEMINI_REPLAY_ERROR_RATE = float(os.getenv("GEMINI_REPLAY_ERROR_RATE", "0"))
+GEMINI_REPLAY_TIMEOUT_RATE = float(os.getenv("GEMINI_REPLAY_TIMEOUT_RATE", "0"))
+# Request yang tidak ada di cassette: "error" atau "synthetic" (jawaban dummy, untuk load test)
+GEMINI_REPLAY_MISS = os.getenv("GEMINI_REPLAY_MISS", "error").lower()
+GEMINI_REPLAY_SEED = os.getenv("GEMINI_REPLAY_SEED")
+
+class CassetteMissError(Exception):
+    """Request tidak ditemukan di cassette replay"""
+
+class BackendResponse:
+    """Response minimal (text + usage_metadata) untuk backend non-live"""
+    
+    def __init__(self, text: str, usage: Optional[Dict] = None):
+        self.text = text
+        usage = usage or {}
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=usage.get('prompt_token_count', 0),
+            candidates_token_count=usage.get('candidates_token_count', 0),
+            total_token_count=usage.get('total_token_count', 0),
+        )
+
+def _usage_dict(response) -> Dict:
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        field: int(getattr(usage, field, 0) or 0)
+        for field in ('prompt_token_count', 'candidates_token_count', 'total_token_count')
+    }
+
+def _request_key(model_name: str, prompt: str, generation_config: Dict, safety_settings: Optional[List[Dict]]) -> str:
+    return make_cache_key('request', model_name, generation_config, safety_settings, prompt)
+
+class LiveGeminiBackend:
+    """Request langsung ke API Gemini"""
+    
+    async def generate(self, model_name: str, prompt: str, generation_config: Dict,
+                       safety_settings: Optional[List[Dict]] = None):
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+        return await model.generate_content_async(prompt)
+    
+    async def count_tokens(self, model_name: str, prompt: str) -> int:
+        response = await genai.GenerativeModel(model_name=model_name).count_tokens_async(prompt)
+        return int(response.total_tokens)
+
+class RecordingGeminiBackend:
+    """Teruskan ke backend lain dan tulis setiap response sukses ke cassette (JSONL, append)"""
+    
+    def __init__(self, cassette_path: str, inner=None):
+        self.cassette_path = cassette_path
+        self.inner = inner or LiveGeminiBackend()
+        self._lock = threading.Lock()
+    
+    async def generate(self, model_name: str, prompt: str, generation_config: Dict,
+                       safety_settings: Optional[List[Dict]] = None):
+        started = time.monotonic()
+        response = await self.inner.generate(model_name, prompt, generation_config, safety_settings)
+        record = {
+            'key': _request_key(model_name, prompt, generation_config, safety_settings),
+            'model': model_name,
+            'prompt_preview': prompt[:200],
+            'text': response.text,
+            'usage': _usage_dict(response),
+            'latency': round(time.monotonic() - started, 3),
+        }
+        with self._lock:
+            cassette_dir = os.path.dirname(self.cassette_path)
+            if cassette_dir:
+                os.makedirs(cassette_dir, exist_ok=True)
+            with open(self.cassette_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return response
+    
+    async def count_tokens(self, model_name: str, prompt: str) -> int:
+        return await self.inner.count_tokens(model_name, prompt)
+
+class ReplayGeminiBackend:
+    """
+    Jawab request dari cassette tanpa jaringan, untuk benchmark dan load test yang reproducible.
+    Latency sintetis (tetap atau sesuai rekaman, + jitter) dan injeksi error 429/timeout.
+    """
+    
+    def __init__(self, cassette_path: str, latency: str = GEMINI_REPLAY_LATENCY, jitter: float = GEMINI_REPLAY_JITTER,
+                 error_rate: float = GEMINI_REPLAY_ERROR_RATE, timeout_rate: float = GEMINI_REPLAY_TIMEOUT_RATE,
+                 miss: str = GEMINI_REPLAY_MISS, seed: Optional[str] = GEMINI_REPLAY_SEED):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.miss = miss
+        self._random = random.Random(seed)
+        self._records = defaultdict(list)
+        self._served = defaultdict(int)
+        
+        if os.path.exists(cassette_path):
+            with open(cassette_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records[record['key']].append(record)
+        print(f"✓ Replay Gemini dari {cassette_path}: {sum(len(r) for r in self._records.values())} response")
+    
+    def _delay(self, record: Optional[Dict]) -> float:
+        if self.latency == "recorded":
+            base = record['latency'] if record else 1.0
+        else:
+            base = float(self.latency)
+        return max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+    
+    async def generate(self, model_name: str, prompt: str, generation_config: Dict,
+                       safety_settings: Optional[List[Dict]] = None):
+        key = _request_key(model_name, prompt, generation_config, safety_settings)
+        records = self._records.get(key)
+        record = None
+        if records:
+            # Rekaman ganda untuk request yang sama diputar bergiliran
+            record = records[self._served[key] % len(records)]
+            self._served[key] += 1
+        
+        roll = self._random.random()
+        if roll < self.timeout_rate:
+            # Tidak pernah menjawab; timeout GeminiClient yang memutus
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self._delay(record))
+        if roll < self.timeout_rate + self.error_rate:
+            raise google_exceptions.ResourceExhausted("Injected 429 (replay)")
+        
+        if record is None:
+            if self.miss != "synthetic":
+                raise CassetteMissError(f"Request tidak ada di cassette ({model_name}, key {key[:12]})")
+            return BackendResponse(f"[replay] {prompt[:40]}")
+        return BackendResponse(record['text'], record.get('usage'))
+    
+    async def count_tokens(self, model_name: str, prompt: str) -> int:
+        return GeminiClient.estimate_tokens(prompt, {})
+
+def create_gemini_backend(mode: str = GEMINI_BACKEND, cassette_path: str = GEMINI_CASSETTE):
+    """Backend sesuai GEMINI_BACKEND: live, record, atau replay"""
+    if mode == "record":
+        return RecordingGeminiBackend(cassette_path)
+    if mode == "replay":
+        return ReplayGeminiBackend(cassette_path)
+    return LiveGeminiBackend()
+
+def set_gemini_backend(backend):
+    """Ganti backend GEMINI_CLIENT saat runtime (mis. replay untuk benchmark)"""
+    GEMINI_CLIENT.backend = backend
+
+class GeminiClient:
+    """
+    Wrapper request Gemini untuk seluruh process (semua sesi Gradio dan semua kandidat).
+    Semua request berjalan di satu event loop bersama, sehingga state limiter di sini
+    tidak perlu lock: batas konkurensi adaptif (AdaptiveConcurrencyLimiter), budget RPM/TPM
+    (token bucket), timeout per request, retry dengan exponential backoff + jitter
+    untuk error sementara, dan hedging untuk request yang melewati p95 latency.
+    Request dikirim lewat backend (live / record / replay, lihat create_gemini_backend).
+    """
+    
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY, rpm: int = GEMINI_RPM,
+                 tpm: int = GEMINI_TPM, max_retries: int = GEMINI_MAX_RETRIES, timeout: float = GEMINI_TIMEOUT,
+                 backend=None):
+        self.backend = backend or create_gemini_backend()
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency, adaptive=GEMINI_ADAPTIVE_CONCURRENCY)
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._acquire_lock = None
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.reset_hedge_budget()
+    
+    def reset_hedge_budget(self):
+        """Mulai budget hedge baru (per run); counter statistik tidak ikut di-reset"""
+        self.budget_requests = 0
+        self.budget_hedges = 0
+    
+    def stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'throttled_seconds': self.throttled_seconds,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            **self.limiter.stats(),
+        }
+    
+    @staticmethod
+    def estimate_tokens(prompt: str, generation_config: Dict) -> int:
+        """Perkiraan kasar token request: ~4 karakter per token input + batas output"""
+        return len(prompt) // 4 + int(generation_config.get("max_output_tokens", 0))
+    
+    async def _acquire_quota(self, tokens: int):
+        """Tunggu sampai budget RPM dan TPM cukup (FIFO antar request)"""
+        if self._acquire_lock is None:
+            self._acquire_lock = asyncio.Lock()
+        
+        async with self._acquire_lock:
+            while True:
+                delay = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+                if delay <= 0:
+                    self.request_bucket.consume(1)
+                    self.token_bucket.consume(tokens)
+                    return
+                self.throttled_seconds += delay
+                await asyncio.sleep(delay)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff dengan full jitter"""
+        return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+    
+    def _try_acquire_quota(self, tokens: int) -> bool:
+        """Ambil budget RPM/TPM hanya jika tersedia sekarang dan tidak ada request yang antre"""
+        if self._acquire_lock is not None and self._acquire_lock.locked():
+            return False
+        if self.request_bucket.wait_time(1) > 0 or self.token_bucket.wait_time(tokens) > 0:
+            return False
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(tokens)
+        return True
+    
+    def _hedge_delay(self) -> Optional[float]:
+        """Batas tunggu sebelum hedge (p95 latency), None jika hedging tidak aktif/budget habis"""
+        if not GEMINI_HEDGE_ENABLED or self.limiter.samples < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        if self.budget_hedges >= GEMINI_HEDGE_BUDGET * self.budget_requests:
+            return None
+        return self.limiter.percentile(95)
+    
+    async def _call(self, model_name: str, request: Dict):
+        return await asyncio.wait_for(self.backend.generate(model_name, **request), timeout=self.timeout)
+    
+    def _release_hedge_slot(self, slot: SimpleNamespace, task: asyncio.Future):
+        """
+        Done callback task hedge: lepas slot limiter-nya. Callback juga jalan jika task dibatalkan
+        sebelum sempat mulai, saat blok finally di dalam coroutine-nya tidak pernah dieksekusi.
+        """
+        error = None if task.cancelled() else task.exception()
+        asyncio.ensure_future(self.limiter.release(
+            slot, success=not task.cancelled() and error is None,
+            rate_limited=error is not None and _is_rate_limit_error(error)
+        ))
+    
+    async def _send(self, model_name: str, request: Dict, hedge_model_name: Optional[str] = None,
+                    estimated_tokens: int = 0, call_stats: Optional[Dict] = None):
+        """
+        Satu percobaan request. Jika belum selesai setelah p95 latency dan budget hedge masih ada,
+        request duplikat dikirim (ke hedge_model_name jika ada); response sukses pertama dipakai.
+        call_stats['model'] diisi model yang benar-benar menjawab.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._call(model_name, request)
+        
+        primary = asyncio.ensure_future(self._call(model_name, request))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            
+            hedge_slot = self.limiter.try_acquire()
+            if hedge_slot is None:
+                return await primary
+            if not self._try_acquire_quota(estimated_tokens):
+                await self.limiter.release(hedge_slot, success=False)
+                return await primary
+            
+            self.hedges += 1
+            self.requests += 1
+            self.budget_hedges += 1
+            self.budget_requests += 1
+            if call_stats is not None:
+                call_stats['hedged'] = True
+            hedge = asyncio.ensure_future(self._call(hedge_model_name or model_name, request))
+            hedge.add_done_callback(lambda task: self._release_hedge_slot(hedge_slot, task))
+            pending = {primary, hedge}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                            if call_stats is not None:
+                                call_stats['model'] = hedge_model_name or model_name
+                        return task.result()
+                    if first_error is None or task is primary:
+                        first_error = task.exception()
+            raise first_error
+        finally:
+            # Termasuk saat pemanggil dibatalkan selama menunggu: jangan tinggalkan request tanpa penunggu
+            for task in pending:
+                task.cancel()
+    
+    async def count_tokens(self, prompt: str) -> Optional[int]:
+        """Preflight jumlah token input (None jika gagal); tidak memakai budget RPM/TPM"""
+        try:
+            return await asyncio.wait_for(self.backend.count_tokens(GEMINI_MODEL, prompt), timeout=self.timeout)
+        except Exception as e:
+            print(f"    ⚠ count_tokens gagal: {e}")
+            return None
+    
+    async def generate(self, prompt: str, generation_config: Dict, safety_settings: List[Dict] = None,
+                       call_stats: Optional[Dict] = None):
+        """
+        Kirim request dengan rate limit dan retry.
+        call_stats (opsional) diisi jumlah retry dan apakah request di-hedge.
+        Returns: response Gemini; error non-retryable atau retry habis dilempar ke pemanggil.
+        """
+        if call_stats is None:
+            call_stats = {}
+        call_stats.setdefault('retries', 0)
+        call_stats.setdefault('hedged', False)
+        call_stats.setdefault('model', GEMINI_MODEL)
+        request = {'prompt': prompt, 'generation_config': generation_config, 'safety_settings': safety_settings}
+        estimated_tokens = self.estimate_tokens(prompt, generation_config)
+        
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_quota(estimated_tokens)
+            self.requests += 1
+            self.budget_requests += 1
+            slot = await self.limiter.acquire()
+            try:
+                response = await self._send(GEMINI_MODEL, request, GEMINI_HEDGE_MODEL, estimated_tokens, call_stats)
+            except RETRYABLE_GEMINI_ERRORS as e:
+                await self.limiter.release(slot, success=False, rate_limited=_is_rate_limit_error(e))
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                call_stats['retries'] += 1
+                delay = self._backoff_delay(attempt)
+                print(f"    ⚠ Gemini {type(e).__name__}, retry {attempt + 1}/{self.max_retries} dalam {delay:.1f} s")
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                await self.limiter.release(slot, success=False)
+                raise
+            except Exception:
+                await self.limiter.release(slot, success=False)
+                self.failures += 1
+                raise
+            
+            await self.limiter.release(slot)
+            
+            # Koreksi budget TPM dengan pemakaian aktual jika tersedia
+            usage = getattr(response, 'usage_metadata', None)
+            total_tokens = getattr(usage, 'total_token_count', 0) if usage is not None else 0
+            if total_tokens:
+                self.token_bucket.consume(total_tokens - estimated_tokens)
+            return response
+
+GEMINI_CLIENT = GeminiClient()
+
+GEMINI_RUN_COUNTERS = ('requests', 'retries', 'failures', 'throttled_seconds', 'hedges', 'hedge_wins')
+
+def format_gemini_stats(since: Optional[Dict] = None) -> str:
+    """
+    Ringkasan counter GeminiClient untuk log.
+    since: snapshot GEMINI_CLIENT.stats() di awal run; counter dilaporkan sebagai selisihnya
+    (client dipakai bersama semua sesi, jadi counter-nya tidak di-reset per run).
+    """
+    stats = GEMINI_CLIENT.stats()
+    if since:
+        stats.update({key: stats[key] - since.get(key, 0) for key in GEMINI_RUN_COUNTERS})
+    return (f"{stats['requests']} request, {stats['retries']} retry, {stats['failures']} gagal, "
+            f"{stats['throttled_seconds']:.1f} s menunggu rate limit, {stats['hedges']} hedge "
+            f"({stats['hedge_wins']} lebih cepat), konkurensi {stats['limit']}, "
+            f"latency p50 {stats['latency_p50']:.1f} s / p90 {stats['latency_p90']:.1f} s / p99 {stats['latency_p99']:.1f} s")
+
+# ========== AKUNTANSI TOKEN & LATENCY AI ==========
+# Preflight count_tokens sebelum setiap request (menambah satu panggilan ringan per request)
+GEMINI_COUNT_TOKENS = os.getenv("GEMINI_COUNT_TOKENS", "0") == "1"
+
+# Tag (candidate, category, ...) untuk setiap request; ikut tersalin ke task asyncio anak
+_AI_CALL_TAGS = contextvars.ContextVar('ai_call_tags', default={})
+
+def set_ai_call_tags(**tags):
+    """Tambahkan tag untuk request AI berikutnya di task asyncio ini (dan task anaknya)"""
+    _AI_CALL_TAGS.set({**_AI_CALL_TAGS.get(), **tags})
+
+class AIUsageTracker:
+    """
+    Catatan per request AI (token, latency, retry, cache hit) dan agregasinya per kategori/kandidat.
+    Tracker dipakai bersama semua sesi dan tidak di-reset: tiap run mengambil mark() di awal
+    dan melaporkan request sejak mark tersebut.
+    """
+    
+    # Request terlama dibuang agar memory proses yang hidup lama tetap terbatas
+    MAX_CALLS = 50000
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = deque(maxlen=self.MAX_CALLS)
+        self._recorded = 0
+    
+    def record(self, **fields):
+        call = {'candidate': '-', 'category': '-', **_AI_CALL_TAGS.get(), **fields}
+        with self._lock:
+            self.calls.append(call)
+            self._recorded += 1
+    
+    def mark(self) -> int:
+        """Posisi saat ini (jumlah request yang pernah dicatat), untuk calls_since/summary"""
+        with self._lock:
+            return self._recorded
+    
+    def calls_since(self, mark: int = 0) -> List[Dict]:
+        with self._lock:
+            dropped = self._recorded - len(self.calls)
+            return list(self.calls)[max(0, mark - dropped):]
+    
+    @staticmethod
+    def _aggregate(calls: List[Dict]) -> Dict:
+        api_latencies = [call['latency'] for call in calls if not call.get('cache_hit')]
+        return {
+            'calls': len(calls),
+            'api_calls': len(api_latencies),
+            'cache_hits': sum(1 for call in calls if call.get('cache_hit')),
+            'reasks': sum(1 for call in calls if call.get('reask')),
+            'errors': sum(1 for call in calls if call.get('error')),
+            'retries': sum(call.get('retries', 0) for call in calls),
+            'hedged': sum(1 for call in calls if call.get('hedged')),
+            'input_tokens': sum(call.get('input_tokens', 0) for call in calls),
+            'output_tokens': sum(call.get('output_tokens', 0) for call in calls),
+            'preflight_tokens': sum(call.get('preflight_tokens') or 0 for call in calls),
+            'latency_total': sum(api_latencies),
+            'latency_p50': float(np.percentile(api_latencies, 50)) if api_latencies else 0.0,
+            'latency_p95': float(np.percentile(api_latencies, 95)) if api_latencies else 0.0,
+        }
+    
+    def summary(self, since: int = 0) -> Dict:
+        """Agregat request sejak mark since (default: semua yang masih tersimpan)"""
+        calls = self.calls_since(since)
+        
+        by_category = defaultdict(list)
+        by_candidate = defaultdict(list)
+        for call in calls:
+            by_category[call['category']].append(call)
+            by_candidate[call['candidate']].append(call)
+        
+        return {
+            'total': self._aggregate(calls),
+            'by_category': {key: self._aggregate(value) for key, value in by_category.items()},
+            'by_candidate': {key: self._aggregate(value) for key, value in by_candidate.items()},
+        }
+    
+    def write_report(self, base_path: str, since: int = 0) -> Tuple[str, str]:
+        """
+        Tulis laporan run (request sejak mark since): <base_path>_ai_usage.txt (ringkasan) dan
+        <base_path>_ai_usage.json (ringkasan + detail per request). Returns: (txt_path, json_path)
+        """
+        calls = self.calls_since(since)
+        summary = self.summary(since)
+        
+        txt_path = f"{base_path}_ai_usage.txt"
+        json_path = f"{base_path}_ai_usage.json"
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(format_ai_usage_report(summary))
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': GEMINI_MODEL, 'summary': summary, 'calls': calls}, f, ensure_ascii=False, indent=2)
+        return txt_path, json_path
+
+AI_USAGE = AIUsageTracker()
+
+def _format_usage_row(name: str, stats: Dict) -> str:
+    return (f"{name[:28]:<28} {stats['calls']:>5} {stats['api_calls']:>5} {stats['cache_hits']:>5} "
+            f"{stats['reasks']:>5} {stats['retries']:>5} {stats['input_tokens']:>9} {stats['output_tokens']:>8} "
+            f"{stats['latency_total']:>8.1f} {stats['latency_p50']:>6.1f} {stats['latency_p95']:>6.1f}")
+
+def format_ai_usage_report(summary: Dict) -> str:
+    """Tabel token dan latency per kategori, per kandidat, dan total batch"""
+    header = (f"{'':<28} {'call':>5} {'api':>5} {'cache':>5} {'ulang':>5} {'retry':>5} "
+              f"{'token in':>9} {'tok out':>8} {'lat (s)':>8} {'p50':>6} {'p95':>6}")
+    lines = [f"LAPORAN PEMAKAIAN AI ({GEMINI_MODEL})", "", "Per kategori:", header]
+    for name, stats in sorted(summary['by_category'].items(), key=lambda item: -item[1]['latency_total']):
+        lines.append(_format_usage_row(name, stats))
+    lines += ["", "Per kandidat:", header]
+    for name, stats in sorted(summary['by_candidate'].items(), key=lambda item: -item[1]['latency_total']):
+        lines.append(_format_usage_row(name, stats))
+    lines += ["", "Total batch:", header, _format_usage_row("TOTAL", summary['total'])]
+    return "\n".join(lines) + "\n"
+
+def _llm_cache_key(prompt: str, generation_config: Dict, safety_settings: Optional[List[Dict]]) -> str:
+    return make_cache_key('llm', GEMINI_MODEL, PROMPT_VERSION, generation_config, safety_settings, prompt)
+
+async def generate_gemini_text_async(prompt: str, generation_config: Dict, safety_settings: List[Dict] = None,
+                                     use_cache: bool = True) -> str:
+    """
+    Satu request Gemini async lewat GEMINI_CLIENT (rate limit, retry, timeout).
+    Response tidak kosong disimpan di LLM_CACHE; use_cache=False (atau LLM_CACHE_ENABLED=0)
+    selalu memanggil API dan tidak menulis cache.
+    Returns: teks response ("" jika kosong)
+    """
+    # Cache hanya untuk backend live: mode record harus sampai ke API, mode replay tidak boleh mengisi cache
+    use_cache = use_cache and LLM_CACHE_ENABLED and isinstance(GEMINI_CLIENT.backend, LiveGeminiBackend)
+    started = time.monotonic()
+    cache_key = None
+    if use_cache:
+        cache_key = _llm_cache_key(prompt, generation_config, safety_settings)
+        cached = LLM_CACHE.get(cache_key)
+        if cached is not None:
+            AI_USAGE.record(cache_hit=True, latency=time.monotonic() - started)
+            return cached['text']
+    
+    preflight_tokens = await GEMINI_CLIENT.count_tokens(prompt) if GEMINI_COUNT_TOKENS else None
+    call_stats = {}
+    try:
+        response = await GEMINI_CLIENT.generate(prompt, generation_config, safety_settings, call_stats)
+    except Exception:
+        AI_USAGE.record(error=True, latency=time.monotonic() - started, preflight_tokens=preflight_tokens, **call_stats)
+        raise
+    
+    usage = _usage_dict(response)
+    AI_USAGE.record(
+        latency=time.monotonic() - started,
+        input_tokens=usage['prompt_token_count'],
+        output_tokens=usage['candidates_token_count'],
+        preflight_tokens=preflight_tokens,
+        **call_stats
+    )
+    
+    text = response.text.strip() if response.text else ""
+    # Jawaban dari GEMINI_HEDGE_MODEL tidak disimpan di bawah key GEMINI_MODEL
+    if cache_key and text and call_stats.get('model') == GEMINI_MODEL:
+        LLM_CACHE.set(cache_key, {'text': text, 'model': GEMINI_MODEL})
+    return text
+
+# ========== VALIDASI OUTPUT AI ==========
+# Berapa kali field yang tetap tidak valid setelah perbaikan lokal diminta ulang ke Gemini
+GEMINI_VALIDATION_RETRIES = int(os.getenv("GEMINI_VALIDATION_RETRIES", "2"))
+
+# Counter kumulatif proses; laporan run memakai selisih terhadap snapshot di awal run (counter_delta)
+VALIDATION_STATS = {'invalid': 0, 'repaired': 0, 'reasked': 0, 'failed': 0}
+
+def counter_delta(counters: Dict, since: Optional[Dict] = None) -> Dict:
+    """Selisih counter kumulatif terhadap snapshot awal run (snapshot = dict(counters))"""
+    since = since or {}
+    return {key: value - since.get(key, 0) for key, value in counters.items()}
+
+_PREAMBLE_RE = re.compile(
+    r'^\s*(berikut|berdasarkan|dari teks|top\s*\d|here\s+(is|are)|based on|sure|tentu|baik,|output\s*:)',
+    re.IGNORECASE
+)
+_COMPETENCY_LINE_RE = re.compile(r'^• \S.*\(Lvl\. [1-5]/5\)$')
+
+def _non_empty_lines(text: str) -> List[str]:
+    return [line.strip() for line in text.split("\n") if line.strip()]
+
+def _is_preamble(lines: List[str]) -> bool:
+    """
+    Baris pertama dianggap preamble hanya jika berakhir ":" atau masih diikuti baris isi;
+    jawaban satu paragraf yang kebetulan diawali "Berdasarkan ..." adalah isi, bukan preamble
+    """
+    if not lines or not _PREAMBLE_RE.match(lines[0]):
+        return False
+    return lines[0].rstrip().endswith(':') or len(lines) > 1
+
+def validate_ai_field(category: str, text: str) -> List[str]:
+    """
+    Cek aturan format prompt secara lokal.
+    Returns: daftar pelanggaran (kosong jika valid)
+    """
+    issues = []
+    lines = _non_empty_lines(text)
+    if not lines:
+        return ["jawaban kosong"]
+    
+    if _is_preamble(lines):
+        issues.append("jangan ada kalimat pembuka/preamble, langsung ke isi")
+    if '*' in text:
+        issues.append("jangan gunakan tanda bintang")
+    
+    if category == 'business_impact':
+        bullets = [line for line in lines if line.startswith('•')]
+        if len(bullets) != 5 or len(lines) != 5:
+            issues.append(f"harus tepat 5 baris bullet '• ', bukan {len(bullets)} bullet dari {len(lines)} baris")
+        if any(len(line.lstrip('• ').split()) > 10 for line in bullets):
+            issues.append("setiap bullet maksimal 5-6 kata")
+    elif category == 'experience':
+        total_lines = len(text.strip().split("\n"))
+        if total_lines > 16:
+            issues.append(f"maksimal 16 baris, bukan {total_lines}")
+    elif category == 'position':
+        if len(lines) != 1 or len(lines[0].split()) > 10:
+            issues.append("hanya satu baris berisi nama posisi")
+    elif category == 'education':
+        if len(lines) != 1:
+            issues.append("satu baris saja, gelar dipisahkan ' | '")
+        if any(line.startswith(('•', '-')) for line in lines):
+            issues.append("jangan gunakan poin-poin")
+    elif category == 'summary_executive':
+        if any(line.startswith(('•', '-')) for line in lines):
+            issues.append("jangan gunakan poin-poin")
+    elif category == 'skills_competency':
+        if '\t' in text:
+            issues.append("jangan gunakan tab setelah bullet point, cukup satu spasi")
+        invalid = [line for line in lines if not _COMPETENCY_LINE_RE.match(line.replace('\t', ' '))]
+        if invalid:
+            issues.append("setiap baris harus berformat '• [Nama Kompetensi] (Lvl. [X]/5)'")
+        if len(lines) > 10:
+            issues.append(f"maksimal 10 kompetensi, bukan {len(lines)}")
+    
+    return issues
+
+def repair_ai_field(category: str, text: str) -> str:
+    """
+    Perbaikan lokal yang aman: buang preamble, tanda bintang, tab setelah bullet.
+    Jawaban yang tidak kosong tidak pernah diperbaiki menjadi kosong.
+    """
+    original = text.strip()
+    content = _non_empty_lines(original)
+    # Baris isi terakhir tidak pernah dibuang sebagai preamble
+    preamble = 0
+    while preamble < len(content) - 1 and _is_preamble(content[preamble:]):
+        preamble += 1
+    lines = original.split("\n")
+    while preamble:
+        if lines.pop(0).strip():
+            preamble -= 1
+    text = "\n".join(lines).strip()
+    text = text.replace('**', '').replace('*', '')
+    text = re.sub(r'^•[ \t]+', '• ', text, flags=re.MULTILINE)
+    if category in ('business_impact', 'skills_competency'):
+        # Bullet lain ("-", "·") diseragamkan ke "• "
+        text = re.sub(r'^[-·●▪][ \t]+', '• ', text, flags=re.MULTILINE)
+    return text.strip() or original
+
+def _reask_prompt(prompt: str, previous: str, issues: List[str]) -> str:
+    return (prompt + "\n\nJawaban sebelumnya:\n" + previous +
+            "\n\nJawaban tersebut melanggar aturan berikut: " + "; ".join(issues) +
+            ". Berikan ulang jawaban lengkap yang memenuhi semua aturan dan format output di atas.")
+
+async def generate_validated_text_async(category: str, prompt: str, generation_config: Dict,
+                                        safety_settings: List[Dict] = None, use_cache: bool = True,
+                                        fallback: Optional[str] = None) -> str:
+    """
+    Request Gemini untuk satu field lalu validasi lokal. Field yang tidak valid diperbaiki
+    lokal dulu; jika masih melanggar, hanya field ini yang diminta ulang
+    (maksimal GEMINI_VALIDATION_RETRIES kali).
+    Returns: teks valid; jika retry habis, fallback (jika ada) atau kandidat tidak kosong
+    dengan pelanggaran paling sedikit
+    """
+    text = await generate_gemini_text_async(prompt, generation_config, safety_settings, use_cache=use_cache)
+    
+    issues = validate_ai_field(category, text)
+    if not issues:
+        return text
+    VALIDATION_STATS['invalid'] += 1
+    
+    repaired = repair_ai_field(category, text)
+    issues = validate_ai_field(category, repaired)
+    if not issues:
+        VALIDATION_STATS['repaired'] += 1
+        return repaired
+    best, best_issues = repaired, issues
+    
+    set_ai_call_tags(reask=True)
+    for attempt in range(1, GEMINI_VALIDATION_RETRIES + 1):
+        print(f"    ⚠ {category} tidak valid ({'; '.join(issues)}), minta ulang {attempt}/{GEMINI_VALIDATION_RETRIES}")
+        VALIDATION_STATS['reasked'] += 1
+        text = await generate_gemini_text_async(
+            _reask_prompt(prompt, text, issues), generation_config, safety_settings, use_cache=use_cache
+        )
+        repaired = repair_ai_field(category, text)
+        issues = validate_ai_field(category, repaired)
+        if not issues:
+            return repaired
+        if repaired and (not best or len(issues) < len(best_issues)):
+            best, best_issues = repaired, issues
+    
+    VALIDATION_STATS['failed'] += 1
+    if fallback:
+        print(f"    ⚠ {category} tetap tidak valid ({'; '.join(best_issues)}), memakai format lokal")
+        return fallback
+    print(f"    ⚠ {category} tetap tidak valid ({'; '.join(best_issues)}), hasil terbaik dipakai")
+    return best
+
+def format_validation_stats(stats: Dict) -> str:
+    return (f"{stats['invalid']} field tidak valid, {stats['repaired']} diperbaiki lokal, "
+            f"{stats['reasked']} diminta ulang, {stats['failed']} tetap gagal")
+
+COMPETENCY_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+def _competency_prompt(competencies_list: List[Dict]) -> str:
     # Format data competency untuk AI
     competency_data = "\n".join([
         f"- {comp['competency']} (Level {comp['level']}/5)"
@@ -252,300 +1462,1350 @@ def generate_competency_with_ai(competencies_list: List[Dict]) -> str:
 
         Output:"""
     
+    return prompt
+
+async def generate_competency_with_ai_async(competencies_list: List[Dict], use_cache: bool = True) -> str:
+    """
+    Menggunakan AI untuk membuat Skills (Competency) dari data Excel
+    """
+    if not competencies_list:
+        return ""
+    
+    set_ai_call_tags(category='skills_competency')
     try:
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config={
-                "temperature": 0.2,
-                "top_p": 0.8,
-                "top_k": 40,
-                "max_output_tokens": 1024,
-            }
+        text = await generate_validated_text_async(
+            'skills_competency', _competency_prompt(competencies_list), COMPETENCY_GENERATION_CONFIG,
+            use_cache=use_cache, fallback=format_competency_local(competencies_list)
         )
         
-        response = model.generate_content(prompt)
-        
-        if response.text:
-            return response.text.strip()
+        if text:
+            return text
         else:
             # Fallback ke format manual
-            return format_competency_string(competencies_list[:11])
+            return format_competency_local(competencies_list)
             
     except Exception as e:
         print(f"    Error generating competency with AI: {e}")
         # Fallback ke format manual
-        return format_competency_string(competencies_list[:11])
+        return format_competency_local(competencies_list)
 
-def analyze_with_gemini_advanced(text_content: str, competency_data: List[Dict] = None, categories: List[str] = ['education', 'experience', 'business_impact', 'position', 'summary_executive', 'skills_competency']) -> Dict:
-    """
-    Menggunakan Gemini AI untuk menganalisis teks dan mengekstrak informasi
-    """
-    
-    results = {}
+# ========== FORMAT COMPETENCY (AI / BATCH / LOKAL) ==========
+# "ai": satu request per kandidat, "batch": banyak kandidat per request (JSON per NIK),
+# "local": formatter deterministik tanpa API
+COMPETENCY_FORMAT_MODE = os.getenv("COMPETENCY_FORMAT_MODE", "ai").lower()
+COMPETENCY_BATCH_SIZE = max(1, int(os.getenv("COMPETENCY_BATCH_SIZE", "25")))
+
+COMPETENCY_BATCH_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+
+def _competency_batch_prompt(competency_by_nik: Dict[str, List[Dict]]) -> str:
+    candidates = "\n\n".join(
+        f"NIK {nik}:\n" + "\n".join(f"- {comp['competency']} (Level {comp['level']}/5)" for comp in competencies)
+        for nik, competencies in competency_by_nik.items()
+    )
     
-    prompts = {
-        'education': """
-        Dari teks CV/penilaian berikut, ekstrak informasi tentang pendidikan dalam Bahasa Indonesia:
-        1. Gelar pendidikan tertinggi
-        2. Institusi pendidikan
-        3. Tahun lulus
-        4. Jurusan/field study
-        5. Jika terdapat lebih dari satu gelar, maka tampilan harus berupa S1 terlebih dahulu baru S2 jika ada S2, dan seterusnya.
-        
-        PERHATIKAN Format output yang diharapkan karena harus sesuai, dan bukan bentuk lain: "S1 Teknik Informatika, ITB | S2 Master of Business Administration, ITB"
-        Tampilkan seluruh gelar yang sudah diraih sesuai dengan informasi yang diberikan.
-        Jika institusi tidak diberikan, berikan Gelar lalu program studi saja.
-        Jangan gunakan bintang atau poin-poin, langsung format string seperti contoh.
-        Selalu berikan output sesuai dengan template pada contoh.
-        
-        Teks yang akan dianalisis:
-        """,
-        
-        'experience': """
-        Dari teks CV/penilaian berikut, ekstrak informasi tentang pengalaman kerja dalam Bahasa Indonesia:
-        Ambil 4 posisi jabatan terakhir saja.
-        
-        Format output yang diharapkan:
-        Direktur Commercial
-        PT Telekomunikasi Selular
-        2021 – Saat ini
-        
-        Head of Human Capital Management 
-        PT Finnet Indonesia
-        2020 – 2021
-        
-        VP Human Capital Management 
-        PT Jalin Pembayaran Nusantara 
-        2018 – 2020
-        
-        SO Human Capital
-        PT Jalin Pembayaran Nusantara
-        2017 – 2018
-        
-        Jangan ada preambles pada awal jawaban jadi langsung pada 4 posisi jabatan terakhirnya, jangan gunakan bintang untuk poin-poinnya, jangan tampilkan reasoning, langsung format seperti contoh dan untuk setiap posisi jabatan pergunakan huruf kapital diawalnya saja misal SO Human Capital serta nama companynya juga huruf awalnya saja untuk huruf PT tetap besar misal PT Telkom Indonesia
-        Jika terdapat jabatan yang sama persis secara BERURUTAN, tidak perlu diulang, gabungkan saja menjadi satu dan kemudian berikan range waktu yang sesuai dengan yang ada.
-        PENTING: Teks total hanya bisa menggunakaan 16 BARIS SAJA. Jangan berikan lebih dari 16 baris. 
-        Teks yang akan dianalisis:
-        """,
-        
-        'business_impact': """
-        Dari teks CV/penilaian berikut, identifikasi potensi dampak bisnis dalam Bahasa Inggris:
-        Ambil top 5 business impact.
+    return f"""Untuk setiap NIK di bawah ini, format kompetensi kandidat dari data competency Excel dalam Bahasa Indonesia.
+Jawab dalam satu objek JSON: key = NIK, value = string hasil format untuk NIK tersebut.
 
-        ATURAN SANGAT PENTING:
-        - DILARANG KERAS menulis: "Berikut adalah", "Berdasarkan teks", "Top 5", atau penjelasan apapun
-        - LANGSUNG mulai dengan bullet point pertama
-        - HARUS tepat 5 poin
-        - Format: • [Dampak bisnis]
-        - Hanya kalimat singkat pada dampak bisnis saja dan HANYA berupa 5-6 kata saja, tanpa tambahan konteks atau penjelasan lainnya jadi to the point saja pada business impactnya
-        
-        Format output yang diharapkan:
-        • Led a major organizational transformation project
-        • Enhanced Total Rewards framework
-        • Established, updated, and standardized Human Capital policies
-        • Revamped Procurement policies and procedures
-        • Redesigned and enhanced workplace areas
-        
-        Jangan ada preambles atau penjelasan pada awal response seperti "Berikut adalah top 5 potensi dampak bisnis yang diidentifikasi dari teks CV/penilaian:" hilangkan dan tidak usah digunakan saja jadi response jawaban seperti itu sehingga langsung ke poin-poin business impactnya.
-        
-        Teks yang akan dianalisis:
-        """,
-        
-        'position': """
-        Dari teks CV/penilaian berikut, identifikasi POSISI TERAKHIR/JABATAN TERAKHIR dalam Bahasa Indonesia:
-        Hanya ambil satu posisi terakhir saja.
-        
-        Contoh output:
-        Direktur Commercial
-        
-        atau
-        
-        Head of Human Capital Management
-        
-        Hanya berikan jawaban singkat nama posisinya saja, tanpa penjelasan tambahan.
-        
-        Teks yang akan dianalisis:
-        """,
-        
-        'summary_executive': """
-        Dari teks CV dan Assessment berikut, buatlah Summary Executive profesional dalam Bahasa Indonesia.
+ATURAN SANGAT PENTING (berlaku untuk setiap NIK):
+1. Urutkan dari level tertinggi ke terendah
+2. Hanya ambil kompetensi dengan level >= 2
+3. Format setiap baris: • [Nama Kompetensi] (Lvl. [X]/5) hanya berikan spasi setelah bullet point, tanpa tab
+4. Maksimal 10 kompetensi, pisahkan baris dengan baris baru
+5. Jangan ada penjelasan tambahan, langsung ke poin-poin
+
+Contoh value:
+• Career Planning & Succession Management (Lvl. 4/5)
+• Human Capital Strategy (Lvl. 4/5)
+• Talent Scouting & Acquisition (Lvl. 2/5)
+
+Data Competency:
+{candidates}
+"""
+
+async def _generate_competency_chunk_async(chunk: Dict[str, List[Dict]], use_cache: bool) -> Dict[str, str]:
+    set_ai_call_tags(category='competency_batch', candidate=f"batch competency ({len(chunk)} kandidat)")
+    generation_config = dict(COMPETENCY_BATCH_GENERATION_CONFIG)
+    generation_config["response_schema"] = {
+        "type": "object",
+        "properties": {nik: {"type": "string"} for nik in chunk},
+        "required": list(chunk),
+    }
+    
+    try:
+        text = await generate_gemini_text_async(
+            _competency_batch_prompt(chunk), generation_config, use_cache=use_cache
+        )
+        parsed = _parse_structured_response(text, list(chunk))
+    except Exception as e:
+        print(f"    Error generating competency batch with AI: {e}")
+        parsed = {}
+    
+    results = {}
+    for nik, competencies in chunk.items():
+        value = repair_ai_field('skills_competency', parsed.get(nik, ""))
+        if validate_ai_field('skills_competency', value):
+            # Field hilang/tidak valid: formatter lokal (tanpa request tambahan)
+            value = format_competency_local(competencies)
+        results[nik] = value
+    return results
+
+async def generate_competency_batch_async(competency_by_nik: Dict[str, List[Dict]],
+                                          use_cache: bool = True) -> Dict[str, str]:
+    """
+    Format competency banyak kandidat sekaligus: COMPETENCY_BATCH_SIZE kandidat per request,
+    output JSON per NIK. NIK yang hilang/tidak valid di response memakai format_competency_local.
+    Returns: dict NIK -> string competency
+    """
+    items = [(nik, competencies) for nik, competencies in competency_by_nik.items() if competencies]
+    chunks = [dict(items[i:i + COMPETENCY_BATCH_SIZE]) for i in range(0, len(items), COMPETENCY_BATCH_SIZE)]
+    if chunks:
+        print(f"  Memformat competency {len(items)} kandidat dalam {len(chunks)} request Gemini...")
+    
+    results = {}
+    for chunk_result in await asyncio.gather(*[_generate_competency_chunk_async(chunk, use_cache) for chunk in chunks]):
+        results.update(chunk_result)
+    return results
+
+async def format_competencies_async(competencies_list: List[Dict], mode: Optional[str] = None,
+                                    use_cache: bool = True) -> str:
+    """
+    Format competency satu kandidat sesuai mode (default COMPETENCY_FORMAT_MODE).
+    Mode batch diproses di generate_competency_batch_async; kandidat yang tidak ikut batch
+    (mis. NIK baru ditemukan dari Assessment) memakai request per kandidat.
+    """
+    if not competencies_list:
+        return ""
+    if (mode or COMPETENCY_FORMAT_MODE) == "local":
+        return format_competency_local(competencies_list)
+    return await generate_competency_with_ai_async(competencies_list, use_cache)
+
+def generate_competency_with_ai(competencies_list: List[Dict], use_cache: bool = True) -> str:
+    """
+    Menggunakan AI untuk membuat Skills (Competency) dari data Excel
+    """
+    return _run_coroutine_sync(generate_competency_with_ai_async(competencies_list, use_cache))
+
+ANALYSIS_PROMPTS = {
+    'education': """
+    Dari teks CV/penilaian berikut, ekstrak informasi tentang pendidikan dalam Bahasa Indonesia:
+    1. Gelar pendidikan tertinggi
+    2. Institusi pendidikan
+    3. Tahun lulus
+    4. Jurusan/field study
+    5. Jika terdapat lebih dari satu gelar, maka tampilan harus berupa S1 terlebih dahulu baru S2 jika ada S2, dan seterusnya.
+    
+    PERHATIKAN Format output yang diharapkan karena harus sesuai, dan bukan bentuk lain: "S1 Teknik Informatika, ITB | S2 Master of Business Administration, ITB"
+    Tampilkan seluruh gelar yang sudah diraih sesuai dengan informasi yang diberikan.
+    Jika institusi tidak diberikan, berikan Gelar lalu program studi saja.
+    Jangan gunakan bintang atau poin-poin, langsung format string seperti contoh.
+    Selalu berikan output sesuai dengan template pada contoh.
+    
+    Teks yang akan dianalisis:
+    """,
+    
+    'experience': """
+    Dari teks CV/penilaian berikut, ekstrak informasi tentang pengalaman kerja dalam Bahasa Indonesia:
+    Ambil 4 posisi jabatan terakhir saja.
+    
+    Format output yang diharapkan:
+    Direktur Commercial
+    PT Telekomunikasi Selular
+    2021 – Saat ini
+    
+    Head of Human Capital Management 
+    PT Finnet Indonesia
+    2020 – 2021
+    
+    VP Human Capital Management 
+    PT Jalin Pembayaran Nusantara 
+    2018 – 2020
+    
+    SO Human Capital
+    PT Jalin Pembayaran Nusantara
+    2017 – 2018
+    
+    Jangan ada preambles pada awal jawaban jadi langsung pada 4 posisi jabatan terakhirnya, jangan gunakan bintang untuk poin-poinnya, jangan tampilkan reasoning, langsung format seperti contoh dan untuk setiap posisi jabatan pergunakan huruf kapital diawalnya saja misal SO Human Capital serta nama companynya juga huruf awalnya saja untuk huruf PT tetap besar misal PT Telkom Indonesia
+    Jika terdapat jabatan yang sama persis secara BERURUTAN, tidak perlu diulang, gabungkan saja menjadi satu dan kemudian berikan range waktu yang sesuai dengan yang ada.
+    PENTING: Teks total hanya bisa menggunakaan 16 BARIS SAJA. Jangan berikan lebih dari 16 baris. 
+    Teks yang akan dianalisis:
+    """,
+    
+    'business_impact': """
+    Dari teks CV/penilaian berikut, identifikasi potensi dampak bisnis dalam Bahasa Inggris:
+    Ambil top 5 business impact.
+
+    ATURAN SANGAT PENTING:
+    - DILARANG KERAS menulis: "Berikut adalah", "Berdasarkan teks", "Top 5", atau penjelasan apapun
+    - LANGSUNG mulai dengan bullet point pertama
+    - HARUS tepat 5 poin
+    - Format: • [Dampak bisnis]
+    - Hanya kalimat singkat pada dampak bisnis saja dan HANYA berupa 5-6 kata saja, tanpa tambahan konteks atau penjelasan lainnya jadi to the point saja pada business impactnya
+    
+    Format output yang diharapkan:
+    • Led a major organizational transformation project
+    • Enhanced Total Rewards framework
+    • Established, updated, and standardized Human Capital policies
+    • Revamped Procurement policies and procedures
+    • Redesigned and enhanced workplace areas
+    
+    Jangan ada preambles atau penjelasan pada awal response seperti "Berikut adalah top 5 potensi dampak bisnis yang diidentifikasi dari teks CV/penilaian:" hilangkan dan tidak usah digunakan saja jadi response jawaban seperti itu sehingga langsung ke poin-poin business impactnya.
+    
+    Teks yang akan dianalisis:
+    """,
+    
+    'position': """
+    Dari teks CV/penilaian berikut, identifikasi POSISI TERAKHIR/JABATAN TERAKHIR dalam Bahasa Indonesia:
+    Hanya ambil satu posisi terakhir saja.
+    
+    Contoh output:
+    Direktur Commercial
+    
+    atau
+    
+    Head of Human Capital Management
+    
+    Hanya berikan jawaban singkat nama posisinya saja, tanpa penjelasan tambahan.
+    
+    Teks yang akan dianalisis:
+    """,
+    
+    'summary_executive': """
+    Dari teks CV dan Assessment berikut, buatlah Summary Executive profesional dalam Bahasa Indonesia.
+    
+    Persyaratan:
+    1. Panjang: 3-5 kalimat
+    2. Highlight: Posisi terakhir, pengalaman tahun, keahlian utama, pencapaian signifikan
+    3. Tone: Profesional dan ringkas
+    4. Fokus pada value dan kontribusi kandidat
+    5. Hasil summary berupa maksimal 4 baris dan tidak lebih.
+    
+    Contoh format:
+    "Profesional berpengalaman 15+ tahun di bidang Human Capital Management dengan track record memimpin transformasi organisasi di perusahaan telekomunikasi dan fintech. Saat ini menjabat sebagai Direktur Commercial di PT Telekomunikasi Selular, sebelumnya sebagai Head of Human Capital Management di PT Finnet Indonesia. Memiliki keahlian kuat dalam strategic planning, talent management, dan organizational development. Sukses mengimplementasikan SAP-Based HCIS dan meningkatkan employee engagement hingga 85%. Pendidikan S2 Master of Business Administration dari ITB dengan spesialisasi Strategic Management."
+    
+    Jangan ada preambles, langsung summary executive-nya.
+    Jangan gunakan bintang simbol lainnya, langsung format string seperti contoh.
+    Gunakan font normal dan bukan bold atau italic atau lainnya.
+    
+    Teks yang akan dianalisis:
+    """,
+    
+    'skills_competency': """
+    Dari data competency Excel berikut, identifikasi dan format kompetensi kandidat dalam Bahasa Indonesia. Ambil maksimal 10 kompetensi dengan level minimal 2.
+
+    ATURAN SANGAT PENTING:
+    1. Urutkan dari level tertinggi ke terendah
+    2. Hanya ambil kompetensi dengan level >= 2
+    3. Format: • [Nama Kompetensi] (Lvl. [X]/5) hanya berikan spasi setelah bullet point
+    4. Maksimal 10 kompetensi
+    5. Jangan ada penjelasan tambahan, langsung ke poin-poin
+    6. jangan gunakan \t setelah bullet point, cukup spasi saja jadi bullet pointnya seperti ini "• Career Planning & Succession Management (Lvl. 4/5)" tanpa tab setelah bullet pointnya
+
+    Format output yang diharapkan (urutkan dari level tertinggi ke terendah):
+    • Career Planning & Succession Management (Lvl. 4/5)
+    • Employee Performance Management (Lvl. 4/5)
+    • Human Capital Strategy (Lvl. 4/5)
+    • Industrial Relations Management (Lvl. 3/5)
+    • Learning Management & Development (Lvl. 3/5)
+    • Organization Planning & Development (Lvl. 3/5)
+    • Talent Scouting & Acquisition (Lvl. 2/5)
+
+    Output:
+    """
+}
+
+ANALYSIS_GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+# Kategori profil kandidat yang dianalisis dari teks CV + Assessment
+PROFILE_CATEGORIES = ['education', 'experience', 'business_impact', 'position', 'summary_executive']
+
+# ========== SEGMENTASI SEKSI DOKUMEN ==========
+# Setiap prompt kategori hanya menerima seksi yang relevan (bukan seluruh CV + Assessment)
+GEMINI_SECTION_CONTEXT = os.getenv("GEMINI_SECTION_CONTEXT", "1") == "1"
+
+# Konteks hasil seleksi yang lebih pendek dari ini dianggap segmentasi gagal -> pakai seluruh teks
+SECTION_CONTEXT_MIN_CHARS = int(os.getenv("SECTION_CONTEXT_MIN_CHARS", "50"))
+# ... begitu juga jika kurang dari fraksi ini terhadap dokumen asal seksi tersebut
+SECTION_CONTEXT_MIN_RATIO = float(os.getenv("SECTION_CONTEXT_MIN_RATIO", "0.1"))
+
+# Pola judul seksi: seluruh baris harus berupa frasa judul (boleh diberi nomor/bullet di depan dan
+# titik dua di belakang). Seksi "other" hanya menutup seksi sebelumnya.
+SECTION_HEADING_PATTERNS = {
+    'education': r'(riwayat\s+)?pendidikan|education(al)?(\s+background)?|academic|kualifikasi\s+akademik',
+    'experience': r'(riwayat\s+|pengalaman\s+)?(pekerjaan|jabatan|karir|karier)|pengalaman(\s+kerja)?|'
+                  r'(work|professional|employment|career)\s+(experience|history)|experience',
+    'achievements': r'prestasi|pencapaian|penghargaan|achievements?|accomplishments?|awards?|'
+                    r'key\s+results?|proyek|projects?',
+    'other': r'keahlian|skills?|kompetensi|competenc(y|ies)|pelatihan|training|sertifikasi|certifications?|'
+             r'organisasi|organi[sz]ations?|bahasa|languages?|referensi|references?|data\s+pribadi|'
+             r'personal\s+(data|information)|hobi|interests?|kesimpulan|rekomendasi|saran',
+}
+_SECTION_HEADING_RES = {
+    section: re.compile(rf'^[\W\d]*(?:{pattern})\s*:?\s*$', re.IGNORECASE)
+    for section, pattern in SECTION_HEADING_PATTERNS.items()
+}
+
+# Seksi yang dikirim untuk tiap kategori; kategori yang tidak ada di sini selalu memakai seluruh teks
+CATEGORY_SECTIONS = {
+    'education': ['header', 'education'],
+    'experience': ['header', 'experience'],
+    'position': ['header', 'experience'],
+    'business_impact': ['experience', 'achievements'],
+}
+
+def _match_section_heading(line: str) -> Optional[str]:
+    line = line.strip()
+    if not line or len(line) > 60 or len(line.split()) > 6:
+        return None
+    for section, pattern in _SECTION_HEADING_RES.items():
+        if pattern.match(line):
+            return section
+    return None
+
+def segment_document_sections(text_content: str) -> List[Tuple[str, str, str]]:
+    """
+    Pecah teks OCR gabungan ("=== CV === ... === ASSESSMENT === ...") menjadi seksi.
+    Teks sebelum judul seksi pertama dalam tiap dokumen menjadi seksi "header".
+    Returns: list (label dokumen, nama seksi, teks)
+    """
+    sections = []
+    label, section, lines = "", 'header', []
+    
+    def _flush():
+        body = "\n".join(lines).strip()
+        if body:
+            sections.append((label, section, body))
+    
+    for line in text_content.split("\n"):
+        document_label = re.match(r'^=== (.+) ===$', line.strip())
+        if document_label:
+            _flush()
+            label, section, lines = document_label.group(1), 'header', []
+            continue
         
-        Persyaratan:
-        1. Panjang: 3-5 kalimat
-        2. Highlight: Posisi terakhir, pengalaman tahun, keahlian utama, pencapaian signifikan
-        3. Tone: Profesional dan ringkas
-        4. Fokus pada value dan kontribusi kandidat
-        5. Hasil summary berupa maksimal 4 baris dan tidak lebih.
+        heading = _match_section_heading(line)
+        # Judul dengan jenis yang sama (mis. "Pengalaman Kerja" lalu "Riwayat Jabatan") tidak memotong seksi
+        if heading and heading != section:
+            _flush()
+            section, lines = heading, []
+        lines.append(line)
+    _flush()
+    
+    return sections
+
+def _context_for_category(category: str, text_content: str) -> str:
+    """Teks yang dikirim ke prompt kategori: seksi relevan saja, atau seluruh teks sebagai fallback"""
+    wanted = CATEGORY_SECTIONS.get(category)
+    if not GEMINI_SECTION_CONTEXT or not wanted:
+        return text_content
+    
+    sections = segment_document_sections(text_content)
+    # Header saja berarti judul seksi yang dicari tidak ditemukan
+    if not any(section in wanted and section != 'header' for _, section, _ in sections):
+        return text_content
+    
+    selected = defaultdict(list)
+    source_chars = defaultdict(int)
+    for label, section, body in sections:
+        source_chars[label] += len(body)
+        if section in wanted:
+            selected[label].append(body)
+    
+    context = "\n\n".join(
+        (f"=== {label} ===\n" if label else "") + "\n\n".join(bodies)
+        for label, bodies in selected.items()
+    )
+    # Seksi yang jauh lebih kecil dari dokumen asalnya biasanya tanda judul palsu memotong seksi
+    source_length = sum(source_chars[label] for label in selected)
+    if len(context) < SECTION_CONTEXT_MIN_CHARS or len(context) < SECTION_CONTEXT_MIN_RATIO * source_length:
+        return text_content
+    return context
+
+def _truncate_analysis_text(text_content: str) -> str:
+    max_text_length = 30000
+    return text_content[:max_text_length] + "..." if len(text_content) > max_text_length else text_content
+
+def _build_analysis_prompt(category: str, text_content: str, competency_data: List[Dict] = None) -> Optional[str]:
+    """Prompt lengkap untuk satu kategori; None jika data untuk kategori tersebut tidak ada"""
+    # Special handling untuk skills_competency
+    if category == 'skills_competency':
+        if not competency_data:
+            return None
         
-        Contoh format:
-        "Profesional berpengalaman 15+ tahun di bidang Human Capital Management dengan track record memimpin transformasi organisasi di perusahaan telekomunikasi dan fintech. Saat ini menjabat sebagai Direktur Commercial di PT Telekomunikasi Selular, sebelumnya sebagai Head of Human Capital Management di PT Finnet Indonesia. Memiliki keahlian kuat dalam strategic planning, talent management, dan organizational development. Sukses mengimplementasikan SAP-Based HCIS dan meningkatkan employee engagement hingga 85%. Pendidikan S2 Master of Business Administration dari ITB dengan spesialisasi Strategic Management."
+        # Format competency data untuk prompt
+        competency_list = "Data Competency:\n"
+        for comp in competency_data:
+            comp_name = comp.get('competency', '')
+            level = comp.get('level', 0)
+            competency_list += f"- {comp_name} (Level {level}/5)\n"
         
-        Jangan ada preambles, langsung summary executive-nya.
-        Jangan gunakan bintang simbol lainnya, langsung format string seperti contoh.
-        Gunakan font normal dan bukan bold atau italic atau lainnya.
+        # Replace placeholder dengan data actual
+        return ANALYSIS_PROMPTS[category].replace('{competency_list}', competency_list)
+    
+    return ANALYSIS_PROMPTS[category] + "\n\n" + _truncate_analysis_text(_context_for_category(category, text_content))
+
+async def _analyze_category_async(category: str, text_content: str, competency_data: List[Dict] = None,
+                                  use_cache: bool = True) -> str:
+    print(f"  Menganalisis {category} dengan Gemini AI...")
+    set_ai_call_tags(category=category)
+    
+    try:
+        full_prompt = _build_analysis_prompt(category, text_content, competency_data)
+        if full_prompt is None:
+            print(f"    ⚠ Tidak ada data competency, menggunakan fallback")
+            return ""
         
-        Teks yang akan dianalisis:
-        """,
+        text = await generate_validated_text_async(
+            category, full_prompt, ANALYSIS_GENERATION_CONFIG, GEMINI_SAFETY_SETTINGS, use_cache=use_cache
+        )
+        return text if text else "Tidak dapat menganalisis dengan AI"
         
-        'skills_competency': """
-        Dari data competency Excel berikut, identifikasi dan format kompetensi kandidat dalam Bahasa Indonesia. Ambil maksimal 10 kompetensi dengan level minimal 2.
+    except Exception as e:
+        print(f"    Error dalam analisis Gemini untuk {category}: {e}")
+        return f"Error: {str(e)}"
 
-        ATURAN SANGAT PENTING:
-        1. Urutkan dari level tertinggi ke terendah
-        2. Hanya ambil kompetensi dengan level >= 2
-        3. Format: • [Nama Kompetensi] (Lvl. [X]/5) hanya berikan spasi setelah bullet point
-        4. Maksimal 10 kompetensi
-        5. Jangan ada penjelasan tambahan, langsung ke poin-poin
-        6. jangan gunakan \t setelah bullet point, cukup spasi saja jadi bullet pointnya seperti ini "• Career Planning & Succession Management (Lvl. 4/5)" tanpa tab setelah bullet pointnya
+# ========== ANALISIS TERSTRUKTUR (SATU REQUEST) ==========
+# "per_category": satu request per kategori (default)
+# "structured": dokumen dikirim sekali, semua kategori profil dijawab dalam satu response JSON
+GEMINI_ANALYSIS_MODE = os.getenv("GEMINI_ANALYSIS_MODE", "per_category").lower()
 
-        Format output yang diharapkan (urutkan dari level tertinggi ke terendah):
-        • Career Planning & Succession Management (Lvl. 4/5)
-        • Employee Performance Management (Lvl. 4/5)
-        • Human Capital Strategy (Lvl. 4/5)
-        • Industrial Relations Management (Lvl. 3/5)
-        • Learning Management & Development (Lvl. 3/5)
-        • Organization Planning & Development (Lvl. 3/5)
-        • Talent Scouting & Acquisition (Lvl. 2/5)
+STRUCTURED_GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 4096,
+    "response_mime_type": "application/json",
+}
 
-        Output:
-        """
-    }
+def _structured_instruction(category: str) -> str:
+    """Instruksi kategori tanpa penutup "Teks yang akan dianalisis:" (teks dikirim sekali di akhir)"""
+    instruction = textwrap.dedent(ANALYSIS_PROMPTS[category]).strip()
+    return re.sub(r'\s*Teks yang akan dianalisis:\s*$', '', instruction).strip()
+
+def _build_structured_prompt(categories: List[str], text_content: str) -> str:
+    sections = "\n\n".join(f"### Field \"{category}\"\n{_structured_instruction(category)}" for category in categories)
+    prompt = f"""Analisis teks CV/penilaian di bawah ini dan jawab dalam satu objek JSON.
+Setiap field JSON berisi string yang mengikuti instruksi dan format output field tersebut persis
+seperti jika ditanyakan terpisah (termasuk baris baru dan bullet point). Jangan tambahkan field lain.
+
+{sections}
+
+Teks yang akan dianalisis:
+"""
+    return prompt + "\n\n" + _truncate_analysis_text(text_content)
+
+def _parse_structured_response(text: str, categories: List[str]) -> Dict:
+    """Ambil field yang valid (string tidak kosong) dari response JSON; field lain diabaikan"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
     
-    generation_config = {
-        "temperature": 0.3,
-        "top_p": 0.8,
-        "top_k": 40,
-        "max_output_tokens": 1024,
+    return {
+        category: data[category].strip()
+        for category in categories
+        if isinstance(data.get(category), str) and data[category].strip()
+    }
+
+async def _analyze_structured_async(text_content: str, categories: List[str], use_cache: bool = True) -> Dict:
+    """
+    Satu request Gemini dengan response schema JSON untuk semua kategori.
+    Returns: dict kategori -> teks, hanya untuk field yang berhasil diparse
+    """
+    print(f"  Menganalisis {', '.join(categories)} dengan satu request Gemini (JSON)...")
+    set_ai_call_tags(category='structured')
+    generation_config = dict(STRUCTURED_GENERATION_CONFIG)
+    generation_config["response_schema"] = {
+        "type": "object",
+        "properties": {category: {"type": "string"} for category in categories},
+        "required": list(categories),
     }
-    
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    ]
     
     try:
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+        text = await generate_gemini_text_async(
+            _build_structured_prompt(categories, text_content), generation_config, GEMINI_SAFETY_SETTINGS,
+            use_cache=use_cache
         )
     except Exception as e:
-        print(f"Error inisialisasi model Gemini: {e}")
-        for category in categories:
-            results[category] = f"Error inisialisasi model: {str(e)}"
-        return results
-    
-    for category in categories:
-        if category in prompts:
-            print(f"  Menganalisis {category} dengan Gemini AI...")
-            
+        print(f"    Error dalam analisis Gemini terstruktur: {e}")
+        return {}
+    
+    parsed = {}
+    for category, value in _parse_structured_response(text, categories).items():
+        value = repair_ai_field(category, value)
+        if not validate_ai_field(category, value):
+            parsed[category] = value
+    missing = [category for category in categories if category not in parsed]
+    if missing:
+        print(f"    ⚠ Field JSON tidak valid/kosong/melanggar format: {', '.join(missing)}, memakai prompt per kategori")
+    return parsed
+
+async def analyze_with_gemini_async(text_content: str, competency_data: List[Dict] = None,
+                                    categories: List[str] = PROFILE_CATEGORIES + ['skills_competency'],
+                                    mode: Optional[str] = None, use_cache: bool = True) -> Dict:
+    """
+    Versi async analyze_with_gemini_advanced: semua kategori dikirim bersamaan,
+    dibatasi GEMINI_MAX_CONCURRENCY.
+    mode (default GEMINI_ANALYSIS_MODE): "structured" mengirim dokumen sekali untuk semua
+    kategori teks; field yang gagal diparse diulang dengan prompt per kategori.
+    use_cache=False melewati cache response Gemini.
+    """
+    categories = [category for category in categories if category in ANALYSIS_PROMPTS]
+    results = {}
+    
+    text_categories = [category for category in categories if category != 'skills_competency']
+    if (mode or GEMINI_ANALYSIS_MODE) == "structured" and len(text_categories) > 1:
+        results = await _analyze_structured_async(text_content, text_categories, use_cache)
+    
+    remaining = [category for category in categories if category not in results]
+    texts = await asyncio.gather(*[
+        _analyze_category_async(category, text_content, competency_data, use_cache)
+        for category in remaining
+    ])
+    results.update(zip(remaining, texts))
+    
+    return {category: results[category] for category in categories}
+
+def analyze_with_gemini_advanced(text_content: str, competency_data: List[Dict] = None, categories: List[str] = ['education', 'experience', 'business_impact', 'position', 'summary_executive', 'skills_competency'],
+                                 use_cache: bool = True) -> Dict:
+    """
+    Menggunakan Gemini AI untuk menganalisis teks dan mengekstrak informasi.
+    Request per kategori berjalan bersamaan (lihat analyze_with_gemini_async).
+    """
+    return _run_coroutine_sync(analyze_with_gemini_async(text_content, competency_data, categories, use_cache=use_cache))
+
+async def analyze_candidate_async(text_content: str, competencies: List[Dict] = None,
+                                  categories: List[str] = PROFILE_CATEGORIES,
+                                  use_cache: bool = True,
+                                  skills_competency: Optional[str] = None,
+                                  candidate: Optional[str] = None) -> Tuple[Dict, str]:
+    """
+    Semua request AI untuk satu kandidat (kategori profil + competency) sekaligus,
+    sehingga latency per kandidat kira-kira sama dengan satu request terlama.
+    skills_competency: hasil format competency yang sudah ada (mode batch), tanpa request lagi.
+    candidate: label kandidat untuk laporan pemakaian AI.
+    Returns: (ai_analysis, skills_competency)
+    """
+    if candidate:
+        set_ai_call_tags(candidate=candidate)
+    
+    if skills_competency is not None:
+        ai_analysis = await analyze_with_gemini_async(text_content, categories=categories, use_cache=use_cache)
+        return ai_analysis, skills_competency
+    
+    ai_analysis, skills_competency = await asyncio.gather(
+        analyze_with_gemini_async(text_content, categories=categories, use_cache=use_cache),
+        format_competencies_async(competencies or [], use_cache=use_cache)
+    )
+    return ai_analysis, skills_competency
+
+# ========== OCR PARALEL PER HALAMAN ==========
+# Jumlah worker process untuk OCR; default sebanyak core CPU
+OCR_MAX_WORKERS = max(1, int(os.getenv("OCR_MAX_WORKERS", str(os.cpu_count() or 1))))
+
+# Batas halaman per dokumen; memory per halaman tetap flat sehingga batas ini bisa dinaikkan
+OCR_MAX_PAGES = max(1, int(os.getenv("OCR_MAX_PAGES", "10")))
+
+# Adaptive DPI: OCR dulu di resolusi rendah, render ulang di DPI penuh hanya untuk
+# halaman dengan rata-rata confidence di bawah ambang batas
+OCR_ADAPTIVE_DPI = os.getenv("OCR_ADAPTIVE_DPI", "1") == "1"
+OCR_LOW_DPI = int(os.getenv("OCR_LOW_DPI", "150"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+
+# Folder render sementara. Default tmpfs (/dev/shm) agar tidak menyentuh disk, tetapi hanya jika ruang kosongnya
+# minimal OCR_RENDER_MIN_FREE_MB (di container /dev/shm sering hanya 64 MB); selain itu temp dir disk
+OCR_RENDER_DIR = os.getenv("OCR_RENDER_DIR") or None
+OCR_RENDER_TMPFS = "/dev/shm"
+OCR_RENDER_MIN_FREE_MB = int(os.getenv("OCR_RENDER_MIN_FREE_MB", "256"))
+# Diset jika render di tmpfs pernah gagal (mis. ENOSPC): render berikutnya di process ini langsung ke disk
+_RENDER_TMPFS_FAILED = False
+
+def _render_base_dir() -> Optional[str]:
+    """Folder induk untuk render sementara (None = temp dir default sistem)"""
+    if OCR_RENDER_DIR:
+        return OCR_RENDER_DIR
+    if _RENDER_TMPFS_FAILED or not os.path.isdir(OCR_RENDER_TMPFS):
+        return None
+    try:
+        free = shutil.disk_usage(OCR_RENDER_TMPFS).free
+    except OSError:
+        return None
+    return OCR_RENDER_TMPFS if free >= OCR_RENDER_MIN_FREE_MB * 1024 * 1024 else None
+
+_OCR_POOL = None
+_OCR_POOL_LOCK = threading.Lock()
+
+# ========== ENGINE TESSERACT ==========
+# Satu engine per thread per process; traineddata hanya dimuat sekali lalu dipakai ulang
+_TESSERACT_LOCAL = threading.local()
+
+def _get_tesseract_api(lang: str, psm: int):
+    """Engine tesserocr yang sudah hangat untuk kombinasi lang/psm ini"""
+    apis = getattr(_TESSERACT_LOCAL, 'apis', None)
+    if apis is None:
+        apis = _TESSERACT_LOCAL.apis = {}
+    
+    key = (lang, psm)
+    if key not in apis:
+        kwargs = {'lang': lang, 'psm': psm, 'oem': tesserocr.OEM.DEFAULT}
+        if os.getenv("TESSDATA_PREFIX"):
+            kwargs['path'] = os.getenv("TESSDATA_PREFIX")
+        apis[key] = tesserocr.PyTessBaseAPI(**kwargs)
+    return apis[key]
+
+def tesseract_image_to_string(image: Image.Image, lang: str = 'ind', psm: int = 6) -> str:
+    """OCR satu gambar (in-memory) dengan engine hangat jika tersedia, fallback ke pytesseract"""
+    if USE_TESSEROCR:
+        api = _get_tesseract_api(lang, psm)
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    
+    custom_config = f'--oem 3 --psm {psm} -l {lang}'
+    return pytesseract.image_to_string(image, lang=lang, config=custom_config)
+
+def _text_from_tesseract_data(data: Dict) -> Tuple[str, float]:
+    """Susun ulang teks per baris dari output image_to_data dan hitung rata-rata confidence kata"""
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data['text']):
+        confidence = float(data['conf'][i])
+        if confidence < 0 or not word.strip():
+            continue
+        line_key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(line_key, []).append(word)
+        confidences.append(confidence)
+    
+    text_lines = []
+    previous_block = None
+    for line_key in sorted(lines):
+        block = line_key[:2]
+        if previous_block is not None and block != previous_block:
+            text_lines.append("")
+        text_lines.append(" ".join(lines[line_key]))
+        previous_block = block
+    
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return "\n".join(text_lines), mean_confidence
+
+def tesseract_image_to_text_with_confidence(image: Image.Image, lang: str = 'ind', psm: int = 6) -> Tuple[str, float]:
+    """OCR satu gambar dan kembalikan (teks, rata-rata confidence kata 0-100)"""
+    if USE_TESSEROCR:
+        api = _get_tesseract_api(lang, psm)
+        api.SetImage(image)
+        return api.GetUTF8Text(), float(api.MeanTextConf())
+    
+    custom_config = f'--oem 3 --psm {psm} -l {lang}'
+    data = pytesseract.image_to_data(image, lang=lang, config=custom_config,
+                                     output_type=pytesseract.Output.DICT)
+    return _text_from_tesseract_data(data)
+
+_TESSERACT_AVAILABLE = None
+
+def is_tesseract_available() -> bool:
+    """Cek ketersediaan Tesseract sekali per process (bukan subprocess per PDF)"""
+    global _TESSERACT_AVAILABLE
+    if _TESSERACT_AVAILABLE is None:
+        try:
+            if USE_TESSEROCR:
+                tesserocr.tesseract_version()
+            else:
+                pytesseract.get_tesseract_version()
+            _TESSERACT_AVAILABLE = True
+        except Exception as e:
+            print(f"    ⚠ OCR Engine not available: {e}")
+            _TESSERACT_AVAILABLE = False
+    return _TESSERACT_AVAILABLE
+
+def _init_ocr_worker(lang: str = 'ind'):
+    """Initializer worker process: muat engine Tesseract di awal agar halaman pertama tidak menunggu"""
+    if USE_TESSEROCR:
+        try:
+            _get_tesseract_api(lang, 6)
+        except Exception as e:
+            print(f"    ⚠ Gagal memuat engine tesserocr: {e}")
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    """Process pool OCR yang dipakai bersama oleh semua dokumen (dibuat sekali)"""
+    global _OCR_POOL
+    with _OCR_POOL_LOCK:
+        if _OCR_POOL is None:
+            _OCR_POOL = ProcessPoolExecutor(max_workers=OCR_MAX_WORKERS, initializer=_init_ocr_worker)
+        return _OCR_POOL
+
+def _reset_ocr_pool(broken_pool: ProcessPoolExecutor) -> bool:
+    """
+    Buang pool yang rusak (misal worker crash) agar dibuat ulang saat dibutuhkan.
+    broken_pool: pool yang melempar BrokenProcessPool; hanya di-reset jika masih pool aktif (error
+    terlambat dari pool lama tidak boleh mematikan pool baru yang sehat). Returns: True jika pool di-reset
+    """
+    global _OCR_POOL
+    with _OCR_POOL_LOCK:
+        if _OCR_POOL is not broken_pool:
+            return False
+        _OCR_POOL.shutdown(wait=False)
+        _OCR_POOL = None
+        return True
+
+def _get_pdf_page_count(pdf_path: str) -> int:
+    """Jumlah halaman PDF via pdfinfo (tanpa rasterisasi)"""
+    info = pdfinfo_from_path(pdf_path)
+    return int(info.get("Pages", 0))
+
+# ========== TEXT LAYER PDF (FAST PATH) ==========
+# PDF hasil export Word dsb. sudah punya text layer; pakai itu dan hanya OCR halaman hasil scan
+PDFTOTEXT_CMD = shutil.which("pdftotext")
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "80"))
+TEXT_LAYER_MIN_GLYPH_RATIO = float(os.getenv("TEXT_LAYER_MIN_GLYPH_RATIO", "0.85"))
+
+_TEXT_LAYER_PUNCTUATION = set(".,;:!?()[]{}<>'\"/\\-–—_&%@#+*=|•·●▪◦°$€")
+
+def _extract_text_layer_pages(pdf_path: str, last_page: int) -> List[str]:
+    """
+    Ambil text layer bawaan PDF per halaman via pdftotext (poppler).
+    Mengembalikan list teks halaman 1..last_page (kosong jika pdftotext tidak tersedia).
+    """
+    if not PDFTOTEXT_CMD:
+        return []
+    
+    result = subprocess.run(
+        [PDFTOTEXT_CMD, "-enc", "UTF-8", "-f", "1", "-l", str(last_page), pdf_path, "-"],
+        capture_output=True,
+        timeout=60
+    )
+    if result.returncode != 0:
+        return []
+    
+    # pdftotext memisahkan halaman dengan form feed
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    return pages[:last_page]
+
+def _is_usable_text_layer(text: str) -> bool:
+    """Cek apakah text layer cukup panjang dan berisi glyph wajar (bukan hasil font ter-encode)"""
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return False
+    
+    sane = sum(1 for c in chars if c.isalnum() or c in _TEXT_LAYER_PUNCTUATION)
+    return sane / len(chars) >= TEXT_LAYER_MIN_GLYPH_RATIO
+
+def _page_image_hash(image: Image.Image) -> str:
+    """Hash isi pixel halaman hasil render"""
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def _render_pdf_page(pdf_path: str, page_number: int, dpi: int, grayscale: bool, render_dir: str) -> Optional[str]:
+    """Render satu halaman PDF ke file mentah (PPM/PGM) di render_dir"""
+    page_paths = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=page_number,
+        last_page=page_number,
+        thread_count=1,
+        output_folder=render_dir,
+        paths_only=True,
+        fmt='ppm',  # Format mentah, tanpa biaya kompresi
+        grayscale=grayscale  # Render langsung grayscale jika preprocess aktif
+    )
+    return page_paths[0] if page_paths else None
+
+def _is_complete_render(image_path: str) -> bool:
+    """File PPM/PGM hasil render lengkap (pdftoppm yang kehabisan ruang meninggalkan file terpotong)"""
+    if not image_path.lower().endswith(('.ppm', '.pgm', '.pbm')):
+        return os.path.exists(image_path)
+    try:
+        with Image.open(image_path) as image:
+            expected = image.width * image.height * len(image.getbands())
+            if image.mode == '1':
+                expected = (image.width + 7) // 8 * image.height
+        return os.path.getsize(image_path) >= expected
+    except (OSError, ValueError):
+        return False
+
+class RenderWorkspace:
+    """
+    Folder render sementara untuk satu pemanggilan worker (context manager).
+    Jika render gagal di folder non-default (tmpfs penuh), render diulang sekali di temp dir disk
+    dengan peringatan, bukan diam-diam menghasilkan teks halaman kosong.
+    """
+    
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.render_dir = None
+        self._base_dir = None
+        self._dirs = []
+    
+    def __enter__(self) -> 'RenderWorkspace':
+        self._open(_render_base_dir())
+        return self
+    
+    def __exit__(self, *exc_info):
+        for directory in self._dirs:
+            directory.cleanup()
+    
+    def _open(self, base_dir: Optional[str]):
+        directory = tempfile.TemporaryDirectory(prefix=self.prefix, dir=base_dir)
+        self._dirs.append(directory)
+        self._base_dir = base_dir
+        self.render_dir = directory.name
+    
+    def render(self, pdf_path: str, page_number: int, dpi: int, grayscale: bool) -> Optional[str]:
+        """Render satu halaman; Returns: path file mentah, None jika PDF tidak menghasilkan halaman"""
+        global _RENDER_TMPFS_FAILED
+        try:
+            image_path = _render_pdf_page(pdf_path, page_number, dpi, grayscale, self.render_dir)
+            error = None
+        except Exception as e:
+            image_path, error = None, e
+        if image_path and _is_complete_render(image_path):
+            return image_path
+        if self._base_dir is None:
+            if error is not None:
+                raise error
+            return None
+        
+        print(f"    ⚠ Render halaman {page_number} {os.path.basename(pdf_path)} gagal di {self._base_dir} "
+              f"({error or 'file tidak lengkap'}), diulang di temp dir disk")
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+        failed_dir = self._base_dir
+        self._open(None)
+        image_path = _render_pdf_page(pdf_path, page_number, dpi, grayscale, self.render_dir)
+        if image_path and failed_dir == OCR_RENDER_TMPFS:
+            # Berhasil di disk: masalahnya tmpfs (penuh), bukan PDF-nya
+            _RENDER_TMPFS_FAILED = True
+        return image_path
+
+# ========== PREPROCESSING NUMPY ==========
+# "grayscale": hanya konversi grayscale (perilaku lama, default)
+# "numpy": adaptive threshold + crop border + deskew + downscale ke x-height optimal (gambar bitonal);
+# opt-in sampai tervalidasi di Assessment asli
+OCR_PREPROCESS_MODE = os.getenv("OCR_PREPROCESS_MODE", "grayscale").lower()
+OCR_TARGET_LINE_HEIGHT = int(os.getenv("OCR_TARGET_LINE_HEIGHT", "40"))  # tinggi baris teks (px) setelah downscale
+OCR_MAX_SKEW_DEGREES = 5.0
+
+def _box_mean(gray: np.ndarray, window: int) -> np.ndarray:
+    """Rata-rata lokal window x window (box filter separable via cumsum)"""
+    radius = window // 2
+    padded = np.pad(gray, ((radius + 1, radius), (radius + 1, radius)), mode='edge').astype(np.float32)
+    rows = padded.cumsum(axis=0)
+    rows = rows[window:] - rows[:-window]
+    cols = rows.cumsum(axis=1)
+    cols = cols[:, window:] - cols[:, :-window]
+    return cols / float(window * window)
+
+def _adaptive_threshold(gray: np.ndarray, offset: float = 10.0) -> np.ndarray:
+    """
+    Binarisasi adaptif: pixel lebih gelap dari rata-rata lokal dikurangi offset = tinta.
+    Di area berlatar gelap (header/tabel teks putih di atas warna gelap) polaritas dibalik:
+    pixel lebih terang dari rata-rata lokal = tinta, agar area itu tidak menjadi blok hitam.
+    """
+    window = max(15, (min(gray.shape) // 40) | 1)
+    local_mean = _box_mean(gray, window)
+    dark_background = _box_mean(gray, window * 3) < 128
+    return np.where(dark_background, gray > local_mean + offset, gray < local_mean - offset)
+
+def _estimate_skew_angle(ink: np.ndarray) -> float:
+    """Sudut kemiringan (derajat) dengan variance projection profile tertinggi, dihitung di gambar kecil"""
+    height, width = ink.shape
+    scale = min(1.0, 600.0 / width)
+    small = Image.fromarray((ink * 255).astype(np.uint8)).resize(
+        (max(1, int(width * scale)), max(1, int(height * scale))), Image.BILINEAR)
+    
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-OCR_MAX_SKEW_DEGREES, OCR_MAX_SKEW_DEGREES + 0.01, 0.25):
+        profile = np.asarray(small.rotate(float(angle), resample=Image.BILINEAR), dtype=np.float32).sum(axis=1)
+        score = float(np.square(np.diff(profile)).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def _crop_to_content(ink: np.ndarray, margin: int = 10) -> np.ndarray:
+    """Buang border gelap hasil scan di tepi, lalu crop ke bounding box tinta"""
+    top, bottom = 0, ink.shape[0]
+    left, right = 0, ink.shape[1]
+    row_ratio = ink.mean(axis=1)
+    col_ratio = ink.mean(axis=0)
+    while top < bottom - 1 and row_ratio[top] > 0.5:
+        top += 1
+    while bottom - 1 > top and row_ratio[bottom - 1] > 0.5:
+        bottom -= 1
+    while left < right - 1 and col_ratio[left] > 0.5:
+        left += 1
+    while right - 1 > left and col_ratio[right - 1] > 0.5:
+        right -= 1
+    ink = ink[top:bottom, left:right]
+    
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return ink
+    return ink[max(0, rows[0] - margin):rows[-1] + margin + 1,
+               max(0, cols[0] - margin):cols[-1] + margin + 1]
+
+def _median_line_height(ink: np.ndarray) -> Optional[float]:
+    """
+    Median tinggi baris teks dari horizontal projection.
+    Baris dihitung ber-tinta relatif terhadap baris terpadat agar noise/border tipis tidak
+    menyambung semua baris; butuh minimal 3 baris wajar, selain itu None.
+    """
+    row_ratio = ink.mean(axis=1)
+    peak = float(np.percentile(row_ratio, 95))
+    if peak <= 0:
+        return None
+    
+    has_ink = row_ratio > peak * 0.15
+    edges = np.diff(np.concatenate(([0], has_ink.astype(np.int8), [0])))
+    heights = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    heights = heights[(heights >= 4) & (heights <= ink.shape[0] * 0.1)]
+    return float(np.median(heights)) if heights.size >= 3 else None
+
+def preprocess_page_image(image: Image.Image) -> Image.Image:
+    """
+    Preprocessing vektor NumPy sebelum Tesseract: adaptive threshold, deskew, crop border,
+    lalu downscale jika teks jauh lebih besar dari x-height optimal. Hasil: gambar bitonal.
+    """
+    gray = np.asarray(image.convert('L'), dtype=np.uint8)
+    ink = _adaptive_threshold(gray)
+    if not ink.any():
+        return image.convert('L')
+    
+    angle = _estimate_skew_angle(ink)
+    if abs(angle) >= 0.25:
+        rotated = Image.fromarray((ink * 255).astype(np.uint8)).rotate(angle, resample=Image.NEAREST, fillcolor=0)
+        ink = np.asarray(rotated) > 127
+    
+    ink = _crop_to_content(ink)
+    bitonal = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+    
+    line_height = _median_line_height(ink)
+    if line_height and line_height > OCR_TARGET_LINE_HEIGHT * 1.25:
+        scale = max(0.5, OCR_TARGET_LINE_HEIGHT / line_height)
+        new_size = (max(1, int(bitonal.width * scale)), max(1, int(bitonal.height * scale)))
+        bitonal = bitonal.resize(new_size, Image.LANCZOS).point(lambda value: 255 if value > 127 else 0)
+    
+    return bitonal.convert('1', dither=Image.Dither.NONE)
+
+def _ocr_rendered_page(image_path: str, options: Dict) -> Tuple[str, float]:
+    """Buka halaman hasil render, preprocessing, lalu OCR dengan confidence"""
+    with Image.open(image_path) as image:
+        if options['preprocess'] and options.get('preprocess_mode') == 'numpy':
+            image = preprocess_page_image(image)
+        elif options['preprocess']:
+            # Simple preprocessing
+            image = image.convert('L')  # Grayscale saja
+        return tesseract_image_to_text_with_confidence(image, lang=options['lang'], psm=options['psm'])
+
+def _ocr_pdf_page(pdf_path: str, page_number: int, options: Dict) -> Dict:
+    """
+    Worker: rasterisasi satu halaman PDF ke file sementara lalu OCR.
+    Dijalankan di process pool sehingga rasterisasi dan OCR antar halaman berjalan bersamaan.
+    Hanya satu halaman per worker yang ada di memory, dan langsung dilepas setelah OCR.
+    Dengan adaptive DPI, halaman dirender di OCR_LOW_DPI dulu dan hanya dirender ulang di
+    options['dpi'] jika confidence-nya di bawah OCR_MIN_CONFIDENCE.
+    Returns: dict text, from_cache (halaman identik sudah pernah di-OCR), confidence, dpi
+    """
+    adaptive = options['adaptive_dpi'] and options['dpi'] > OCR_LOW_DPI
+    first_dpi = OCR_LOW_DPI if adaptive else options['dpi']
+    
+    with RenderWorkspace("ocr_page_") as workspace:
+        image_path = workspace.render(pdf_path, page_number, first_dpi, options['preprocess'])
+        if not image_path:
+            return {'text': "", 'from_cache': False, 'confidence': 0.0, 'dpi': first_dpi}
+        
+        with Image.open(image_path) as image:
+            page_hash = _page_image_hash(image)
+        
+        cache_key = make_cache_key('page', page_hash, options,
+                                   OCR_MIN_CONFIDENCE if adaptive else None)
+        cached = OCR_PAGE_CACHE.get(cache_key, track_stats=False)
+        if cached is not None:
+            cached['from_cache'] = True
+            return cached
+        
+        text, confidence = _ocr_rendered_page(image_path, options)
+        used_dpi = first_dpi
+        
+        if adaptive and confidence < OCR_MIN_CONFIDENCE:
+            # Confidence rendah (scan pudar/fax): render ulang di DPI penuh
+            os.remove(image_path)
+            hires_path = workspace.render(pdf_path, page_number, options['dpi'], options['preprocess'])
+            if hires_path:
+                hires_text, hires_confidence = _ocr_rendered_page(hires_path, options)
+                if hires_confidence >= confidence:
+                    text, confidence, used_dpi = hires_text, hires_confidence, options['dpi']
+    
+    result = {'text': text, 'confidence': round(confidence, 1), 'dpi': used_dpi}
+    OCR_PAGE_CACHE.set(cache_key, result)
+    return dict(result, from_cache=False)
+
+# ========== SKIP HALAMAN KOSONG & DUPLIKAT ==========
+# Klasifikasi murah sebelum OCR berdasarkan thumbnail. Kandidat halaman kosong dan duplikat
+# dikonfirmasi ulang di OCR_BLANK_CONFIRM_DPI sebelum benar-benar dilewati: halaman kosong dilewati,
+# halaman yang identik pixel-per-pixel memakai ulang teks halaman aslinya
+OCR_SKIP_BLANK_DUPLICATES = os.getenv("OCR_SKIP_BLANK_DUPLICATES", "1") == "1"
+# Opt-in: halaman yang hampir identik (perceptual hash) juga dianggap duplikat. Halaman form/template
+# dengan isian berbeda bisa lolos sebagai duplikat dan isinya hilang, jadi default mati.
+OCR_NEAR_DUPLICATES = os.getenv("OCR_NEAR_DUPLICATES", "0") == "1"
+OCR_THUMBNAIL_DPI = 36
+# Pixel yang lebih gelap dari background halaman itu sendiri minimal sebanyak ini dihitung sebagai tinta
+# (relatif, sehingga teks abu-abu pudar dan kertas scan yang kusam tetap terhitung)
+OCR_INK_CONTRAST = int(os.getenv("OCR_INK_CONTRAST", "24"))
+OCR_BLANK_INK_RATIO = float(os.getenv("OCR_BLANK_INK_RATIO", "0.002"))
+# Konfirmasi halaman kosong di resolusi kerja: di sini satu baris teks pun sudah melewati batas ini
+OCR_BLANK_CONFIRM_DPI = int(os.getenv("OCR_BLANK_CONFIRM_DPI", str(OCR_LOW_DPI)))
+OCR_BLANK_CONFIRM_INK_RATIO = float(os.getenv("OCR_BLANK_CONFIRM_INK_RATIO", "0.00005"))
+OCR_DUPLICATE_MAX_DISTANCE = int(os.getenv("OCR_DUPLICATE_MAX_DISTANCE", "6"))  # dari 256 bit
+
+# Counter kumulatif halaman yang tidak perlu di-OCR; per run lewat snapshot + counter_delta
+OCR_SKIP_STATS = {'blank': 0, 'duplicate': 0}
+_OCR_SKIP_STATS_LOCK = threading.Lock()
+
+def snapshot_ocr_skip_stats() -> Dict:
+    with _OCR_SKIP_STATS_LOCK:
+        return dict(OCR_SKIP_STATS)
+
+def _ink_ratio(gray: np.ndarray, despeckle: bool = False) -> float:
+    """
+    Fraksi pixel yang minimal OCR_INK_CONTRAST lebih gelap dari background halaman (persentil 90).
+    despeckle: pixel tinta tunggal tanpa tetangga horizontal (noise scan) tidak dihitung.
+    """
+    if gray.size == 0:
+        return 0.0
+    background = float(np.percentile(gray, 90))
+    ink = gray.astype(np.int16) <= background - OCR_INK_CONTRAST
+    if despeckle and ink.shape[1] > 1:
+        paired = ink[:, 1:] & ink[:, :-1]
+        ink = np.zeros_like(ink)
+        ink[:, 1:] |= paired
+        ink[:, :-1] |= paired
+    return float(ink.mean())
+
+def _page_fingerprint(image: Image.Image) -> Dict:
+    """Ink coverage, SHA-256 pixel dan dHash 256-bit dari thumbnail halaman (NumPy, tanpa OCR)"""
+    gray_image = image.convert('L')
+    gray = np.asarray(gray_image, dtype=np.uint8)
+    ink_ratio = _ink_ratio(gray)
+    digest = hashlib.sha256(repr(gray.shape).encode() + gray.tobytes()).hexdigest()
+    
+    small = np.asarray(gray_image.resize((17, 16), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    phash = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return {'ink': ink_ratio, 'digest': digest, 'hash': phash}
+
+def _is_near_duplicate(a: Dict, b: Dict) -> bool:
+    """
+    Kandidat duplikat jika pixel thumbnail identik (dikonfirmasi ulang di resolusi kerja).
+    Dengan OCR_NEAR_DUPLICATES juga jika hash hampir sama dan coverage tinta mirip.
+    """
+    if a['digest'] == b['digest']:
+        return True
+    if not OCR_NEAR_DUPLICATES:
+        return False
+    distance = bin(a['hash'] ^ b['hash']).count('1')
+    if distance > OCR_DUPLICATE_MAX_DISTANCE:
+        return False
+    return abs(a['ink'] - b['ink']) <= 0.1 * max(a['ink'], b['ink'])
+
+def _render_gray_page(pdf_path: str, page_number: int, dpi: int) -> np.ndarray:
+    """Satu halaman sebagai array grayscale di dpi tertentu (untuk konfirmasi kosong/duplikat)"""
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number,
+                               thread_count=1, grayscale=True)
+    if not images:
+        raise ValueError(f"halaman {page_number} tidak ter-render")
+    return np.asarray(images[0].convert('L'), dtype=np.uint8)
+
+def classify_pdf_pages(pdf_path: str, page_numbers: List[int]) -> Tuple[List[int], List[int], Dict[int, int]]:
+    """
+    Klasifikasi halaman sebelum OCR dari thumbnail resolusi rendah. Kandidat halaman kosong dan
+    duplikat exact dirender ulang di OCR_BLANK_CONFIRM_DPI; hanya yang terkonfirmasi dilewati.
+    Returns: (halaman unik yang perlu OCR, halaman kosong, {halaman duplikat: halaman asli})
+    """
+    thumbnails = convert_from_path(
+        pdf_path,
+        dpi=OCR_THUMBNAIL_DPI,
+        first_page=min(page_numbers),
+        last_page=max(page_numbers),
+        thread_count=1,
+        grayscale=True
+    )
+    
+    unique_pages, blank_pages, duplicates = [], [], {}
+    fingerprints = {}
+    confirm_digests = {}
+    
+    def _confirm_digest(page: int) -> str:
+        if page not in confirm_digests:
+            gray = _render_gray_page(pdf_path, page, OCR_BLANK_CONFIRM_DPI)
+            confirm_digests[page] = hashlib.sha256(repr(gray.shape).encode() + gray.tobytes()).hexdigest()
+        return confirm_digests[page]
+    
+    for page_number, thumbnail in zip(range(min(page_numbers), max(page_numbers) + 1), thumbnails):
+        if page_number not in page_numbers:
+            continue
+        
+        fingerprint = _page_fingerprint(thumbnail)
+        if fingerprint['ink'] < OCR_BLANK_INK_RATIO:
+            # Thumbnail 36 dpi mengaburkan teks tipis/pudar: cek ulang di resolusi kerja
+            confirm_ink = _ink_ratio(_render_gray_page(pdf_path, page_number, OCR_BLANK_CONFIRM_DPI), despeckle=True)
+            if confirm_ink < OCR_BLANK_CONFIRM_INK_RATIO:
+                print(f"    ⏭ Halaman {page_number} kosong (tinta {confirm_ink:.4%} di {OCR_BLANK_CONFIRM_DPI} dpi), tidak di-OCR")
+                blank_pages.append(page_number)
+                continue
+            print(f"    ℹ Halaman {page_number} tampak kosong di thumbnail tetapi bertinta "
+                  f"{confirm_ink:.4%} di {OCR_BLANK_CONFIRM_DPI} dpi, tetap di-OCR")
+        
+        original = next((unique_page for unique_page in unique_pages
+                         if _is_near_duplicate(fingerprint, fingerprints[unique_page])), None)
+        if original is not None and fingerprint['digest'] == fingerprints[original]['digest']:
+            # Thumbnail identik belum tentu halaman identik: bandingkan pixel di resolusi kerja
+            if _confirm_digest(page_number) != _confirm_digest(original):
+                original = None
+        if original is not None:
+            kind = "duplikat" if fingerprint['digest'] == fingerprints[original]['digest'] else "hampir duplikat"
+            print(f"    ⏭ Halaman {page_number} {kind} dari halaman {original}, memakai teks halaman {original}")
+            duplicates[page_number] = original
+            continue
+        
+        fingerprints[page_number] = fingerprint
+        unique_pages.append(page_number)
+    
+    # Halaman yang tidak ter-render tetap di-OCR
+    classified = set(unique_pages) | set(blank_pages) | set(duplicates)
+    unique_pages.extend(page_number for page_number in page_numbers if page_number not in classified)
+    return sorted(unique_pages), blank_pages, duplicates
+
+def _page_status(result: Dict) -> str:
+    """Keterangan singkat hasil satu halaman untuk log"""
+    status = f"{len(result['text'])} karakter, conf {result['confidence']:.0f}, {result['dpi']} dpi"
+    return status + ", cache" if result['from_cache'] else status
+
+def _ocr_pages_serial(pdf_path: str, page_numbers: List[int], options: Dict) -> Dict[int, str]:
+    """OCR halaman satu per satu di process saat ini"""
+    page_texts = {}
+    for page_number in page_numbers:
+        print(f"=== Processing page {page_number}/{len(page_numbers)}")
+        try:
+            result = _ocr_pdf_page(pdf_path, page_number, options)
+            OCR_PAGE_CACHE.record_lookup(result['from_cache'])
+            print(f"    ✓ Page {page_number} selesai ({_page_status(result)})")
+            text = result['text']
+        except Exception as e:
+            print(f"    ❌ Error OCR page {page_number}: {e}")
+            text = ""
+        page_texts[page_number] = text
+    return page_texts
+
+def _ocr_pages_parallel(pdf_path: str, page_numbers: List[int], options: Dict,
+                        max_workers: int, pool: ProcessPoolExecutor) -> Dict[int, str]:
+    """
+    OCR halaman secara paralel di process pool, hasil dikembalikan per nomor halaman.
+    Maksimal max_workers halaman diproses bersamaan untuk satu dokumen.
+    """
+    pending_pages = list(page_numbers)
+    in_flight = {}
+    page_texts = {}
+    
+    while pending_pages or in_flight:
+        while pending_pages and len(in_flight) < max_workers:
+            page_number = pending_pages.pop(0)
+            future = pool.submit(_ocr_pdf_page, pdf_path, page_number, options)
+            in_flight[future] = page_number
+        
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            page_number = in_flight.pop(future)
             try:
-                # Special handling untuk skills_competency
-                if category == 'skills_competency':
-                    if competency_data and len(competency_data) > 0:
-                        # Format competency data untuk prompt
-                        competency_list = "Data Competency:\n"
-                        for comp in competency_data:
-                            comp_name = comp.get('competency', '')
-                            level = comp.get('level', 0)
-                            competency_list += f"- {comp_name} (Level {level}/5)\n"
-                        
-                        # Replace placeholder dengan data actual
-                        full_prompt = prompts[category].replace('{competency_list}', competency_list)
-                    else:
-                        print(f"    ⚠ Tidak ada data competency, menggunakan fallback")
-                        results[category] = ""
-                        continue
-                else:
-                    max_text_length = 30000
-                    truncated_text = text_content[:max_text_length] + "..." if len(text_content) > max_text_length else text_content
-                    full_prompt = prompts[category] + "\n\n" + truncated_text
-                
-                response = model.generate_content(full_prompt)
-                
-                if response.text:
-                    results[category] = response.text.strip()
-                else:
-                    results[category] = "Tidak dapat menganalisis dengan AI"
-                    
+                result = future.result()
+                OCR_PAGE_CACHE.record_lookup(result['from_cache'])
+                print(f"    ✓ Page {page_number}/{len(page_numbers)} selesai ({_page_status(result)})")
+                text = result['text']
+            except BrokenProcessPool:
+                raise
             except Exception as e:
-                print(f"    Error dalam analisis Gemini untuk {category}: {e}")
-                results[category] = f"Error: {str(e)}"
-            
-            time.sleep(0.5)
+                print(f"    ❌ Error OCR page {page_number}: {e}")
+                text = ""
+            page_texts[page_number] = text
     
-    return results
+    return page_texts
+
+def _build_ocr_options(lang: str = 'ind', preprocess: bool = True, dpi: int = 300,
+                       adaptive_dpi: Optional[bool] = None) -> Dict:
+    """Opsi OCR per halaman yang dikirim ke worker (juga bagian dari key cache halaman)"""
+    return {
+        'engine': OCR_ENGINE_USED,
+        'lang': lang,
+        'psm': 6,
+        'preprocess': preprocess,
+        'preprocess_mode': OCR_PREPROCESS_MODE,
+        'dpi': dpi,
+        'adaptive_dpi': OCR_ADAPTIVE_DPI if adaptive_dpi is None else adaptive_dpi,
+    }
 
-def pdf_to_text_ocr_advanced(pdf_path, output_txt_path=None, lang='ind', preprocess=True, dpi=300):
-    """Fungsi OCR untuk convert PDF ke text"""
+def _prepare_ocr_document(pdf_path: str, use_text_layer: bool = True,
+                          skip_blank_duplicates: Optional[bool] = None) -> Optional[Dict]:
+    """
+    Tahap murah sebelum OCR untuk satu dokumen: hitung halaman, ambil text layer,
+    klasifikasi halaman kosong/duplikat. Returns dict state dokumen, None jika PDF tidak terbaca.
+    """
     print(f"    Memproses PDF: {os.path.basename(pdf_path)}")
     
     try:
-        # First verify OCR is available
-        try:
-            pytesseract.get_tesseract_version()
-            print(f"    ✓ Tesseract tersedia")
-        except Exception as ocr_err:
-            print(f"    ⚠ OCR Engine not available: {ocr_err}")
-            return ""
-        
         # Check file size
         file_size = os.path.getsize(pdf_path) / (1024*1024)  # in MB
         print(f"    📄 File size: {file_size:.2f} MB")
         
         # Limit pages untuk mencegah hang
-        max_pages = 10
+        max_pages = OCR_MAX_PAGES
         print(f"    ⚙️  Membatasi proses ke {max_pages} halaman pertama")
         
         try:
-            print(f"    🕐 Mengkonversi PDF ke gambar...")
-            # Convert with limited pages
-            images = convert_from_path(
-                pdf_path, 
-                dpi=200,  # Reduced DPI untuk kecepatan
-                first_page=1, 
-                last_page=max_pages,
-                thread_count=1  # Single thread untuk stabilitas
-            )
+            page_count = _get_pdf_page_count(pdf_path)
             
-            if not images:
-                print(f"    ❌ Tidak ada gambar yang dihasilkan")
-                return ""
-                
-            print(f"    ✓ Berhasil mengkonversi {len(images)} halaman")
+            if page_count <= 0:
+                print(f"    ❌ Tidak ada halaman yang ditemukan")
+                return None
+            
+            page_numbers = list(range(1, min(page_count, max_pages) + 1))
+            print(f"    ✓ {len(page_numbers)} halaman akan diproses")
             
         except Exception as e:
-            print(f"    ❌ Error mengkonversi PDF: {e}")
-            return ""
+            print(f"    ❌ Error membaca info PDF: {e}")
+            return None
         
     except Exception as e:
         print(f"    ❌ Error dalam setup OCR: {e}")
-        return ""
+        return None
     
-    # Process images
-    full_text = []
+    page_texts = {}
+    layer_texts = {}
     
-    for i, image in enumerate(images, start=1):
-        print(f"=== Processing page {i}/{len(images)}")
-        
-        if preprocess:
-            # Simple preprocessing
-            image = image.convert('L')  # Grayscale saja
+    # Fast path: pakai text layer bawaan PDF jika layak
+    if use_text_layer:
+        try:
+            layer_pages = _extract_text_layer_pages(pdf_path, page_numbers[-1])
+        except Exception as e:
+            print(f"    ⚠ Gagal membaca text layer: {e}")
+            layer_pages = []
         
-        # OCR config
-        custom_config = r'--oem 3 --psm 6 -l ind'
+        for page_number, layer_text in zip(page_numbers, layer_pages):
+            layer_texts[page_number] = layer_text
+            if _is_usable_text_layer(layer_text):
+                page_texts[page_number] = layer_text.strip()
         
+        if page_texts:
+            print(f"    ⚡ {len(page_texts)}/{len(page_numbers)} halaman memakai text layer PDF")
+    
+    ocr_page_numbers = [page_number for page_number in page_numbers if page_number not in page_texts]
+    
+    if ocr_page_numbers:
+        # Verify OCR is available (dicek sekali per process)
+        if not is_tesseract_available():
+            ocr_page_numbers = []
+    
+    duplicates = {}
+    if skip_blank_duplicates is None:
+        skip_blank_duplicates = OCR_SKIP_BLANK_DUPLICATES
+    if skip_blank_duplicates and len(ocr_page_numbers) > 0:
         try:
-            text = pytesseract.image_to_string(image, lang=lang, config=custom_config)
-            full_text.append(text)
-            print(f"    ✓ Page {i} selesai ({len(text)} karakter)")
+            ocr_page_numbers, blank_pages, duplicates = classify_pdf_pages(pdf_path, ocr_page_numbers)
         except Exception as e:
-            print(f"    ❌ Error OCR page {i}: {e}")
-            full_text.append("")
+            print(f"    ⚠ Gagal klasifikasi halaman, semua halaman di-OCR: {e}")
+            blank_pages = []
+        
+        # Text layer (meski terlalu tipis untuk dipakai langsung) membuktikan halaman tidak kosong
+        for page_number in [page for page in blank_pages if layer_texts.get(page, "").strip()]:
+            print(f"    ℹ Halaman {page_number} punya text layer, tetap di-OCR")
+            blank_pages.remove(page_number)
+            ocr_page_numbers = sorted(ocr_page_numbers + [page_number])
+        
+        for page_number in blank_pages:
+            page_texts[page_number] = ""
+        with _OCR_SKIP_STATS_LOCK:
+            OCR_SKIP_STATS['blank'] += len(blank_pages)
+            OCR_SKIP_STATS['duplicate'] += len(duplicates)
+        
+        if blank_pages or duplicates:
+            print(f"    ⏭ {len(blank_pages)} halaman kosong dan {len(duplicates)} halaman duplikat tidak di-OCR")
+    
+    return {
+        'pdf_path': pdf_path,
+        'page_numbers': page_numbers,
+        'page_texts': page_texts,
+        'ocr_pages': ocr_page_numbers,
+        'duplicates': duplicates,
+    }
+
+def _assemble_ocr_document(document: Dict) -> str:
+    """Gabungkan teks halaman sesuai urutan; halaman duplikat memakai teks halaman aslinya"""
+    page_texts = document['page_texts']
+    for page_number, original in document['duplicates'].items():
+        page_texts[page_number] = page_texts.get(original, "")
+    
+    return "\n".join(page_texts.get(page_number, "") for page_number in document['page_numbers'])
+
+def pdf_to_text_ocr_advanced(pdf_path, output_txt_path=None, lang='ind', preprocess=True, dpi=300,
+                             max_workers=None, use_text_layer=True, adaptive_dpi=None,
+                             skip_blank_duplicates=None):
+    """
+    Fungsi OCR untuk convert PDF ke text.
+    Halaman dengan text layer yang layak (use_text_layer) diambil langsung via pdftotext,
+    sisanya di-OCR paralel di process pool (max_workers, default dan batas atas OCR_MAX_WORKERS);
+    max_workers=1 memakai mode serial.
+    adaptive_dpi (default OCR_ADAPTIVE_DPI): OCR di OCR_LOW_DPI dulu, dpi penuh hanya untuk
+    halaman dengan confidence rendah. Tanpa adaptive, semua halaman dirender di dpi.
+    skip_blank_duplicates (default OCR_SKIP_BLANK_DUPLICATES): halaman kosong dilewati dan
+    halaman hampir identik memakai ulang teks halaman aslinya.
+    """
+    document = _prepare_ocr_document(pdf_path, use_text_layer, skip_blank_duplicates)
+    if document is None:
+        return ""
+    
+    # Process pages
+    options = _build_ocr_options(lang, preprocess, dpi, adaptive_dpi)
+    workers = min(max_workers or OCR_MAX_WORKERS, OCR_MAX_WORKERS)
+    ocr_page_numbers = document['ocr_pages']
+    
+    ocr_start = time.time()
+    if workers > 1 and len(ocr_page_numbers) > 1:
+        print(f"    🕐 OCR paralel {len(ocr_page_numbers)} halaman dengan {workers} worker...")
+        pool = _get_ocr_pool()
+        try:
+            document['page_texts'].update(_ocr_pages_parallel(pdf_path, ocr_page_numbers, options, workers, pool))
+        except BrokenProcessPool as e:
+            print(f"    ⚠ Process pool OCR rusak ({e}), beralih ke mode serial")
+            _reset_ocr_pool(broken_pool=pool)
+            document['page_texts'].update(_ocr_pages_serial(pdf_path, ocr_page_numbers, options))
+    elif ocr_page_numbers:
+        document['page_texts'].update(_ocr_pages_serial(pdf_path, ocr_page_numbers, options))
+    
+    if ocr_page_numbers:
+        ocr_duration = time.time() - ocr_start
+        print(f"    ⏱ OCR {len(ocr_page_numbers)} halaman dalam {ocr_duration:.1f} s "
+              f"({len(ocr_page_numbers) / max(ocr_duration, 1e-6):.2f} halaman/detik, "
+              f"preprocess={OCR_PREPROCESS_MODE if preprocess else 'off'})")
     
-    result_text = "\n".join(full_text)
+    # Susun ulang sesuai urutan halaman
+    result_text = _assemble_ocr_document(document)
     
     # Save if requested
     if output_txt_path:
@@ -558,6 +2818,678 @@ def pdf_to_text_ocr_advanced(pdf_path, output_txt_path=None, lang='ind', preproc
     
     return result_text
 
+# ========== SCHEDULER OCR LINTAS DOKUMEN ==========
+class OCRScheduler:
+    """
+    Scheduler OCR lintas dokumen.
+    Semua halaman dari semua PDF dienumerasi di awal ke satu antrian kerja dan dikerjakan
+    process pool bersama (dokumen dengan halaman OCR terbanyak dulu), sehingga semua core
+    tetap sibuk sepanjang batch. Hasil tiap dokumen berupa Future -> (text, from_cache),
+    sama seperti get_cached_ocr_text.
+    """
+    
+    # Berapa kali satu halaman dicoba ulang jika process pool rusak sebelum di-OCR serial
+    MAX_POOL_RETRIES = 2
+    
+    def __init__(self, lang: str = 'ind', max_workers: Optional[int] = None, use_cache: bool = True):
+        self.lang = lang
+        self.max_workers = min(max_workers or OCR_MAX_WORKERS, OCR_MAX_WORKERS)
+        self.use_cache = use_cache
+        self.options = _build_ocr_options(lang)
+        self._thread = None
+    
+    def submit_documents(self, pdf_paths: List[str]) -> Dict[str, Future]:
+        """Jadwalkan OCR semua dokumen di background, langsung kembalikan Future per dokumen"""
+        futures = {pdf_path: Future() for pdf_path in dict.fromkeys(pdf_paths)}
+        self._thread = threading.Thread(target=self._run, args=(futures,), name="ocr-scheduler", daemon=True)
+        self._thread.start()
+        return futures
+    
+    def _run(self, futures: Dict[str, Future]):
+        try:
+            self._run_batch(futures)
+        except Exception as e:
+            print(f"❌ Error scheduler OCR: {e}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+    
+    def _prepare(self, pdf_path: str) -> Tuple[Optional[Dict], Optional[str], Optional[str]]:
+        """Cek cache dokumen lalu tahap murah sebelum OCR. Returns: (document, cache_key, cached_text)"""
+        cache_key = None
+        if self.use_cache:
+            cache_key = _document_cache_key(pdf_path, self.lang)
+            cached = OCR_CACHE.get(cache_key) if cache_key else None
+            if cached is not None:
+                return None, cache_key, cached['text']
+        return _prepare_ocr_document(pdf_path), cache_key, None
+    
+    def _complete(self, document: Dict, future: Future):
+        text = _assemble_ocr_document(document)
+        if document.get('cache_key') and text:
+            OCR_CACHE.set(document['cache_key'], {'text': text, 'filename': os.path.basename(document['pdf_path'])})
+        future.set_result((text, False))
+    
+    def _run_batch(self, futures: Dict[str, Future]):
+        batch_start = time.time()
+        documents = {}
+        
+        # 1. Cache + tahap murah (subprocess poppler) untuk semua dokumen secara paralel
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as prepare_pool:
+            prepared = prepare_pool.map(self._prepare, list(futures))
+            for pdf_path, (document, cache_key, cached_text) in zip(list(futures), prepared):
+                if cached_text is not None:
+                    futures[pdf_path].set_result((cached_text, True))
+                elif document is None:
+                    futures[pdf_path].set_result(("", False))
+                elif not document['ocr_pages']:
+                    document['cache_key'] = cache_key
+                    self._complete(document, futures[pdf_path])
+                else:
+                    document['cache_key'] = cache_key
+                    documents[pdf_path] = document
+        
+        # 2. Satu antrian halaman untuk seluruh batch, dokumen terbesar dulu
+        ordered = sorted(documents.values(), key=lambda document: len(document['ocr_pages']), reverse=True)
+        queue = [(document['pdf_path'], page_number) for document in ordered for page_number in document['ocr_pages']]
+        remaining = {pdf_path: len(document['ocr_pages']) for pdf_path, document in documents.items()}
+        attempts = defaultdict(int)
+        total_pages = len(queue)
+        
+        if total_pages:
+            print(f"\n🗂 Scheduler OCR: {total_pages} halaman dari {len(documents)} dokumen "
+                  f"({len(futures) - len(documents)} dokumen dari cache/tanpa OCR), {self.max_workers} worker")
+        
+        def _finish_page(pdf_path: str, page_number: int, text: str):
+            documents[pdf_path]['page_texts'][page_number] = text
+            remaining[pdf_path] -= 1
+            if remaining[pdf_path] == 0:
+                self._complete(documents[pdf_path], futures[pdf_path])
+        
+        in_flight = {}
+        while queue or in_flight:
+            while queue and len(in_flight) < self.max_workers:
+                pdf_path, page_number = queue.pop(0)
+                if attempts[(pdf_path, page_number)] >= self.MAX_POOL_RETRIES:
+                    # Halaman ini berulang kali membuat pool rusak, OCR di thread ini saja
+                    try:
+                        result = _ocr_pdf_page(pdf_path, page_number, self.options)
+                        OCR_PAGE_CACHE.record_lookup(result['from_cache'])
+                        text = result['text']
+                    except Exception as e:
+                        print(f"    ❌ Error OCR {os.path.basename(pdf_path)} page {page_number}: {e}")
+                        text = ""
+                    _finish_page(pdf_path, page_number, text)
+                    continue
+                pool = _get_ocr_pool()
+                future = pool.submit(_ocr_pdf_page, pdf_path, page_number, self.options)
+                in_flight[future] = (pdf_path, page_number, pool)
+            
+            if not in_flight:
+                continue
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path, page_number, pool = in_flight.pop(future)
+                try:
+                    result = future.result()
+                    OCR_PAGE_CACHE.record_lookup(result['from_cache'])
+                    text = result['text']
+                except BrokenProcessPool as e:
+                    # Hanya halaman yang pertama melaporkan pool rusak dihitung sebagai percobaan;
+                    # halaman lain yang kebetulan sedang berjalan di pool itu cukup dijadwalkan ulang
+                    if _reset_ocr_pool(broken_pool=pool):
+                        print(f"    ⚠ Process pool OCR rusak ({e}), halaman dijadwalkan ulang")
+                        attempts[(pdf_path, page_number)] += 1
+                    queue.insert(0, (pdf_path, page_number))
+                    continue
+                except Exception as e:
+                    print(f"    ❌ Error OCR {os.path.basename(pdf_path)} page {page_number}: {e}")
+                    text = ""
+                _finish_page(pdf_path, page_number, text)
+        
+        duration = time.time() - batch_start
+        if total_pages:
+            print(f"🗂 Scheduler OCR selesai: {total_pages} halaman dalam {duration:.1f} s "
+                  f"({total_pages / max(duration, 1e-6):.2f} halaman/detik)")
+
+# ========== IDENTIFIKASI CEPAT NIK/NAMA ==========
+# NIK dan nama hampir selalu ada di header halaman 1, jadi fase matching cukup OCR area itu saja
+ID_REGION_RATIO = float(os.getenv("ID_REGION_RATIO", "0.35"))
+ID_DPI = int(os.getenv("ID_DPI", "200"))
+ID_MAX_PAGES = int(os.getenv("ID_MAX_PAGES", "3"))
+# CV jarang mencantumkan NIK: cukup pass murah halaman 1 (0 = tidak mencari NIK di CV)
+CV_ID_MAX_PAGES = int(os.getenv("CV_ID_MAX_PAGES", "1"))
+
+def _identify_pdf_document(pdf_path: str, lang: str = 'ind', max_pages: int = ID_MAX_PAGES,
+                           known_niks: Optional[Set[str]] = None) -> Dict:
+    """
+    Worker: cari NIK dan nama secepat mungkin.
+    Urutan: text layer halaman 1 -> OCR area atas halaman 1 -> OCR penuh halaman 1..max_pages
+    (tersimpan di OCR_PAGE_CACHE untuk fase analisis),
+    berhenti begitu ada NIK berlabel atau angka yang ada di known_niks. Angka lepas lain
+    (No. Peserta, nomor HP) tidak menghentikan pencarian; NIK berlabel tetap diutamakan.
+    Semua kandidat NIK yang terlihat ikut dikembalikan (nik_labeled, nik_bare).
+    """
+    known_niks = known_niks or set()
+    nik, name = None, None
+    stage = None
+    nik_labeled, nik_bare = [], []
+    bare_nik, bare_stage = None, None
+    
+    def _result() -> Dict:
+        return {'nik': nik or bare_nik, 'name': name, 'stage': stage if nik else bare_stage,
+                'nik_labeled': nik_labeled, 'nik_bare': nik_bare}
+    
+    def _update(text: str, stage_name: str) -> bool:
+        nonlocal nik, name, stage, bare_nik, bare_stage
+        labeled, bare = extract_nik_candidates(text)
+        nik_labeled.extend(candidate for candidate in labeled if candidate not in nik_labeled)
+        nik_bare.extend(candidate for candidate in bare if candidate not in nik_bare)
+        found_nik, found_name = extract_nik_and_name_from_text(text)
+        if found_name and not name:
+            name = found_name
+        
+        resolved = resolve_nik(labeled, bare, known_niks, require_known=not labeled)
+        if resolved:
+            nik = resolved
+            stage = stage_name
+            return True
+        if found_nik and not bare_nik:
+            # Angka lepas hanya cadangan jika sampai akhir tidak ada NIK berlabel/dikenal
+            bare_nik, bare_stage = found_nik, stage_name
+        return False
+    
+    try:
+        layer_pages = _extract_text_layer_pages(pdf_path, 1)
+    except Exception:
+        layer_pages = []
+    if layer_pages and _is_usable_text_layer(layer_pages[0]) and _update(layer_pages[0], 'text_layer'):
+        return _result()
+    
+    if not is_tesseract_available():
+        return _result()
+    
+    with RenderWorkspace("ocr_id_") as workspace:
+        image_path = workspace.render(pdf_path, 1, ID_DPI, True)
+        if image_path:
+            with Image.open(image_path) as image:
+                width, height = image.size
+                header = image.crop((0, 0, width, int(height * ID_REGION_RATIO)))
+                if _update(tesseract_image_to_string(header, lang=lang, psm=6), 'header'):
+                    return _result()
+    
+    # OCR halaman penuh lewat jalur yang sama dengan fase analisis (opsi dan key OCR_PAGE_CACHE sama),
+    # sehingga halaman yang sudah dibaca di sini tidak di-OCR ulang saat analisis
+    page_options = _build_ocr_options(lang)
+    for page_number in range(1, min(_get_pdf_page_count(pdf_path), max_pages) + 1):
+        if _update(_ocr_pdf_page(pdf_path, page_number, page_options)['text'], f'page_{page_number}'):
+            break
+    
+    return _result()
+
+def identify_documents(pdf_paths: List[str], lang: str = 'ind', use_cache: bool = True,
+                       max_pages: int = ID_MAX_PAGES, known_niks: Optional[Set[str]] = None) -> Dict[str, Dict]:
+    """
+    Identifikasi NIK/nama banyak dokumen sekaligus (paralel di process pool).
+    known_niks: NIK yang dikenal; angka lepas yang cocok boleh menghentikan pencarian lebih awal.
+    Returns: {pdf_path: {'nik', 'name', 'stage', 'nik_labeled', 'nik_bare', 'from_cache'}}
+    """
+    known_niks = set(known_niks or ())
+    # Titik berhenti bergantung pada NIK yang dikenal, jadi ikut key cache
+    known_digest = hashlib.sha256("\n".join(sorted(known_niks)).encode('utf-8')).hexdigest()
+    results = {}
+    cache_keys = {}
+    to_identify = []
+    
+    for pdf_path in pdf_paths:
+        if use_cache:
+            try:
+                cache_keys[pdf_path] = make_cache_key('identify', _file_sha256(pdf_path), lang, OCR_ENGINE_USED,
+                                                      TEXT_LAYER_MIN_CHARS, TEXT_LAYER_MIN_GLYPH_RATIO,
+                                                      ID_REGION_RATIO, ID_DPI, _build_ocr_options(lang), max_pages,
+                                                      'labeled_first', known_digest)
+            except OSError as e:
+                print(f"    ⚠ Tidak bisa membaca file untuk cache: {e}")
+        
+        cached = OCR_CACHE.get(cache_keys[pdf_path]) if pdf_path in cache_keys else None
+        if cached is not None:
+            results[pdf_path] = dict(cached, from_cache=True)
+        else:
+            to_identify.append(pdf_path)
+    
+    def _store(pdf_path: str, result: Dict):
+        results[pdf_path] = dict(result, from_cache=False)
+        if pdf_path in cache_keys and (result['nik'] or result['name'] or result['nik_labeled'] or result['nik_bare']):
+            OCR_CACHE.set(cache_keys[pdf_path], result)
+    
+    if OCR_MAX_WORKERS > 1 and len(to_identify) > 1:
+        pool = _get_ocr_pool()
+        try:
+            futures = {pool.submit(_identify_pdf_document, pdf_path, lang, max_pages, known_niks): pdf_path for pdf_path in to_identify}
+            for future in as_completed(futures):
+                pdf_path = futures[future]
+                try:
+                    _store(pdf_path, future.result())
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    print(f"    ❌ Error identifikasi {os.path.basename(pdf_path)}: {e}")
+                    results[pdf_path] = {'nik': None, 'name': None, 'stage': None, 'from_cache': False}
+            return results
+        except BrokenProcessPool as e:
+            print(f"    ⚠ Process pool OCR rusak ({e}), beralih ke mode serial")
+            _reset_ocr_pool(broken_pool=pool)
+            to_identify = [pdf_path for pdf_path in to_identify if pdf_path not in results]
+    
+    for pdf_path in to_identify:
+        try:
+            _store(pdf_path, _identify_pdf_document(pdf_path, lang, max_pages, known_niks))
+        except Exception as e:
+            print(f"    ❌ Error identifikasi {os.path.basename(pdf_path)}: {e}")
+            results[pdf_path] = {'nik': None, 'name': None, 'stage': None, 'from_cache': False}
+    
+    return results
+
+# ========== MATCHING KANDIDAT (BLOCKING + ASSIGNMENT) ==========
+# Nama dinormalisasi lalu di-index per token dan trigram: hanya pasangan yang berbagi key yang diberi skor.
+# Pasangan akhir dipilih dengan assignment optimal global, bukan greedy menurut urutan Assessment.
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.6"))
+MATCH_MIN_SHARED_GRAMS = int(os.getenv("MATCH_MIN_SHARED_GRAMS", "2"))
+MATCH_MIN_GRAM_OVERLAP = float(os.getenv("MATCH_MIN_GRAM_OVERLAP", "0.3"))
+MATCH_AUDIT_TOP_N = int(os.getenv("MATCH_AUDIT_TOP_N", "3"))
+
+# Kata jenis dokumen yang sering terbawa di nama file, bukan bagian nama orang
+MATCH_NAME_STOPWORDS = {'cv', 'resume', 'assessment', 'penilaian', 'hasil', 'laporan', 'report'}
+
+def normalize_person_name(name: str) -> str:
+    """Lowercase, buang aksen, tanda baca, angka dan kata jenis dokumen, rapikan spasi"""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    name = re.sub(r'[^a-z\s]', ' ', name.lower())
+    return ' '.join(token for token in name.split() if token not in MATCH_NAME_STOPWORDS)
+
+def _name_blocking_keys(normalized: str) -> Set[str]:
+    """Key blocking: token nama (>= 3 huruf) dan trigram dari nama tanpa spasi"""
+    keys = {f"t:{token}" for token in normalized.split() if len(token) >= 3}
+    compact = normalized.replace(' ', '')
+    keys.update(f"g:{compact[i:i + 3]}" for i in range(len(compact) - 2))
+    return keys
+
+def name_similarity(a: str, b: str) -> float:
+    """Similarity 0..1 antara dua nama ter-normalisasi (rapidfuzz jika terpasang, selain itu difflib)"""
+    if not a or not b:
+        return 0.0
+    if rapidfuzz_fuzz is not None:
+        return rapidfuzz_fuzz.ratio(a, b) / 100.0
+    return SequenceMatcher(None, a, b).ratio()
+
+class NameIndex:
+    """Inverted index key blocking -> posisi nama, untuk mencari kandidat tanpa membandingkan semua pasangan"""
+    
+    def __init__(self, names: List[str]):
+        self.names = [normalize_person_name(name) for name in names]
+        self._postings = defaultdict(set)
+        for position, name in enumerate(self.names):
+            for key in _name_blocking_keys(name):
+                self._postings[key].add(position)
+    
+    def candidates(self, name: str) -> Set[int]:
+        """Posisi nama yang berbagi token utuh, atau cukup banyak trigram (MATCH_MIN_GRAM_OVERLAP)"""
+        keys = _name_blocking_keys(normalize_person_name(name))
+        grams = [key for key in keys if key.startswith('g:')]
+        
+        result = set()
+        for key in keys:
+            if key.startswith('t:'):
+                result.update(self._postings.get(key, ()))
+        
+        shared = defaultdict(int)
+        for key in grams:
+            for position in self._postings.get(key, ()):
+                shared[position] += 1
+        # Nama pendek hanya punya sedikit trigram
+        min_shared = max(1, min(len(grams), max(MATCH_MIN_SHARED_GRAMS, math.ceil(len(grams) * MATCH_MIN_GRAM_OVERLAP))))
+        result.update(position for position, count in shared.items() if count >= min_shared)
+        return result
+
+def match_names(query_names: List[List[str]], target_names: List[str],
+                threshold: float = MATCH_THRESHOLD) -> Tuple[List[Tuple[int, int, float]], Dict[Tuple[int, int], float]]:
+    """
+    Pasangkan tiap query (satu atau beberapa varian nama) dengan paling banyak satu target, dan sebaliknya.
+    Skor pasangan = similarity tertinggi antara varian nama query dan nama target.
+    Returns: (pairs [(idx_query, idx_target, skor)], scores {(idx_query, idx_target): skor} semua pasangan kandidat)
+    """
+    index = NameIndex(target_names)
+    scores = {}
+    
+    for query_idx, names in enumerate(query_names):
+        variants = [normalize_person_name(name) for name in names if name]
+        candidates = set()
+        for variant in variants:
+            candidates |= index.candidates(variant)
+        for target_idx in candidates:
+            scores[(query_idx, target_idx)] = max(name_similarity(variant, index.names[target_idx])
+                                                  for variant in variants)
+    
+    eligible = {pair: score for pair, score in scores.items() if score >= threshold}
+    if not eligible:
+        return [], scores
+    
+    # Nama yang sama persis dan pasangan saling-terbaik dikunci dulu: Hungarian memaksimalkan total skor
+    # dan bisa menukar pasangan exact demi dua pasangan sedang (mis. Santoso->Santoso Wibowo)
+    pairs = _lock_confident_pairs(eligible)
+    locked_queries = {query_idx for query_idx, _, _ in pairs}
+    locked_targets = {target_idx for _, target_idx, _ in pairs}
+    eligible = {
+        (query_idx, target_idx): score for (query_idx, target_idx), score in eligible.items()
+        if query_idx not in locked_queries and target_idx not in locked_targets
+    }
+    if not eligible:
+        return pairs, scores
+    
+    # Assignment optimal global (Hungarian) hanya atas baris/kolom sisa yang punya pasangan layak
+    rows = sorted({query_idx for query_idx, _ in eligible})
+    cols = sorted({target_idx for _, target_idx in eligible})
+    row_pos = {query_idx: pos for pos, query_idx in enumerate(rows)}
+    col_pos = {target_idx: pos for pos, target_idx in enumerate(cols)}
+    matrix = np.zeros((len(rows), len(cols)))
+    for (query_idx, target_idx), score in eligible.items():
+        matrix[row_pos[query_idx], col_pos[target_idx]] = score
+    
+    row_ind, col_ind = linear_sum_assignment(matrix, maximize=True)
+    pairs.extend(
+        (rows[r], cols[c], float(matrix[r, c]))
+        for r, c in zip(row_ind, col_ind)
+        if matrix[r, c] >= threshold
+    )
+    return pairs, scores
+
+def _lock_confident_pairs(eligible: Dict[Tuple[int, int], float]) -> List[Tuple[int, int, float]]:
+    """Pasangan exact (skor 1.0) lalu pasangan yang saling menjadi satu-satunya skor tertinggi"""
+    pairs = []
+    used_queries, used_targets = set(), set()
+    
+    for (query_idx, target_idx), score in sorted(eligible.items()):
+        if score >= 1.0 and query_idx not in used_queries and target_idx not in used_targets:
+            pairs.append((query_idx, target_idx, score))
+            used_queries.add(query_idx)
+            used_targets.add(target_idx)
+    
+    best_for_query, best_for_target = {}, {}
+    for (query_idx, target_idx), score in eligible.items():
+        if query_idx in used_queries or target_idx in used_targets:
+            continue
+        for best, key, other in ((best_for_query, query_idx, target_idx), (best_for_target, target_idx, query_idx)):
+            current = best.get(key)
+            if current is None or score > current[1]:
+                best[key] = (other, score, True)
+            elif score == current[1]:
+                best[key] = (current[0], score, False)
+    
+    for query_idx, (target_idx, score, unique) in sorted(best_for_query.items()):
+        target_best = best_for_target[target_idx]
+        if unique and target_best[2] and target_best[0] == query_idx:
+            pairs.append((query_idx, target_idx, score))
+    return pairs
+
+def write_match_audit(match_audit: List[Dict], path: str) -> Optional[str]:
+    """Simpan audit matching ke CSV (None jika tidak ada pasangan kandidat)"""
+    if not match_audit:
+        return None
+    pd.DataFrame(match_audit).to_csv(path, index=False, encoding='utf-8-sig')
+    return path
+
+# ========== ROSTER INDEX PERSISTEN (SQLITE) ==========
+# Orang (NIK, nama ter-normalisasi), dokumen (hash isi + salinan PDF) dan profil hasil analisis disimpan
+# antar run, sehingga Assessment yang menyusul minggu depan langsung dipasangkan dengan CV yang sudah
+# pernah diupload, dan hanya profil orang yang input-nya berubah yang dihitung ulang.
+# Opt-in: roster dipakai bersama semua sesi di proses yang sama.
+ROSTER_INDEX_ENABLED = os.getenv("ROSTER_INDEX_ENABLED", "0") == "1"
+# Dokumen roster dipasangkan lewat exact NIK. Tanpa NIK (CV jarang mencantumkannya), default hanya nama yang
+# sama persis setelah normalisasi dan satu-satunya kandidat di kedua sisi, dan setiap pasangan dicatat di log.
+# Fuzzy nama ke roster hanya jika threshold ini > 0; nama berbeda orang mudah lolos 0.6
+# ("budi santoso" vs "budi hartono" = 0.75), jadi pakai nilai ketat (mis. 0.95).
+ROSTER_NAME_MATCH_THRESHOLD = float(os.getenv("ROSTER_NAME_MATCH_THRESHOLD", "0"))
+ROSTER_DIR = os.getenv("ROSTER_DIR", os.path.join(OCR_CACHE_DIR, "roster"))
+ROSTER_DB_PATH = os.getenv("ROSTER_DB_PATH", os.path.join(ROSTER_DIR, "roster.sqlite3"))
+# Salinan PDF adalah dokumen pribadi: dihapus setelah ROSTER_RETENTION_DAYS tanpa dilihat lagi,
+# dan yang paling lama tidak dilihat dihapus lebih dulu jika total melewati ROSTER_MAX_MB
+ROSTER_RETENTION_DAYS = float(os.getenv("ROSTER_RETENTION_DAYS", "30"))  # 0 = tanpa kedaluwarsa
+ROSTER_MAX_MB = int(os.getenv("ROSTER_MAX_MB", "512"))
+
+class RosterIndex:
+    """
+    Index roster di SQLite.
+    people: satu baris per orang (NIK unik jika ada); documents: dokumen per orang, key SHA-256 isi,
+    path menunjuk salinan PDF di documents_dir; profiles: hasil analisis terakhir per orang + key input-nya.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS people (
+            person_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nik TEXT UNIQUE,
+            name TEXT NOT NULL,
+            name_normalized TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_people_name ON people(name_normalized);
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_hash TEXT PRIMARY KEY,
+            person_id INTEGER NOT NULL REFERENCES people(person_id),
+            doc_type TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            path TEXT NOT NULL,
+            seen_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_documents_person ON documents(person_id, doc_type);
+        CREATE TABLE IF NOT EXISTS profiles (
+            person_id INTEGER PRIMARY KEY REFERENCES people(person_id),
+            input_key TEXT NOT NULL,
+            result_json TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+    
+    def __init__(self, db_path: str, documents_dir: str):
+        self.db_path = db_path
+        self.documents_dir = documents_dir
+        self._lock = threading.Lock()
+        self._initialized = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            os.makedirs(self.documents_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.executescript(self.SCHEMA)
+            self._initialized = True
+        return conn
+    
+    def _store_document(self, path: str) -> Tuple[str, str]:
+        """Salin PDF ke documents_dir (sekali per isi file). Returns: (doc_hash, path salinan)"""
+        doc_hash = _file_sha256(path)
+        stored_path = os.path.join(self.documents_dir, f"{doc_hash}.pdf")
+        if not os.path.exists(stored_path):
+            tmp_path = f"{stored_path}.{os.getpid()}.tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, stored_path)
+        return doc_hash, stored_path
+    
+    def find_document(self, nik: str, doc_type: str) -> Optional[Dict]:
+        """Dokumen terbaru bertipe doc_type milik orang dengan NIK ini (None jika tidak ada)"""
+        with self._lock, closing(self._connect()) as conn:
+            row = conn.execute(
+                """SELECT p.person_id, p.nik, p.name, d.doc_hash, d.filename, d.path FROM people p
+                   JOIN documents d ON d.person_id = p.person_id
+                   WHERE p.nik = ? AND d.doc_type = ? ORDER BY d.seen_at DESC LIMIT 1""",
+                (nik, doc_type)
+            ).fetchone()
+        if row and os.path.exists(row['path']):
+            return dict(row)
+        return None
+    
+    def people_with_document(self, doc_type: str, with_nik: Optional[bool] = None) -> List[Dict]:
+        """Orang yang punya dokumen doc_type (dokumen terbaru per orang); with_nik membatasi ada/tidaknya NIK"""
+        query = """SELECT p.person_id, p.nik, p.name, d.doc_hash, d.filename, d.path, MAX(d.seen_at) AS seen_at
+                   FROM people p JOIN documents d ON d.person_id = p.person_id
+                   WHERE d.doc_type = ?"""
+        if with_nik is True:
+            query += " AND p.nik IS NOT NULL"
+        elif with_nik is False:
+            query += " AND p.nik IS NULL"
+        query += " GROUP BY p.person_id"
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute(query, (doc_type,)).fetchall()
+        return [dict(row) for row in rows if os.path.exists(row['path'])]
+    
+    def record_person(self, nik: Optional[str], name: str, documents: List[Tuple[str, str, str]]) -> int:
+        """
+        Simpan/perbarui orang beserta dokumennya [(doc_type, path, filename)].
+        Orang dikenali dari NIK, atau dari dokumen yang sudah tercatat (hash isi sama) milik orang
+        dengan NIK sama/kosong; tidak pernah dari nama saja. Returns: person_id
+        """
+        stored = [(doc_type, filename) + self._store_document(path) for doc_type, path, filename in documents if path]
+        now = time.time()
+        with self._lock, closing(self._connect()) as conn, conn:
+            row = None
+            if nik:
+                row = conn.execute("SELECT person_id FROM people WHERE nik = ?", (nik,)).fetchone()
+            for _, _, doc_hash, _ in stored:
+                if row is not None:
+                    break
+                row = conn.execute(
+                    "SELECT p.person_id FROM documents d JOIN people p ON p.person_id = d.person_id "
+                    "WHERE d.doc_hash = ? AND (p.nik IS NULL OR p.nik = ?)",
+                    (doc_hash, nik)
+                ).fetchone()
+            
+            if row is None:
+                person_id = conn.execute(
+                    "INSERT INTO people (nik, name, name_normalized, updated_at) VALUES (?, ?, ?, ?)",
+                    (nik, name, normalize_person_name(name), now)
+                ).lastrowid
+            else:
+                person_id = row['person_id']
+                conn.execute(
+                    "UPDATE people SET nik = COALESCE(?, nik), name = ?, name_normalized = ?, updated_at = ? "
+                    "WHERE person_id = ?",
+                    (nik, name, normalize_person_name(name), now, person_id)
+                )
+            
+            for doc_type, filename, doc_hash, stored_path in stored:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (doc_hash, person_id, doc_type, filename, path, seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_hash, person_id, doc_type, filename, stored_path, now)
+                )
+        return person_id
+    
+    def prune(self, retention_seconds: Optional[float], max_bytes: int) -> int:
+        """
+        Hapus dokumen yang tidak dilihat lebih lama dari retention_seconds, lalu yang paling lama
+        tidak dilihat sampai total salinan PDF <= max_bytes. Orang tanpa dokumen tersisa ikut dihapus
+        beserta profilnya. Returns: jumlah dokumen yang dihapus
+        """
+        with self._lock, closing(self._connect()) as conn, conn:
+            rows = conn.execute("SELECT doc_hash, path, seen_at FROM documents ORDER BY seen_at").fetchall()
+            sizes = {row['doc_hash']: os.path.getsize(row['path']) if os.path.exists(row['path']) else 0
+                     for row in rows}
+            total = sum(sizes.values())
+            now = time.time()
+            
+            removed = []
+            for row in rows:
+                expired = retention_seconds is not None and now - row['seen_at'] > retention_seconds
+                if not expired and total <= max_bytes and os.path.exists(row['path']):
+                    continue
+                removed.append(row)
+                total -= sizes[row['doc_hash']]
+            
+            for row in removed:
+                conn.execute("DELETE FROM documents WHERE doc_hash = ?", (row['doc_hash'],))
+                if os.path.exists(row['path']):
+                    os.remove(row['path'])
+            if removed:
+                conn.execute("DELETE FROM profiles WHERE person_id NOT IN (SELECT person_id FROM documents)")
+                conn.execute("DELETE FROM people WHERE person_id NOT IN (SELECT person_id FROM documents)")
+        return len(removed)
+    
+    def get_profile(self, person_id: int, input_key: str) -> Optional[Dict]:
+        """Hasil analisis tersimpan jika input orang ini tidak berubah sejak analisis terakhir"""
+        with self._lock, closing(self._connect()) as conn:
+            row = conn.execute("SELECT input_key, result_json FROM profiles WHERE person_id = ?",
+                               (person_id,)).fetchone()
+        if row is None or row['input_key'] != input_key:
+            return None
+        return json.loads(row['result_json'])
+    
+    def save_profile(self, person_id: int, input_key: str, result: Dict):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO profiles (person_id, input_key, result_json, updated_at) VALUES (?, ?, ?, ?)",
+                (person_id, input_key, json.dumps(result, ensure_ascii=False, default=str), time.time())
+            )
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock, closing(self._connect()) as conn:
+            return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ('people', 'documents', 'profiles')}
+    
+    def clear(self):
+        with self._lock:
+            for path in (self.db_path, self.documents_dir):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+            self._initialized = False
+
+ROSTER_INDEX = RosterIndex(ROSTER_DB_PATH, os.path.join(ROSTER_DIR, "documents"))
+
+def clear_roster_index():
+    """Membersihkan roster index (orang, dokumen tersimpan dan profil)"""
+    ROSTER_INDEX.clear()
+    print("✓ Roster index cleared")
+
+def profile_input_key(person_data: Dict, competencies: List[Dict]) -> str:
+    """Key input analisis satu orang: isi dokumen, competency, parameter OCR, prompt dan mode analisis"""
+    return make_cache_key(
+        'profile',
+        _file_sha256(person_data['CV']) if person_data.get('CV') else None,
+        _file_sha256(person_data['Assessment']) if person_data.get('Assessment') else None,
+        competencies, _ocr_params('ind'),
+        GEMINI_BACKEND, GEMINI_MODEL, PROMPT_VERSION, GEMINI_ANALYSIS_MODE, GEMINI_SECTION_CONTEXT,
+        COMPETENCY_FORMAT_MODE
+    )
+
+def attach_roster_profiles(matched_docs: Dict[str, Dict], competency_data: Dict, use_cache: bool = True) -> int:
+    """
+    Isi Profile_Key tiap orang yang tercatat di roster, dan Cached_Profile jika input-nya
+    (dokumen, competency, prompt) sama dengan analisis terakhir. Returns: jumlah profil yang dipakai ulang.
+    Seperti cache LLM, profil hanya disimpan/dipakai dengan backend live (hasil record/replay bukan hasil nyata).
+    """
+    reused = 0
+    if not isinstance(GEMINI_CLIENT.backend, LiveGeminiBackend):
+        return reused
+    for person_data in matched_docs.values():
+        if not person_data.get('Roster_ID'):
+            continue
+        try:
+            person_data['Profile_Key'] = profile_input_key(person_data, competency_data.get(person_data['NIK'], []))
+            cached = ROSTER_INDEX.get_profile(person_data['Roster_ID'], person_data['Profile_Key']) if use_cache else None
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"  ⚠ Profil roster {person_data['Nama']} tidak bisa dibaca: {e}")
+            continue
+        if cached:
+            person_data['Cached_Profile'] = cached
+            reused += 1
+    return reused
+
 def extract_name_from_filename(filename):
     """Ekstrak nama dari filename dengan berbagai pattern"""
     # Hapus ekstensi file
@@ -631,13 +3563,131 @@ def extract_name_from_filename(filename):
     
     return name
 
-def group_and_match_documents(pdf_files: List[str]) -> Dict[str, Dict]:
+def _unique_name_pairs(query_names: List[List[str]], target_names: List[str]) -> List[Tuple[int, int, float]]:
+    """
+    Pasangan nama yang sama persis setelah normalize_person_name dan unik di kedua sisi:
+    query dengan lebih dari satu target bernama sama (atau target yang diklaim beberapa query) dilewati.
+    Returns: [(idx_query, idx_target, 1.0)]
+    """
+    targets_by_name = defaultdict(list)
+    for target_idx, name in enumerate(target_names):
+        normalized = normalize_person_name(name)
+        if normalized:
+            targets_by_name[normalized].append(target_idx)
+    
+    claims = {}
+    for query_idx, names in enumerate(query_names):
+        candidates = {target_idx for name in names if name
+                      for target_idx in targets_by_name.get(normalize_person_name(name), [])}
+        if len(candidates) == 1:
+            claims[query_idx] = candidates.pop()
+    claimed = Counter(claims.values())
+    return [(query_idx, target_idx, 1.0) for query_idx, target_idx in claims.items() if claimed[target_idx] == 1]
+
+def _match_with_roster(assessments: List[Dict], cvs: List[Dict],
+                       paired_assessments: Set[int], paired_cvs: Set[int]) -> Tuple[Dict, Dict]:
+    """
+    Pasangkan Assessment/CV yang belum punya pasangan di upload ini dengan dokumen dari upload sebelumnya.
+    Exact NIK; tanpa NIK (Assessment vs CV roster tanpa NIK, CV tanpa NIK vs Assessment roster) lewat nama:
+    nama sama persis dan unik (default), atau fuzzy jika ROSTER_NAME_MATCH_THRESHOLD > 0.
+    Returns: ({idx_assessment: (dokumen_roster, skor, metode)}, {idx_cv: (dokumen_roster, skor, metode)})
+    """
+    assessment_matches, cv_matches = {}, {}
+    try:
+        current_hashes = {_file_sha256(assessment['assessment_data']['path']) for assessment in assessments}
+        current_hashes |= {_file_sha256(cv['path']) for cv in cvs}
+        current_niks = {assessment['nik'] for assessment in assessments} | {cv['nik'] for cv in cvs if cv['nik']}
+        
+        def _usable(stored: Optional[Dict]) -> bool:
+            # Dokumen yang ikut diupload lagi di run ini sudah ditangani matching biasa
+            return stored is not None and stored['doc_hash'] not in current_hashes
+        
+        for idx, assessment in enumerate(assessments):
+            if idx not in paired_assessments:
+                stored = ROSTER_INDEX.find_document(assessment['nik'], 'CV')
+                if _usable(stored):
+                    assessment_matches[idx] = (stored, 1.0, 'roster_nik')
+        for idx, cv in enumerate(cvs):
+            if idx not in paired_cvs and cv['nik']:
+                stored = ROSTER_INDEX.find_document(cv['nik'], 'ASSESSMENT')
+                if _usable(stored):
+                    cv_matches[idx] = (stored, 1.0, 'roster_nik')
+        
+        def _name_pairs(query_names: List[List[str]], target_names: List[str]) -> Tuple[List, str]:
+            if ROSTER_NAME_MATCH_THRESHOLD > 0:
+                pairs, _ = match_names(query_names, target_names, threshold=ROSTER_NAME_MATCH_THRESHOLD)
+                return pairs, 'roster_nama'
+            return _unique_name_pairs(query_names, target_names), 'roster_nama_unik'
+        
+        def _log_name_match(filename: str, stored: Dict, score: float):
+            print(f"  ⚠ Roster: {filename} dipasangkan lewat nama dengan {stored['filename']} "
+                  f"(upload sebelumnya, '{stored['name']}', skor {score:.2f}), periksa match audit")
+        
+        remaining = [idx for idx in range(len(assessments))
+                     if idx not in paired_assessments and idx not in assessment_matches]
+        stored_cvs = [stored for stored in ROSTER_INDEX.people_with_document('CV', with_nik=False) if _usable(stored)]
+        if remaining and stored_cvs:
+            pairs, method = _name_pairs(
+                [[assessments[idx]['name_from_filename'], assessments[idx]['assessment_data']['extracted_name']]
+                 for idx in remaining],
+                [stored['name'] for stored in stored_cvs]
+            )
+            for query_idx, target_idx, score in pairs:
+                assessment_matches[remaining[query_idx]] = (stored_cvs[target_idx], score, method)
+                _log_name_match(assessments[remaining[query_idx]]['assessment_data']['filename'],
+                                stored_cvs[target_idx], score)
+        
+        remaining = [idx for idx, cv in enumerate(cvs) if idx not in paired_cvs and not cv['nik']]
+        stored_assessments = [
+            stored for stored in ROSTER_INDEX.people_with_document('ASSESSMENT', with_nik=True)
+            if _usable(stored) and stored['nik'] not in current_niks
+        ]
+        if remaining and stored_assessments:
+            pairs, method = _name_pairs([[cvs[idx]['name_from_filename']] for idx in remaining],
+                                        [stored['name'] for stored in stored_assessments])
+            for query_idx, target_idx, score in pairs:
+                cv_matches[remaining[query_idx]] = (stored_assessments[target_idx], score, method)
+                _log_name_match(cvs[remaining[query_idx]]['filename'], stored_assessments[target_idx], score)
+    except (sqlite3.Error, OSError) as e:
+        print(f"  ⚠ Roster index tidak bisa dibaca: {e}")
+        return {}, {}
+    
+    return assessment_matches, cv_matches
+
+def _record_roster(matched_documents: Dict[str, Dict], unmatched_assessments: List[Dict]):
+    """Catat semua orang di run ini (termasuk Assessment tanpa CV) ke roster index; isi Roster_ID"""
+    try:
+        for person_data in matched_documents.values():
+            documents = [('CV', person_data['CV'], person_data['CV_filename']),
+                         ('ASSESSMENT', person_data['Assessment'], person_data['Assessment_filename'])]
+            person_data['Roster_ID'] = ROSTER_INDEX.record_person(person_data['NIK'] or None, person_data['Nama'],
+                                                                  documents)
+        for assessment in unmatched_assessments:
+            data = assessment['assessment_data']
+            ROSTER_INDEX.record_person(assessment['nik'], assessment['name_from_filename'],
+                                       [('ASSESSMENT', data['path'], data['filename'])])
+        removed = ROSTER_INDEX.prune(ROSTER_RETENTION_DAYS * 86400 if ROSTER_RETENTION_DAYS > 0 else None,
+                                     ROSTER_MAX_MB * 1024 * 1024)
+        if removed:
+            print(f"Roster index: {removed} dokumen lama dihapus (retensi)")
+        print(f"Roster index: {ROSTER_INDEX.stats()}")
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠ Gagal memperbarui roster index: {e}")
+
+def group_and_match_documents(pdf_files: List[str], competency_data: Optional[Dict] = None,
+                              match_audit: Optional[List[Dict]] = None) -> Dict[str, Dict]:
     """
-    Mengelompokkan dan mencocokkan CV dengan Assessment berdasarkan nama
+    Mengelompokkan dan mencocokkan CV dengan Assessment.
+    Join exact NIK dulu (NIK dari Assessment, teks halaman 1 CV dan nama file; angka tanpa label
+    hanya dipakai jika ada di competency_data), lalu fuzzy nama untuk sisanya.
+    match_audit (opsional): list milik pemanggil yang diisi satu baris per pasangan kandidat + skor.
     """
     print("\n" + "="*60)
     print("MENGGABUNGKAN CV DENGAN ASSESSMENT BERDASARKAN NAMA")
     print("="*60)
+    if match_audit is None:
+        match_audit = []
+    known_niks = set(competency_data or {})
     
     # Kelompokkan dokumen berdasarkan nama dari filename
     documents_by_filename_name = defaultdict(list)
@@ -666,45 +3716,53 @@ def group_and_match_documents(pdf_files: List[str]) -> Dict[str, Dict]:
     unmatched_assessments = []
     assessments_with_nik = {}
     
-    print(f"\nMencari NIK dari file Assessment...")
+    print(f"\nMencari NIK dari file Assessment (identifikasi cepat header halaman 1)...")
+    
+    # Identifikasi cepat semua Assessment; OCR penuh ditunda ke fase analisis
+    # dan hanya untuk Assessment yang berhasil dimatch dengan CV
+    assessment_docs = [
+        (name, doc)
+        for name, docs in documents_by_filename_name.items()
+        for doc in docs
+        if doc['type'] == 'ASSESSMENT'
+    ]
+    identities = identify_documents([doc['path'] for _, doc in assessment_docs], known_niks=known_niks)
     
     # Proses semua Assessment untuk ekstrak NIK dan nama
-    for name, docs in documents_by_filename_name.items():
-        for doc in docs:
-            if doc['type'] == 'ASSESSMENT':
-                print(f"  Memproses Assessment: {doc['filename']}")
-                
-                # MODIFIKASI: Gunakan caching untuk menghindari OCR duplikat
-                text, from_cache = get_cached_ocr_text(doc['path'])
-                
-                if from_cache:
-                    print(f"    ✓ Menggunakan hasil OCR dari cache")
-                else:
-                    print(f"    ✓ Melakukan OCR baru dan menyimpan ke cache")
-                
-                nik, extracted_name = extract_nik_and_name_from_text(text)
-                
-                if nik:
-                    print(f"    ✓ NIK ditemukan: {nik}")
-                    assessments_with_nik[nik] = {
-                        'path': doc['path'],
-                        'filename': doc['filename'],
-                        'extracted_name': extracted_name,
-                        'name_from_filename': name,
-                        'ocr_text': text  # Simpan teks untuk digunakan nanti
-                    }
-                    
-                    # Tambahkan ke unmatched untuk matching nanti
-                    unmatched_assessments.append({
-                        'nik': nik,
-                        'assessment_data': assessments_with_nik[nik],
-                        'name_from_filename': name
-                    })
-                else:
-                    print(f"    ✗ NIK tidak ditemukan")
+    for name, doc in assessment_docs:
+        print(f"  Memproses Assessment: {doc['filename']}")
+        identity = identities.get(doc['path'], {})
+        
+        if identity.get('from_cache'):
+            print(f"    ✓ Menggunakan hasil identifikasi dari cache")
+        
+        filename_labeled, filename_bare = extract_nik_candidates(_nik_text_from_filename(doc['filename']))
+        nik = resolve_nik(identity.get('nik_labeled', []) + filename_labeled,
+                          identity.get('nik_bare', []) + filename_bare,
+                          known_niks) or normalize_nik(identity.get('nik'))
+        extracted_name = identity.get('name')
+        
+        if nik:
+            print(f"    ✓ NIK ditemukan: {nik} (sumber: {identity.get('stage')})")
+            assessments_with_nik[nik] = {
+                'path': doc['path'],
+                'filename': doc['filename'],
+                'extracted_name': extracted_name,
+                'name_from_filename': name,
+                'ocr_text': ''  # OCR penuh dilakukan saat analisis
+            }
+            
+            # Tambahkan ke unmatched untuk matching nanti
+            unmatched_assessments.append({
+                'nik': nik,
+                'assessment_data': assessments_with_nik[nik],
+                'name_from_filename': name
+            })
+        else:
+            print(f"    ✗ NIK tidak ditemukan")
     
     print(f"\nTotal Assessment dengan NIK: {len(assessments_with_nik)}")
-    print(f"Ukuran cache OCR: {len(OCR_CACHE)} file")
+    print(f"Cache OCR: {format_cache_stats(OCR_CACHE)}")
     
     # Sekarang coba match CV dengan Assessment
     print(f"\nMencocokkan CV dengan Assessment...")
@@ -719,49 +3777,146 @@ def group_and_match_documents(pdf_files: List[str]) -> Dict[str, Dict]:
                 cv_documents.append({
                     'path': doc['path'],
                     'filename': doc['filename'],
-                    'name_from_filename': name
+                    'name_from_filename': name,
+                    'nik': None
                 })
                 all_cv_names.append(name)
     
     print(f"Total CV ditemukan: {len(cv_documents)}")
     print(f"Total Assessment dengan NIK: {len(unmatched_assessments)}")
     
-    # Matching logic
-    for assessment in unmatched_assessments:
+    # NIK CV: pass murah halaman 1 + nama file. NIK CV hanya dipakai sebagai key join jika dikenal
+    # (ada di Assessment atau competency); selain itu CV tetap ikut fuzzy nama.
+    cv_known_niks = known_niks | {assessment['nik'] for assessment in unmatched_assessments}
+    cv_identities = {}
+    if CV_ID_MAX_PAGES > 0 and cv_documents:
+        print(f"\nMencari NIK di CV (halaman 1 dan nama file)...")
+        cv_identities = identify_documents([cv['path'] for cv in cv_documents], max_pages=CV_ID_MAX_PAGES,
+                                           known_niks=cv_known_niks)
+    for cv in cv_documents:
+        identity = cv_identities.get(cv['path'], {})
+        filename_labeled, filename_bare = extract_nik_candidates(_nik_text_from_filename(cv['filename']))
+        cv['nik'] = resolve_nik(identity.get('nik_labeled', []) + filename_labeled,
+                                identity.get('nik_bare', []) + filename_bare, cv_known_niks, require_known=True)
+        if cv['nik']:
+            print(f"  ✓ NIK CV {cv['filename']}: {cv['nik']}")
+    
+    # Join exact NIK (hash lookup)
+    assessment_indices_by_nik = defaultdict(list)
+    for assessment_idx, assessment in enumerate(unmatched_assessments):
+        assessment_indices_by_nik[assessment['nik']].append(assessment_idx)
+    
+    pairs = []
+    for cv_idx, cv in enumerate(cv_documents):
+        if cv['nik'] and assessment_indices_by_nik.get(cv['nik']):
+            pairs.append((assessment_indices_by_nik[cv['nik']].pop(0), cv_idx, 1.0, 'nik'))
+    for assessment_idx, cv_idx, score, method in pairs:
+        match_audit.append({
+            'nik': unmatched_assessments[assessment_idx]['nik'],
+            'assessment': unmatched_assessments[assessment_idx]['assessment_data']['filename'],
+            'cv': cv_documents[cv_idx]['filename'],
+            'score': score,
+            'rank': 1,
+            'chosen': True,
+            'method': method,
+        })
+    print(f"Match via NIK: {len(pairs)}")
+    
+    # Sisanya: fuzzy nama (blocking token/trigram + assignment optimal global).
+    # CV yang punya NIK sendiri tidak dipasangkan ke Assessment dengan NIK lain.
+    nik_matched = {assessment_idx for assessment_idx, _, _, _ in pairs}
+    remaining_assessments = [idx for idx in range(len(unmatched_assessments)) if idx not in nik_matched]
+    remaining_cvs = [idx for idx, cv in enumerate(cv_documents) if not cv['nik']]
+    assessment_names = [
+        [unmatched_assessments[idx]['name_from_filename'], unmatched_assessments[idx]['assessment_data']['extracted_name']]
+        for idx in remaining_assessments
+    ]
+    name_pairs, name_scores = match_names(assessment_names,
+                                          [cv_documents[idx]['name_from_filename'] for idx in remaining_cvs])
+    candidate_scores = {
+        (remaining_assessments[query_idx], remaining_cvs[target_idx]): score
+        for (query_idx, target_idx), score in name_scores.items()
+    }
+    pairs.extend((remaining_assessments[query_idx], remaining_cvs[target_idx], score, 'nama')
+                 for query_idx, target_idx, score in name_pairs)
+    chosen = {(assessment_idx, cv_idx) for assessment_idx, cv_idx, _, _ in pairs}
+    print(f"Pasangan kandidat diberi skor: {len(candidate_scores)} "
+          f"(dari {len(remaining_assessments) * len(remaining_cvs)} kemungkinan)")
+    
+    # Audit: top kandidat per Assessment beserta skornya
+    candidates_by_assessment = defaultdict(list)
+    for (assessment_idx, cv_idx), score in candidate_scores.items():
+        candidates_by_assessment[assessment_idx].append((score, cv_idx))
+    for assessment_idx, candidates in candidates_by_assessment.items():
+        assessment = unmatched_assessments[assessment_idx]
+        for rank, (score, cv_idx) in enumerate(sorted(candidates, reverse=True)[:MATCH_AUDIT_TOP_N], 1):
+            match_audit.append({
+                'nik': assessment['nik'],
+                'assessment': assessment['assessment_data']['filename'],
+                'cv': cv_documents[cv_idx]['filename'],
+                'score': round(score, 4),
+                'rank': rank,
+                'chosen': (assessment_idx, cv_idx) in chosen,
+                'method': 'nama',
+            })
+    
+    # Roster index: sisa dokumen dipasangkan dengan orang dari upload sebelumnya.
+    # Dokumen roster ditambahkan sebagai CV/Assessment biasa agar alur di bawah tetap sama.
+    if ROSTER_INDEX_ENABLED:
+        roster_for_assessments, roster_for_cvs = _match_with_roster(
+            unmatched_assessments, cv_documents,
+            {assessment_idx for assessment_idx, _, _, _ in pairs}, {cv_idx for _, cv_idx, _, _ in pairs}
+        )
+        for assessment_idx, (stored, score, method) in roster_for_assessments.items():
+            cv_documents.append({
+                'path': stored['path'],
+                'filename': stored['filename'],
+                'name_from_filename': stored['name'],
+                'nik': stored['nik']
+            })
+            pairs.append((assessment_idx, len(cv_documents) - 1, score, method))
+        for cv_idx, (stored, score, method) in roster_for_cvs.items():
+            unmatched_assessments.append({
+                'nik': stored['nik'],
+                'assessment_data': {
+                    'path': stored['path'],
+                    'filename': stored['filename'],
+                    'extracted_name': None,
+                    'name_from_filename': stored['name'],
+                    'ocr_text': ''
+                },
+                'name_from_filename': stored['name']
+            })
+            pairs.append((len(unmatched_assessments) - 1, cv_idx, score, method))
+        for assessment_idx, cv_idx, score, method in pairs:
+            if method.startswith('roster'):
+                match_audit.append({
+                    'nik': unmatched_assessments[assessment_idx]['nik'],
+                    'assessment': unmatched_assessments[assessment_idx]['assessment_data']['filename'],
+                    'cv': cv_documents[cv_idx]['filename'],
+                    'score': round(score, 4),
+                    'rank': 1,
+                    'chosen': True,
+                    'method': method,
+                })
+        print(f"Match dengan roster upload sebelumnya: {len(roster_for_assessments) + len(roster_for_cvs)}")
+    
+    matched_assessments = {assessment_idx: (cv_idx, score, method) for assessment_idx, cv_idx, score, method in pairs}
+    matched_cv_indices = set()
+    for assessment_idx, assessment in enumerate(unmatched_assessments):
         nik = assessment['nik']
-        assessment_name_from_filename = assessment['name_from_filename']
-        assessment_extracted_name = assessment['assessment_data']['extracted_name']
-        
-        best_match = None
-        best_match_name = None
-        best_score = 0
         
-        # Cari CV yang cocok
-        for cv in cv_documents:
-            cv_name = cv['name_from_filename']
-            
-            # Cek similarity dengan nama dari filename Assessment
-            score1 = similarity_ratio(cv_name, assessment_name_from_filename)
-            
-            # Cek similarity dengan nama yang diekstrak dari Assessment
-            if assessment_extracted_name:
-                score2 = similarity_ratio(cv_name, assessment_extracted_name)
-            else:
-                score2 = 0
-            
-            score = max(score1, score2)
+        if assessment_idx in matched_assessments:
+            cv_idx, best_score, method = matched_assessments[assessment_idx]
+            best_match = cv_documents[cv_idx]
+            best_match_name = best_match['name_from_filename']
+            matched_cv_indices.add(cv_idx)
             
-            if score > best_score and score >= 0.6:  # Threshold 60%
-                best_score = score
-                best_match = cv
-                best_match_name = cv_name
-        
-        if best_match:
             print(f"\n✓ Ditemukan match:")
             print(f"  NIK: {nik}")
             print(f"  Assessment: {assessment['assessment_data']['filename']}")
             print(f"  CV: {best_match['filename']}")
-            print(f"  Similarity score: {best_score:.2f}")
+            print(f"  Similarity score: {best_score:.2f} (via {method})")
             
             # Buat key unik
             person_key = f"{nik}_{best_match_name}"
@@ -774,55 +3929,125 @@ def group_and_match_documents(pdf_files: List[str]) -> Dict[str, Dict]:
                 'Assessment': assessment['assessment_data']['path'],
                 'Assessment_filename': assessment['assessment_data']['filename'],
                 'Assessment_ocr_text': assessment['assessment_data'].get('ocr_text', ''),  # Simpan teks OCR
-                'Match_Score': best_score
+                'Match_Score': best_score,
+                'Match_Method': method
             }
-            
-            # Hapus CV yang sudah dimatch dari list
-            cv_documents = [cv for cv in cv_documents if cv['path'] != best_match['path']]
         else:
+            candidates = sorted(candidates_by_assessment.get(assessment_idx, []), reverse=True)
             print(f"\n✗ Tidak ditemukan match untuk Assessment: {assessment['assessment_data']['filename']}")
+            if candidates:
+                score, cv_idx = candidates[0]
+                print(f"  Kandidat terdekat: {cv_documents[cv_idx]['filename']} (skor {score:.2f})")
+    
+    cv_documents = [cv for cv_idx, cv in enumerate(cv_documents) if cv_idx not in matched_cv_indices]
     
     # Tambahkan CV yang tidak memiliki match
+    # (CV dengan NIK sendiri tetap membawa NIK-nya sehingga competency tetap ditemukan)
     for cv in cv_documents:
-        person_key = f"NO_NIK_{cv['name_from_filename']}"
+        person_key = f"{cv['nik']}_{cv['name_from_filename']}" if cv['nik'] else f"NO_NIK_{cv['name_from_filename']}"
         matched_documents[person_key] = {
-            'NIK': '',
+            'NIK': cv['nik'] or '',
             'Nama': cv['name_from_filename'],
             'CV': cv['path'],
             'CV_filename': cv['filename'],
             'Assessment': '',
             'Assessment_filename': '',
             'Assessment_ocr_text': '',
-            'Match_Score': 0
+            'Match_Score': 0,
+            'Match_Method': ''
         }
         print(f"\n⚠ CV tanpa match: {cv['filename']}")
     
+    if ROSTER_INDEX_ENABLED:
+        _record_roster(matched_documents, [assessment for assessment_idx, assessment in enumerate(unmatched_assessments)
+                                           if assessment_idx not in matched_assessments])
+    
     print(f"\n" + "="*60)
     print("HASIL MATCHING:")
     print(f"Total pasangan CV-Assessment: {len([v for v in matched_documents.values() if v['Assessment']])}")
     print(f"Total CV tanpa Assessment: {len([v for v in matched_documents.values() if not v['Assessment']])}")
-    print(f"Ukuran cache OCR akhir: {len(OCR_CACHE)} file")
+    if known_niks:
+        with_competency = len([v for v in matched_documents.values() if v['NIK'] in known_niks])
+        print(f"Orang dengan data competency (join NIK): {with_competency}/{len(matched_documents)}")
+    print(f"Cache OCR akhir: {format_cache_stats(OCR_CACHE)}")
     print("="*60)
     
     return matched_documents
 
-def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_folder: str) -> List[Dict]:
+def _get_document_text(pdf_path: str, ocr_futures: Optional[Dict[str, Future]] = None) -> Tuple[str, bool]:
+    """Teks dokumen dari scheduler OCR jika sudah dijadwalkan, selain itu dari cache/OCR langsung"""
+    if ocr_futures and pdf_path in ocr_futures:
+        try:
+            return ocr_futures[pdf_path].result()
+        except Exception as e:
+            print(f"    ⚠ Scheduler OCR gagal untuk dokumen ini ({e}), OCR ulang langsung")
+    return get_cached_ocr_text(pdf_path)
+
+def _iter_ready_candidates(matched_docs: Dict, ocr_futures: Optional[Dict[str, Future]] = None):
+    """
+    Urutkan kandidat menurut selesainya OCR: kandidat yang semua dokumennya sudah selesai
+    (cache, profil roster, tanpa scheduler) lebih dulu, sisanya begitu Future dokumennya selesai.
+    Yields: (person_key, person_data)
+    """
+    pending = {}
+    for person_key, person_data in matched_docs.items():
+        futures = set()
+        if ocr_futures and not person_data.get('Cached_Profile'):
+            paths = [person_data['CV']]
+            if not person_data.get('Assessment_ocr_text'):
+                paths.append(person_data['Assessment'])
+            futures = {ocr_futures[path] for path in paths if path and path in ocr_futures}
+        futures = {future for future in futures if not future.done()}
+        if futures:
+            pending[person_key] = futures
+        else:
+            yield person_key, person_data
+    
+    while pending:
+        wait(set().union(*pending.values()), return_when=FIRST_COMPLETED)
+        for person_key in list(pending):
+            pending[person_key] = {future for future in pending[person_key] if not future.done()}
+            if not pending[person_key]:
+                del pending[person_key]
+                yield person_key, matched_docs[person_key]
+
+def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_folder: str,
+                              ocr_futures: Optional[Dict[str, Future]] = None,
+                              use_llm_cache: bool = True) -> List[Dict]:
     """
-    Proses dokumen yang sudah dimatch
+    Proses dokumen yang sudah dimatch.
+    ocr_futures: hasil OCRScheduler.submit_documents; kandidat diproses menurut urutan selesainya
+    OCR dokumennya (bukan urutan matched_docs) sementara halaman kandidat lain masih dikerjakan
+    di background. Hasil tetap dikembalikan dalam urutan matched_docs.
+    use_llm_cache=False memaksa semua analisis Gemini dipanggil ulang.
     """
     print("\n" + "="*60)
     print("MEMPROSES DOKUMEN YANG SUDAH DIMATCH")
     print("="*60)
     
-    all_results = []
+    all_results = {}
     
-    for i, (person_key, person_data) in enumerate(matched_docs.items(), 1):
+    # Mode batch: competency semua kandidat dengan NIK yang sudah diketahui diformat sekaligus
+    batch_competency = {}
+    if COMPETENCY_FORMAT_MODE == "batch":
+        known_niks = {person_data['NIK'] for person_data in matched_docs.values()
+                      if person_data['NIK'] and not person_data.get('Cached_Profile')}
+        batch_competency = _run_coroutine_sync(generate_competency_batch_async(
+            {nik: competency_data[nik] for nik in known_niks if nik in competency_data}, use_llm_cache
+        ))
+    
+    for i, (person_key, person_data) in enumerate(_iter_ready_candidates(matched_docs, ocr_futures), 1):
         nik = person_data['NIK']
         nama = person_data['Nama']
         
         print(f"\n[{i}/{len(matched_docs)}] Memproses: {nama}")
         print(f"  NIK: {nik if nik else 'Tidak ditemukan'}")
         
+        if person_data.get('Cached_Profile'):
+            all_results[person_key] = dict(person_data['Cached_Profile'], Match_Score=person_data.get('Match_Score', 0))
+            print(f"  ✓ Dokumen dan competency tidak berubah, memakai profil dari roster index")
+            continue
+        
         # Gabungkan teks dari CV dan Assessment jika ada
         all_text = ""
         source_files = []
@@ -833,7 +4058,7 @@ def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_
             cv_txt_path = os.path.join(output_folder, f"hasil_cv_{nama.replace(' ', '_')}.txt")
             
             # MODIFIKASI: Gunakan caching untuk CV juga
-            cv_text, from_cache = get_cached_ocr_text(person_data['CV'])
+            cv_text, from_cache = _get_document_text(person_data['CV'], ocr_futures)
             
             if from_cache:
                 print(f"    ✓ Menggunakan hasil OCR CV dari cache")
@@ -867,7 +4092,7 @@ def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_
                 assessment_text = person_data['Assessment_ocr_text']
             else:
                 # Fallback: coba dari cache atau lakukan OCR baru
-                assessment_text, from_cache = get_cached_ocr_text(person_data['Assessment'])
+                assessment_text, from_cache = _get_document_text(person_data['Assessment'], ocr_futures)
                 if from_cache:
                     print(f"    ✓ Menggunakan hasil OCR Assessment dari cache")
                 else:
@@ -896,23 +4121,23 @@ def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_
                     nik = extracted_nik
                     print(f"  ✓ NIK ditemukan dari Assessment: {nik}")
         
-        # Analisis dengan Gemini AI
-        print(f"  Menganalisis dengan Gemini AI...")
-        ai_analysis = analyze_with_gemini_advanced(
-            all_text, 
-            categories=['education', 'experience', 'business_impact', 'position', 'summary_executive']
-        )
-        
-        # Ambil competency berdasarkan NIK dan generate dengan AI
-        skills_competency = ""
+        # Ambil competency berdasarkan NIK
+        competencies = []
         if nik and nik in competency_data:
             competencies = competency_data[nik]
             print(f"  ✓ Found {len(competencies)} competencies for NIK {nik}")
-            # Gunakan AI untuk generate competency
-            skills_competency = generate_competency_with_ai(competencies)
         else:
             print(f"  ✗ No competency data found for NIK: {nik}")
         
+        # Analisis dengan Gemini AI: kategori profil dan competency dikirim bersamaan
+        print(f"  Menganalisis dengan Gemini AI...")
+        ai_start = time.time()
+        ai_analysis, skills_competency = _run_coroutine_sync(
+            analyze_candidate_async(all_text, competencies, categories=PROFILE_CATEGORIES, use_cache=use_llm_cache,
+                                    skills_competency=batch_competency.get(nik), candidate=nama)
+        )
+        print(f"  ⏱ Analisis AI selesai dalam {time.time() - ai_start:.1f} s")
+        
         # Buat hasil
         result = {
             'nik': nik if nik else f"NO_NIK_{nama}",
@@ -929,22 +4154,42 @@ def process_matched_documents(matched_docs: Dict, competency_data: Dict, output_
             #'Assessment_File': person_data.get('Assessment_filename', '')
         }
         
-        all_results.append(result)
+        all_results[person_key] = result
+        # Profil dengan analisis gagal tidak disimpan agar dicoba lagi di run berikutnya
+        failed = any(str(value).startswith("Error:") or value == "Tidak dapat menganalisis dengan AI"
+                     for value in result.values())
+        if person_data.get('Profile_Key') and not failed:
+            try:
+                ROSTER_INDEX.save_profile(person_data['Roster_ID'], person_data['Profile_Key'], result)
+            except (sqlite3.Error, OSError) as e:
+                print(f"  ⚠ Gagal menyimpan profil ke roster index: {e}")
         print(f"  ✓ Selesai: {nama}")
     
-    return all_results
+    return [all_results[person_key] for person_key in matched_docs if person_key in all_results]
 
 def process_all_documents_with_competency(input_folder: str, excel_path: str, 
-                                         output_folder: str, output_excel: str = None) -> pd.DataFrame:
+                                         output_folder: str, output_excel: str = None,
+                                         use_llm_cache: bool = True) -> pd.DataFrame:
     """
-    Proses utama: membaca dokumen PDF, matching CV-Assessment, baca Excel competency
+    Proses utama: membaca dokumen PDF, matching CV-Assessment, baca Excel competency.
+    use_llm_cache=False melewati cache response Gemini (hasil baru tetap tidak ditulis ke cache).
     """
     
     # Buat output folder jika belum ada
     os.makedirs(output_folder, exist_ok=True)
     
-    # Bersihkan cache sebelum memulai
-    clear_ocr_cache()
+    # Cache OCR persisten antar run; cukup reset counter hit/miss dan buang entry yang kedaluwarsa
+    for cache in (OCR_CACHE, OCR_PAGE_CACHE, LLM_CACHE):
+        cache.prune()
+    OCR_CACHE.reset_stats()
+    OCR_PAGE_CACHE.reset_stats()
+    LLM_CACHE.reset_stats()
+    # Counter AI/OCR dipakai bersama semua sesi: snapshot di awal, laporan run memakai selisihnya
+    gemini_stats_start = GEMINI_CLIENT.stats()
+    GEMINI_CLIENT.reset_hedge_budget()
+    validation_stats_start = dict(VALIDATION_STATS)
+    ai_usage_start = AI_USAGE.mark()
+    ocr_skip_stats_start = snapshot_ocr_skip_stats()
     
     # 1. Baca data competency dari Excel
     print("="*60)
@@ -965,12 +4210,30 @@ def process_all_documents_with_competency(input_folder: str, excel_path: str,
     print(f"Total {len(pdf_files)} file PDF ditemukan")
     
     # 3. Kelompokkan dan match CV dengan Assessment
-    matched_documents = group_and_match_documents(pdf_files)
+    match_audit = []
+    matched_documents = group_and_match_documents(pdf_files, competency_data, match_audit)
     
-    # 4. Proses dokumen yang sudah dimatch
-    all_results = process_matched_documents(matched_documents, competency_data, output_folder)
+    # Profil yang input-nya tidak berubah sejak run sebelumnya dipakai ulang (tanpa OCR/AI)
+    if ROSTER_INDEX_ENABLED:
+        reused = attach_roster_profiles(matched_documents, competency_data, use_cache=use_llm_cache)
+        print(f"Profil dipakai ulang dari roster: {reused}/{len(matched_documents)}")
     
-    # 5. Buat DataFrame dan simpan ke Excel
+    # 4. Jadwalkan OCR semua dokumen sekaligus (satu antrian halaman lintas dokumen)
+    pending_ocr = []
+    for person_data in matched_documents.values():
+        if person_data.get('Cached_Profile'):
+            continue
+        if person_data['CV']:
+            pending_ocr.append(person_data['CV'])
+        if person_data['Assessment'] and not person_data.get('Assessment_ocr_text'):
+            pending_ocr.append(person_data['Assessment'])
+    ocr_futures = OCRScheduler().submit_documents(pending_ocr) if pending_ocr else {}
+    
+    # 5. Proses dokumen yang sudah dimatch
+    all_results = process_matched_documents(matched_documents, competency_data, output_folder, ocr_futures,
+                                            use_llm_cache=use_llm_cache)
+    
+    # 6. Buat DataFrame dan simpan ke Excel
     print("\n" + "="*60)
     print("MENYIMPAN HASIL KE EXCEL")
     print("="*60)
@@ -1036,7 +4299,36 @@ def process_all_documents_with_competency(input_folder: str, excel_path: str,
         print(f"✓ Kolom: {', '.join(df.columns.tolist())}")
         
         # Statistik caching
-        print(f"✓ Cache OCR digunakan: {len(OCR_CACHE)} file")
+        print(f"✓ Cache OCR: {format_cache_stats(OCR_CACHE)}")
+        print(f"✓ Cache OCR per halaman: {format_cache_stats(OCR_PAGE_CACHE)}")
+        print(f"✓ Cache response AI: {format_cache_stats(LLM_CACHE)}")
+        validation_stats = counter_delta(VALIDATION_STATS, validation_stats_start)
+        ocr_skip_stats = counter_delta(snapshot_ocr_skip_stats(), ocr_skip_stats_start)
+        print(f"✓ Gemini: {format_gemini_stats(gemini_stats_start)}")
+        print(f"✓ Validasi output AI: {format_validation_stats(validation_stats)}")
+        
+        # Laporan token & latency AI di sebelah file Excel
+        usage_summary = AI_USAGE.summary(ai_usage_start)
+        df.attrs['ai_usage'] = usage_summary
+        df.attrs['gemini_stats_start'] = gemini_stats_start
+        df.attrs['validation_stats'] = validation_stats
+        df.attrs['ocr_skip_stats'] = ocr_skip_stats
+        try:
+            usage_txt, _ = AI_USAGE.write_report(os.path.splitext(output_excel_path)[0], ai_usage_start)
+            df.attrs['ai_usage_report'] = usage_txt
+            print(f"✓ Laporan pemakaian AI: {usage_txt}")
+        except OSError as e:
+            print(f"⚠ Gagal menulis laporan pemakaian AI: {e}")
+        print(format_ai_usage_report(usage_summary))
+        print(f"✓ Halaman dilewati: {ocr_skip_stats['blank']} kosong, {ocr_skip_stats['duplicate']} duplikat")
+        
+        # Audit matching CV-Assessment (pasangan kandidat + skor) di sebelah file Excel
+        try:
+            audit_csv = write_match_audit(match_audit, f"{os.path.splitext(output_excel_path)[0]}_match_audit.csv")
+            if audit_csv:
+                print(f"✓ Audit matching: {audit_csv}")
+        except OSError as e:
+            print(f"⚠ Gagal menulis audit matching: {e}")
         
         # Statistik
         if 'nik' in df.columns:
@@ -1081,7 +4373,21 @@ def create_detailed_report(df: pd.DataFrame, output_folder: str):
         f.write(f"Tanggal: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"Total data: {len(df)} orang\n")
         f.write(f"Model AI: {GEMINI_MODEL}\n")
-        f.write(f"Cache OCR: {len(OCR_CACHE)} file\n\n")
+        f.write(f"Cache OCR: {format_cache_stats(OCR_CACHE)}\n")
+        f.write(f"Cache OCR per halaman: {format_cache_stats(OCR_PAGE_CACHE)}\n")
+        f.write(f"Cache response AI: {format_cache_stats(LLM_CACHE)}\n")
+        f.write(f"Gemini: {format_gemini_stats(df.attrs.get('gemini_stats_start'))}\n")
+        # Statistik per run dari snapshot process_all_documents_with_competency (bukan counter global)
+        if 'validation_stats' in df.attrs:
+            f.write(f"Validasi output AI: {format_validation_stats(df.attrs['validation_stats'])}\n")
+        if 'ai_usage' in df.attrs:
+            usage_total = df.attrs['ai_usage']['total']
+            f.write(f"Token AI: {usage_total['input_tokens']} input, {usage_total['output_tokens']} output "
+                    f"({usage_total['api_calls']} request API, {usage_total['cache_hits']} dari cache)\n")
+        if 'ocr_skip_stats' in df.attrs:
+            skipped = df.attrs['ocr_skip_stats']
+            f.write(f"Halaman dilewati: {skipped['blank']} kosong, {skipped['duplicate']} duplikat\n")
+        f.write("\n")
         
         # Statistik
         with_nik = df[df['nik'].str.contains('NO_NIK', na=False) == False].shape[0]
@@ -1221,7 +4527,8 @@ def main():
     print("PROSES SELESAI!")
     print("="*80)
     print(f"⏱ Waktu proses: {duration/60:.2f} menit")
-    print(f"📊 Cache OCR: {len(OCR_CACHE)} file diproses sekali saja")
+    print(f"📊 Cache OCR: {format_cache_stats(OCR_CACHE)} ({len(OCR_CACHE)} file tersimpan)")
+    print(f"📊 Cache response AI: {format_cache_stats(LLM_CACHE)} ({len(LLM_CACHE)} response tersimpan)")
     
     # Tampilkan path hasil
     print(f"\n📁 Hasil disimpan di:")
@@ -0,0 +1,254 @@
+import asyncio
+
+import pytest
+
+import ocr_processor as o
+
+
+def test_limiter_does_not_grow_when_limit_is_not_reached():
+    async def _run():
+        limiter = o.AdaptiveConcurrencyLimiter(4, maximum=32)
+        for _ in range(50):
+            await limiter.release(await limiter.acquire())
+        return limiter
+    
+    limiter = asyncio.run(_run())
+    
+    assert limiter.current_limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_limiter_grows_when_all_slots_are_used():
+    async def _run():
+        limiter = o.AdaptiveConcurrencyLimiter(2, maximum=32)
+        first, second = await limiter.acquire(), await limiter.acquire()
+        assert limiter.try_acquire() is None
+        await limiter.release(first)
+        await limiter.release(second)
+        return limiter, first, second
+    
+    limiter, first, second = asyncio.run(_run())
+    
+    assert not first.saturated and second.saturated
+    assert limiter.limit == pytest.approx(2.5)
+
+
+def test_limiter_halves_once_per_rate_limit_wave():
+    async def _run():
+        limiter = o.AdaptiveConcurrencyLimiter(8, maximum=32)
+        slots = [await limiter.acquire() for _ in range(3)]
+        await limiter.release(slots[0], success=False, rate_limited=True)
+        # 429 dari request yang dimulai sebelum penurunan tidak menurunkan lagi
+        await limiter.release(slots[1], success=False, rate_limited=True)
+        after_wave = limiter.limit
+        await limiter.release(slots[2], success=False)
+        await limiter.release(await limiter.acquire(), success=False, rate_limited=True)
+        return after_wave, limiter.limit
+    
+    after_wave, after_next = asyncio.run(_run())
+    
+    assert after_wave == pytest.approx(4)
+    assert after_next == pytest.approx(2)
+
+
+def test_ai_usage_summary_counts_only_calls_since_mark():
+    tracker = o.AIUsageTracker()
+    tracker.record(category='education', latency=1.0, input_tokens=10)
+    mark = tracker.mark()
+    tracker.record(category='experience', latency=2.0, input_tokens=20)
+    tracker.record(cache_hit=True, latency=0.0)
+    
+    summary = tracker.summary(mark)
+    
+    assert summary['total']['calls'] == 2
+    assert summary['total']['input_tokens'] == 20
+    assert set(summary['by_category']) == {'experience', '-'}
+    assert tracker.summary()['total']['calls'] == 3
+
+
+def test_counter_delta_reports_run_counts_without_reset():
+    start = {'invalid': 3, 'repaired': 1}
+    assert o.counter_delta({'invalid': 5, 'repaired': 1}, start) == {'invalid': 2, 'repaired': 0}
+
+
+class FakeBackend:
+    """Backend palsu: tiap request mengambil (delay, jawaban atau exception) berurutan dari script"""
+    
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+        self.cancelled = []
+    
+    async def generate(self, model_name, prompt, generation_config, safety_settings=None):
+        index = len(self.calls)
+        self.calls.append(model_name)
+        delay, outcome = self.script.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return o.BackendResponse(outcome)
+    
+    async def count_tokens(self, model_name, prompt):
+        return 0
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Hedging aktif setelah satu sampel latency; p95 = 0.02 s"""
+    monkeypatch.setattr(o, 'GEMINI_HEDGE_ENABLED', True)
+    monkeypatch.setattr(o, 'GEMINI_HEDGE_MIN_SAMPLES', 1)
+    monkeypatch.setattr(o, 'GEMINI_HEDGE_BUDGET', 1.0)
+    
+    def _client(script, rpm=0, max_retries=0):
+        client = o.GeminiClient(max_concurrency=4, rpm=rpm, tpm=0, max_retries=max_retries, timeout=5,
+                                backend=FakeBackend(script))
+        client.limiter._latencies.append(0.02)
+        return client
+    
+    return _client
+
+
+async def _settle():
+    """Beri kesempatan done callback (release slot hedge) berjalan"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_hedge_fires_after_p95_and_cancels_loser(hedging):
+    client = hedging([(1.0, 'primary'), (0.0, 'hedge')])
+    call_stats = {}
+    
+    async def _run():
+        response = await client.generate('prompt', {}, call_stats=call_stats)
+        await _settle()
+        return response
+    
+    response = asyncio.run(_run())
+    
+    assert response.text == 'hedge'
+    assert call_stats['hedged']
+    assert client.backend.cancelled == [0]
+    assert (client.hedges, client.hedge_wins, client.requests) == (1, 1, 2)
+    assert client.limiter.in_flight == 0
+
+
+def test_fast_primary_is_not_hedged(hedging):
+    client = hedging([(0.0, 'primary')])
+    
+    response = asyncio.run(client.generate('prompt', {}))
+    
+    assert response.text == 'primary'
+    assert client.backend.calls == [o.GEMINI_MODEL]
+    assert client.hedges == 0
+
+
+def test_hedge_without_rate_limit_budget_releases_its_slot(hedging):
+    client = hedging([(0.1, 'primary')], rpm=1)
+    
+    async def _run():
+        response = await client.generate('prompt', {})
+        await _settle()
+        return response
+    
+    response = asyncio.run(_run())
+    
+    assert response.text == 'primary'
+    assert client.hedges == 0
+    assert client.requests == 1
+    assert client.limiter.in_flight == 0
+
+
+def test_primary_failure_waits_for_pending_hedge(hedging):
+    client = hedging([(0.05, o.google_exceptions.ResourceExhausted("429")), (0.2, 'hedge')])
+    
+    async def _run():
+        response = await client.generate('prompt', {})
+        await _settle()
+        return response
+    
+    response = asyncio.run(_run())
+    
+    assert response.text == 'hedge'
+    assert client.backend.cancelled == []
+    assert client.limiter.in_flight == 0
+
+
+def test_both_failing_raise_primary_error(hedging):
+    client = hedging([(0.05, o.google_exceptions.ResourceExhausted("primary")),
+                      (0.0, o.google_exceptions.InternalServerError("hedge"))])
+    
+    async def _run():
+        try:
+            await client.generate('prompt', {})
+        finally:
+            await _settle()
+    
+    with pytest.raises(o.google_exceptions.ResourceExhausted):
+        asyncio.run(_run())
+    assert client.failures == 1
+    assert client.limiter.in_flight == 0
+
+
+def test_caller_cancellation_cancels_primary_and_hedge(hedging):
+    client = hedging([(1.0, 'primary'), (1.0, 'hedge')])
+    
+    async def _run():
+        task = asyncio.ensure_future(client.generate('prompt', {}))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await _settle()
+    
+    asyncio.run(_run())
+    
+    assert sorted(client.backend.cancelled) == [0, 1]
+    assert client.limiter.in_flight == 0
+
+
+def test_record_then_replay_returns_recorded_response(tmp_path):
+    cassette = str(tmp_path / 'cassette' / 'gemini.jsonl')
+    recorder = o.RecordingGeminiBackend(cassette, inner=FakeBackend([(0.0, 'satu'), (0.0, 'dua')]))
+    
+    async def _record():
+        await recorder.generate('model-a', 'prompt', {'temperature': 0.3})
+        await recorder.generate('model-a', 'prompt', {'temperature': 0.3})
+    
+    asyncio.run(_record())
+    replay = o.ReplayGeminiBackend(cassette, latency="0", jitter=0, seed="1")
+    
+    async def _replay():
+        return [(await replay.generate('model-a', 'prompt', {'temperature': 0.3})).text for _ in range(3)]
+    
+    # Rekaman ganda untuk request yang sama diputar bergiliran
+    assert asyncio.run(_replay()) == ['satu', 'dua', 'satu']
+
+
+def test_replay_miss_and_injected_errors(tmp_path):
+    cassette = str(tmp_path / 'empty.jsonl')
+    
+    with pytest.raises(o.CassetteMissError):
+        asyncio.run(o.ReplayGeminiBackend(cassette, latency="0").generate('model-a', 'prompt', {}))
+    
+    synthetic = o.ReplayGeminiBackend(cassette, latency="0", miss="synthetic")
+    assert asyncio.run(synthetic.generate('model-a', 'prompt', {})).text.startswith('[replay]')
+    
+    failing = o.ReplayGeminiBackend(cassette, latency="0", miss="synthetic", error_rate=1.0)
+    with pytest.raises(o.google_exceptions.ResourceExhausted):
+        asyncio.run(failing.generate('model-a', 'prompt', {}))
+
+
+def test_replay_key_includes_model_and_config(tmp_path):
+    cassette = str(tmp_path / 'gemini.jsonl')
+    recorder = o.RecordingGeminiBackend(cassette, inner=FakeBackend([(0.0, 'satu')]))
+    asyncio.run(recorder.generate('model-a', 'prompt', {'temperature': 0.3}))
+    replay = o.ReplayGeminiBackend(cassette, latency="0")
+    
+    with pytest.raises(o.CassetteMissError):
+        asyncio.run(replay.generate('model-b', 'prompt', {'temperature': 0.3}))
+    with pytest.raises(o.CassetteMissError):
+        asyncio.run(replay.generate('model-a', 'prompt', {'temperature': 0.9}))
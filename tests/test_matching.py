@@ -0,0 +1,245 @@
+import os
+
+import pytest
+
+import ocr_processor as o
+
+
+@pytest.fixture
+def stub_identify(monkeypatch):
+    """identify_documents tanpa OCR: hasil diambil dari dict per nama file"""
+    identities = {}
+    
+    def _identify(paths, **kwargs):
+        empty = {'nik': None, 'name': None, 'stage': None, 'nik_labeled': [], 'nik_bare': []}
+        return {path: dict(identities.get(os.path.basename(path), empty), from_cache=False) for path in paths}
+    
+    monkeypatch.setattr(o, 'identify_documents', _identify)
+    monkeypatch.setattr(o, 'ROSTER_INDEX_ENABLED', False)
+    return identities
+
+
+def test_unknown_labeled_cv_nik_does_not_block_name_matching(tmp_path, stub_identify):
+    # NIK KTP 16 digit berlabel di CV bukan NIK karyawan: CV tetap dipasangkan lewat nama
+    stub_identify['CV_Budi Santoso.pdf'] = {'nik': '3201012345670001', 'name': None, 'stage': 'text_layer',
+                                            'nik_labeled': ['3201012345670001'], 'nik_bare': []}
+    stub_identify['Assessment_Budi Santoso.pdf'] = {'nik': '12345', 'name': None, 'stage': 'text_layer',
+                                                    'nik_labeled': ['12345'], 'nik_bare': []}
+    paths = []
+    for filename in stub_identify:
+        path = tmp_path / filename
+        path.write_bytes(filename.encode())
+        paths.append(str(path))
+    
+    matched = o.group_and_match_documents(paths, {'12345': []})
+    
+    assert list(matched) == ['12345_Budi Santoso']
+    person = matched['12345_Budi Santoso']
+    assert person['NIK'] == '12345'
+    assert person['Assessment_filename'] == 'Assessment_Budi Santoso.pdf'
+    assert person['Match_Score'] == pytest.approx(1.0)
+
+
+def test_group_and_match_fills_caller_audit(tmp_path, stub_identify):
+    stub_identify['Assessment_Siti Aminah.pdf'] = {'nik': '222', 'name': None, 'stage': 'text_layer',
+                                                   'nik_labeled': ['222'], 'nik_bare': []}
+    paths = []
+    for filename in ['CV_Siti Aminah.pdf', 'Assessment_Siti Aminah.pdf']:
+        path = tmp_path / filename
+        path.write_bytes(filename.encode())
+        paths.append(str(path))
+    
+    audit = []
+    o.group_and_match_documents(paths, {}, audit)
+    
+    assert audit == [{'nik': '222', 'assessment': 'Assessment_Siti Aminah.pdf', 'cv': 'CV_Siti Aminah.pdf',
+                      'score': 1.0, 'rank': 1, 'chosen': True, 'method': 'nama'}]
+
+
+def test_match_names_locks_exact_pair_before_similar_names():
+    # Greedy memberi "Budi Santosa" ke Assessment pertama dan Assessment kedua tidak dapat pasangan
+    queries = [['Budi Santoso'], ['Budi Santosa']]
+    targets = ['Budi Santosa', 'Budi Santoso Wibowo']
+    
+    pairs, scores = o.match_names(queries, targets)
+    
+    assert sorted((query, target) for query, target, _ in pairs) == [(0, 1), (1, 0)]
+    assert scores[(0, 0)] > scores[(0, 1)]
+
+
+def test_match_names_never_trades_exact_pair_for_higher_total():
+    # Total skor tertinggi adalah (0,1)+(1,0), tetapi (0,0) sama persis
+    queries = [['Budi Santoso'], ['Budi Hartono']]
+    targets = ['Budi Santoso', 'Budi Santoso Wibowo']
+    
+    pairs, _ = o.match_names(queries, targets)
+    
+    assert (0, 0, 1.0) in pairs
+    assert not any(target == 0 for query, target, _ in pairs if query == 1)
+
+
+def test_match_names_threshold_leaves_unmatched():
+    pairs, _ = o.match_names([['Siti Aminah']], ['Siti Aisyah'], threshold=0.95)
+    assert pairs == []
+
+
+def test_name_index_blocks_unrelated_names():
+    index = o.NameIndex(['Budi Santoso', 'Rina Kartika', 'Agus Salim'])
+    
+    assert index.candidates('budi santosa') == {0}
+    assert index.candidates('Xyz') == set()
+    
+    _, scores = o.match_names([['Budi Santosa']], ['Budi Santoso', 'Rina Kartika', 'Agus Salim'])
+    assert set(scores) == {(0, 0)}
+
+
+def test_normalize_person_name_drops_document_words():
+    assert o.normalize_person_name('CV_Budi-Santoso (2)') == 'budi santoso'
+    assert o.normalize_person_name('Assessment Siti Ámínah') == 'siti aminah'
+    assert o.normalize_person_name(None) == ''
+
+
+@pytest.mark.parametrize('value, expected', [
+    (123456.0, '123456'),
+    ('123456.0', '123456'),
+    (' 12.34-56 ', '123456'),
+    (123456, '123456'),
+    (float('nan'), None),
+    (None, None),
+    ('', None),
+    ('abc', None),
+])
+def test_normalize_nik(value, expected):
+    assert o.normalize_nik(value) == expected
+
+
+def test_extract_nik_candidates_separates_labeled_and_bare():
+    labeled, bare = o.extract_nik_candidates("Nama: Budi\nNIK : 870012\nHP 081234567890")
+    assert labeled == ['870012']
+    assert bare == ['081234567890']
+    
+    labeled, bare = o.extract_nik_candidates(o._nik_text_from_filename('CV_Budi_NIK_870099.pdf'))
+    assert labeled == ['870099']
+    assert bare == []
+
+
+def test_resolve_nik_priorities():
+    known = {'870055'}
+    # Angka lepas yang dikenal mengalahkan label yang tidak dikenal
+    assert o.resolve_nik(['3201012345670001'], ['870055'], known) == '870055'
+    # Angka lepas yang tidak dikenal (mis. nomor HP) tidak pernah dipakai
+    assert o.resolve_nik([], ['081234567890'], known) is None
+    assert o.resolve_nik(['3201012345670001'], [], known) == '3201012345670001'
+    assert o.resolve_nik(['3201012345670001'], [], known, require_known=True) is None
+
+
+@pytest.fixture
+def fake_page_ocr(monkeypatch, tmp_path):
+    """OCR identifikasi tanpa tesseract/poppler: teks header dan halaman penuh dari dict"""
+    from PIL import Image
+    texts = {}
+    calls = []
+    
+    def _render(pdf_path, page_number, dpi, grayscale, output_dir):
+        path = os.path.join(output_dir, f"page_{page_number}.png")
+        Image.new('L', (100, 100), 255).save(path)
+        return path
+    
+    def _tesseract(image, lang='ind', psm=6):
+        calls.append('header')
+        return texts.get('header', '')
+    
+    def _ocr_page(pdf_path, page_number, options):
+        calls.append('page')
+        return {'text': texts.get('page', ''), 'from_cache': False}
+    
+    monkeypatch.setattr(o, '_extract_text_layer_pages', lambda pdf_path, max_pages: [])
+    monkeypatch.setattr(o, 'is_tesseract_available', lambda: True)
+    monkeypatch.setattr(o, '_get_pdf_page_count', lambda pdf_path: 1)
+    monkeypatch.setattr(o, '_render_pdf_page', _render)
+    monkeypatch.setattr(o, 'tesseract_image_to_string', _tesseract)
+    monkeypatch.setattr(o, '_ocr_pdf_page', _ocr_page)
+    monkeypatch.setattr(o, 'OCR_RENDER_DIR', str(tmp_path))
+    return texts, calls
+
+
+def test_bare_number_in_header_does_not_stop_identification(fake_page_ocr):
+    texts, calls = fake_page_ocr
+    texts['header'] = "LAPORAN ASSESSMENT\nNo. Peserta 2024001234"
+    texts['page'] = texts['header'] + "\nNama : Budi Santoso\nNIK : 870012"
+    
+    identity = o._identify_pdf_document('Assessment_Budi.pdf')
+    
+    assert calls == ['header', 'page']
+    assert identity['nik'] == '870012'
+    assert identity['stage'] == 'page_1'
+
+
+def test_known_bare_number_in_header_stops_identification(fake_page_ocr):
+    texts, calls = fake_page_ocr
+    texts['header'] = "LAPORAN ASSESSMENT\nBudi Santoso 870012"
+    
+    identity = o._identify_pdf_document('Assessment_Budi.pdf', known_niks={'870012'})
+    
+    assert calls == ['header']
+    assert identity['nik'] == '870012'
+
+
+def test_bare_number_is_only_a_last_resort(fake_page_ocr):
+    texts, _ = fake_page_ocr
+    texts['header'] = "CURRICULUM VITAE\nHP 081234567890"
+    
+    identity = o._identify_pdf_document('CV_Budi.pdf')
+    
+    assert identity['nik'] == '081234567890'
+    assert identity['stage'] == 'header'
+
+
+@pytest.fixture
+def roster(tmp_path, monkeypatch, stub_identify):
+    """Roster index di tmp_path, aktif untuk group_and_match_documents"""
+    index = o.RosterIndex(str(tmp_path / 'roster' / 'roster.sqlite3'), str(tmp_path / 'roster' / 'documents'))
+    monkeypatch.setattr(o, 'ROSTER_INDEX', index)
+    monkeypatch.setattr(o, 'ROSTER_INDEX_ENABLED', True)
+    monkeypatch.setattr(o, 'ROSTER_NAME_MATCH_THRESHOLD', 0.0)
+    return index
+
+
+def _upload(directory, *filenames):
+    directory.mkdir()
+    paths = []
+    for filename in filenames:
+        path = directory / filename
+        path.write_bytes(f"{directory.name}/{filename}".encode())
+        paths.append(str(path))
+    return paths
+
+
+def test_roster_links_cv_from_previous_run_by_unique_name(tmp_path, roster, stub_identify):
+    # Minggu 1: CV saja (tanpa NIK); minggu 2: Assessment dengan NIK
+    o.group_and_match_documents(_upload(tmp_path / 'week1', 'CV_Budi Santoso.pdf', 'CV_Rina Kartika.pdf'), {})
+    
+    stub_identify['Assessment_Budi Santoso.pdf'] = {'nik': '12345', 'name': None, 'stage': 'text_layer',
+                                                    'nik_labeled': ['12345'], 'nik_bare': []}
+    audit = []
+    matched = o.group_and_match_documents(_upload(tmp_path / 'week2', 'Assessment_Budi Santoso.pdf'),
+                                          {'12345': []}, audit)
+    
+    person = matched['12345_Budi Santoso']
+    assert person['CV_filename'] == 'CV_Budi Santoso.pdf'
+    assert person['Assessment_filename'] == 'Assessment_Budi Santoso.pdf'
+    assert [row['method'] for row in audit] == ['roster_nama_unik']
+
+
+def test_roster_skips_ambiguous_names(tmp_path, roster, stub_identify):
+    o.group_and_match_documents(_upload(tmp_path / 'week1', 'CV_Budi Santoso.pdf'), {})
+    o.group_and_match_documents(_upload(tmp_path / 'week1b', 'CV_Budi_Santoso.pdf'), {})
+    
+    stub_identify['Assessment_Budi Santoso.pdf'] = {'nik': '12345', 'name': None, 'stage': 'text_layer',
+                                                    'nik_labeled': ['12345'], 'nik_bare': []}
+    audit = []
+    matched = o.group_and_match_documents(_upload(tmp_path / 'week2', 'Assessment_Budi Santoso.pdf'),
+                                          {'12345': []}, audit)
+    
+    assert not any(person['CV'] and person['Assessment'] for person in matched.values())
+    assert not any(row['method'].startswith('roster') for row in audit)
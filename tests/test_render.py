@@ -0,0 +1,121 @@
+import os
+
+import pytest
+from PIL import Image
+
+import ocr_processor as o
+
+
+@pytest.fixture
+def full_tmpfs(tmp_path, monkeypatch):
+    """tmpfs palsu yang selalu penuh: render di sana meninggalkan file PGM terpotong"""
+    tmpfs = tmp_path / 'shm'
+    tmpfs.mkdir()
+    monkeypatch.setattr(o, 'OCR_RENDER_DIR', None)
+    monkeypatch.setattr(o, 'OCR_RENDER_TMPFS', str(tmpfs))
+    monkeypatch.setattr(o, 'OCR_RENDER_MIN_FREE_MB', 0)
+    monkeypatch.setattr(o, '_RENDER_TMPFS_FAILED', False)
+    
+    def _render(pdf_path, page_number, dpi, grayscale, render_dir):
+        path = os.path.join(render_dir, f"page-{page_number}.pgm")
+        Image.new('L', (50, 40), 255).save(path)
+        if render_dir.startswith(str(tmpfs)):
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) // 2)
+        return path
+    
+    monkeypatch.setattr(o, '_render_pdf_page', _render)
+    return tmpfs
+
+
+def test_render_retries_on_disk_when_tmpfs_write_fails(full_tmpfs):
+    with o.RenderWorkspace("ocr_test_") as workspace:
+        image_path = workspace.render('a.pdf', 1, 150, True)
+        
+        assert not image_path.startswith(str(full_tmpfs))
+        with Image.open(image_path) as image:
+            assert image.size == (50, 40)
+    
+    assert not os.path.exists(image_path)
+    assert o._RENDER_TMPFS_FAILED
+    assert o._render_base_dir() is None
+
+
+def test_tmpfs_skipped_when_free_space_is_low(full_tmpfs, monkeypatch):
+    monkeypatch.setattr(o, 'OCR_RENDER_MIN_FREE_MB', 10 ** 9)
+    assert o._render_base_dir() is None
+
+
+def _page(dpi, lines=0, fill=0, text="Nama: Budi Santoso, Jakarta 2019 - sekarang"):
+    """Halaman A4 putih dengan beberapa baris teks berwarna abu-abu fill"""
+    from PIL import ImageDraw, ImageFont
+    image = Image.new('L', (int(8.27 * dpi), int(11.69 * dpi)), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=max(4, int(dpi * 11 / 72)))
+    for line in range(lines):
+        draw.text((dpi, dpi + line * int(dpi / 4)), text, fill=fill, font=font)
+    return image
+
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    """convert_from_path palsu: pages[(halaman, 'thumb'|'full')] -> fungsi dpi -> Image"""
+    pages = {}
+    
+    def _convert(pdf_path, dpi, first_page, last_page, **kwargs):
+        kind = 'thumb' if dpi == o.OCR_THUMBNAIL_DPI else 'full'
+        return [pages[(page, kind)](dpi) for page in range(first_page, last_page + 1)]
+    
+    monkeypatch.setattr(o, 'convert_from_path', _convert)
+    monkeypatch.setattr(o, 'OCR_NEAR_DUPLICATES', False)
+    return pages
+
+
+@pytest.mark.parametrize('lines, fill', [(5, 150), (1, 110)])
+def test_faint_text_is_not_blank_on_thumbnail(lines, fill):
+    fingerprint = o._page_fingerprint(_page(o.OCR_THUMBNAIL_DPI, lines, fill))
+    assert fingerprint['ink'] >= o.OCR_BLANK_INK_RATIO
+
+
+def test_blank_thumbnail_is_confirmed_at_working_dpi(fake_pages):
+    for page in (1, 2):
+        fake_pages[(page, 'thumb')] = lambda dpi: _page(dpi)
+    fake_pages[(1, 'full')] = lambda dpi: _page(dpi)
+    fake_pages[(2, 'full')] = lambda dpi: _page(dpi, 1, 200)
+    
+    unique_pages, blank_pages, duplicates = o.classify_pdf_pages('a.pdf', [1, 2])
+    
+    assert blank_pages == [1]
+    assert unique_pages == [2]
+    assert duplicates == {}
+
+
+def test_identical_thumbnails_need_identical_pages(fake_pages):
+    for page in (1, 2, 3):
+        fake_pages[(page, 'thumb')] = lambda dpi: _page(dpi, 3, 0)
+    fake_pages[(1, 'full')] = lambda dpi: _page(dpi, 3, 0)
+    fake_pages[(2, 'full')] = lambda dpi: _page(dpi, 3, 0, text="Nama: Budi Santosa, Jakarta 2019 - sekarang")
+    fake_pages[(3, 'full')] = lambda dpi: _page(dpi, 3, 0)
+    
+    unique_pages, blank_pages, duplicates = o.classify_pdf_pages('a.pdf', [1, 2, 3])
+    
+    assert unique_pages == [1, 2]
+    assert blank_pages == []
+    assert duplicates == {3: 1}
+
+
+def test_reset_ocr_pool_keeps_replacement_pool(monkeypatch):
+    class _Pool:
+        shut_down = False
+        
+        def shutdown(self, wait=True):
+            self.shut_down = True
+    
+    broken, replacement = _Pool(), _Pool()
+    monkeypatch.setattr(o, '_OCR_POOL', replacement)
+    
+    assert not o._reset_ocr_pool(broken_pool=broken)
+    assert o._OCR_POOL is replacement and not replacement.shut_down
+    
+    assert o._reset_ocr_pool(broken_pool=replacement)
+    assert o._OCR_POOL is None and replacement.shut_down
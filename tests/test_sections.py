@@ -0,0 +1,75 @@
+import pytest
+
+import ocr_processor as o
+
+
+CV = """=== CV ===
+Budi Santoso
+Jakarta
+
+PENGALAMAN KERJA
+PT Maju Jaya (2018 - sekarang)
+Project Manager
+Memimpin implementasi ERP di 12 cabang dan menurunkan biaya operasional 15%.
+PT Sinar Abadi (2014 - 2018)
+Training Manager
+Menyusun kurikulum pelatihan kepemimpinan untuk 300 supervisor.
+PT Karya Utama (2010 - 2014)
+Training Coordinator
+Mengkoordinasikan program onboarding karyawan baru.
+
+PENDIDIKAN
+S1 Teknik Industri, Institut Teknologi Bandung
+
+Keahlian:
+Microsoft Excel, SAP"""
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('PENGALAMAN KERJA', 'experience'),
+    ('Pendidikan:', 'education'),
+    ('2. Riwayat Pekerjaan', 'experience'),
+    ('• Penghargaan', 'achievements'),
+    ('Project Manager', None),
+    ('Training Manager', None),
+    ('Training Coordinator', None),
+    ('Education Consultant', None),
+    ('Awards Committee Member', None),
+])
+def test_match_section_heading_requires_whole_line(line, expected):
+    assert o._match_section_heading(line) == expected
+
+
+def test_job_titles_stay_in_experience_section():
+    sections = o.segment_document_sections(CV)
+    
+    assert [section for _, section, _ in sections] == ['header', 'experience', 'education', 'other']
+    experience = sections[1][2]
+    assert 'PT Karya Utama' in experience
+    assert 'Training Coordinator' in experience
+
+
+def test_same_kind_heading_does_not_split_section():
+    text = "=== CV ===\nPengalaman Kerja\nPT A\nRiwayat Jabatan\nPT B\nPendidikan\nS1"
+    
+    sections = o.segment_document_sections(text)
+    
+    assert [section for _, section, _ in sections] == ['experience', 'education']
+    assert 'PT B' in sections[0][2]
+
+
+def test_experience_context_keeps_all_jobs(monkeypatch):
+    monkeypatch.setattr(o, 'GEMINI_SECTION_CONTEXT', True)
+    
+    context = o._context_for_category('experience', CV)
+    
+    assert 'PT Karya Utama' in context
+    assert 'S1 Teknik Industri' not in context
+
+
+def test_small_context_falls_back_to_full_text(monkeypatch):
+    monkeypatch.setattr(o, 'GEMINI_SECTION_CONTEXT', True)
+    monkeypatch.setattr(o, 'SECTION_CONTEXT_MIN_CHARS', 0)
+    text = "=== CV ===\nPendidikan\nS1\nKeahlian\n" + "Excel, SAP, Power BI\n" * 20
+    
+    assert o._context_for_category('education', text) == text
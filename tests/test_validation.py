@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import pytest
+
+import ocr_processor as o
+
+
+SUMMARY = ("Berdasarkan pengalaman lebih dari 15 tahun di bidang human capital, kandidat memimpin "
+           "transformasi organisasi dan pengembangan talenta di beberapa unit bisnis.")
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """generate_gemini_text_async tanpa API: jawaban diambil berurutan dari list"""
+    answers = []
+    prompts = []
+    
+    async def _generate(prompt, *args, **kwargs):
+        prompts.append(prompt)
+        return answers.pop(0)
+    
+    monkeypatch.setattr(o, 'generate_gemini_text_async', _generate)
+    return answers, prompts
+
+
+def test_single_paragraph_starting_with_preamble_word_is_content():
+    assert o.validate_ai_field('summary_executive', SUMMARY) == []
+    assert o.repair_ai_field('summary_executive', SUMMARY) == SUMMARY
+
+
+def test_repair_drops_real_preamble_only():
+    assert o.repair_ai_field('summary_executive', "Berikut ringkasannya:\n\n" + SUMMARY) == SUMMARY
+    assert o.repair_ai_field('summary_executive', "Berikut ringkasannya:") == "Berikut ringkasannya:"
+
+
+def test_summary_is_not_reasked_or_emptied(fake_gemini):
+    answers, prompts = fake_gemini
+    answers.append(SUMMARY)
+    
+    text = asyncio.run(o.generate_validated_text_async('summary_executive', 'prompt', {}))
+    
+    assert text == SUMMARY
+    assert len(prompts) == 1
+
+
+def test_exhausted_retries_keep_best_non_empty_answer(fake_gemini, monkeypatch):
+    monkeypatch.setattr(o, 'GEMINI_VALIDATION_RETRIES', 2)
+    answers, _ = fake_gemini
+    answers.extend(["• satu\n• dua\n• tiga", "• satu\n• dua\n• tiga\n• empat panjang sekali melebihi batas kata per bullet ini", ""])
+    
+    text = asyncio.run(o.generate_validated_text_async('business_impact', 'prompt', {}))
+    
+    assert text == "• satu\n• dua\n• tiga"
+
+
+def test_invalid_competency_falls_back_to_local_format(fake_gemini, monkeypatch):
+    monkeypatch.setattr(o, 'GEMINI_VALIDATION_RETRIES', 1)
+    answers, _ = fake_gemini
+    answers.extend(["Kompetensi kandidat cukup baik.", "Kompetensi kandidat cukup baik."])
+    competencies = [{'competency': 'Human Capital Strategy', 'level': 4},
+                    {'competency': 'Talent Scouting & Acquisition', 'level': 2}]
+    
+    text = asyncio.run(o.generate_competency_with_ai_async(competencies, use_cache=False))
+    
+    assert text == o.format_competency_local(competencies)
+
+
+STRUCTURED = {
+    'education': "S1 Teknik Industri, Institut Teknologi Bandung (2005)",
+    'position': "HR Business Partner",
+    'summary_executive': SUMMARY,
+}
+
+
+def test_structured_mode_answers_all_fields_in_one_request(fake_gemini):
+    answers, prompts = fake_gemini
+    answers.append(json.dumps(STRUCTURED))
+    
+    results = asyncio.run(o.analyze_with_gemini_async('teks', categories=list(STRUCTURED), mode='structured'))
+    
+    assert results == STRUCTURED
+    assert len(prompts) == 1
+
+
+def test_structured_mode_asks_only_invalid_fields_again(fake_gemini):
+    answers, prompts = fake_gemini
+    # position melanggar format (lebih dari satu baris), education hilang dari JSON
+    answers.append(json.dumps({'position': "HR Business Partner\nPT Maju Jaya",
+                               'summary_executive': STRUCTURED['summary_executive']}))
+    answers.extend([STRUCTURED['education'], STRUCTURED['position']])
+    
+    results = asyncio.run(o.analyze_with_gemini_async('teks', categories=list(STRUCTURED), mode='structured'))
+    
+    assert results == STRUCTURED
+    assert len(prompts) == 3
+    assert prompts[1].startswith(o.ANALYSIS_PROMPTS['education'])
+    assert prompts[2].startswith(o.ANALYSIS_PROMPTS['position'])
+
+
+def test_structured_mode_falls_back_on_non_json(fake_gemini):
+    answers, prompts = fake_gemini
+    answers.extend(["bukan JSON", STRUCTURED['education'], STRUCTURED['position']])
+    
+    results = asyncio.run(o.analyze_with_gemini_async('teks', categories=['education', 'position'], mode='structured'))
+    
+    assert results == {'education': STRUCTURED['education'], 'position': STRUCTURED['position']}
+    assert len(prompts) == 3
+
+
+COMPETENCIES = {
+    '111': [{'competency': 'Human Capital Strategy', 'level': 4}, {'competency': 'Talent Scouting & Acquisition', 'level': 2}],
+    '222': [{'competency': 'Industrial Relations Management', 'level': 3}],
+    '333': [{'competency': 'Learning Management & Development', 'level': 5}],
+}
+
+
+def test_competency_batch_splits_requests_and_falls_back_per_nik(fake_gemini, monkeypatch):
+    monkeypatch.setattr(o, 'COMPETENCY_BATCH_SIZE', 2)
+    answers, prompts = fake_gemini
+    answers.append(json.dumps({'111': "• Human Capital Strategy (Lvl. 4/5)\n• Talent Scouting & Acquisition (Lvl. 2/5)",
+                               '222': "Kompetensi cukup baik."}))
+    answers.append("bukan JSON")
+    
+    results = asyncio.run(o.generate_competency_batch_async(dict(COMPETENCIES, **{'444': []})))
+    
+    assert len(prompts) == 2
+    assert 'NIK 111' in prompts[0] and 'NIK 333' in prompts[1]
+    assert results == {
+        '111': "• Human Capital Strategy (Lvl. 4/5)\n• Talent Scouting & Acquisition (Lvl. 2/5)",
+        '222': o.format_competency_local(COMPETENCIES['222']),
+        '333': o.format_competency_local(COMPETENCIES['333']),
+    }
+
+
+def test_local_competency_mode_makes_no_request(fake_gemini):
+    _, prompts = fake_gemini
+    
+    text = asyncio.run(o.format_competencies_async(COMPETENCIES['111'], mode='local'))
+    
+    assert text == o.format_competency_local(COMPETENCIES['111'])
+    assert prompts == []